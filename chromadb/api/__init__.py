@@ -336,6 +336,7 @@ class BaseAPI(ABC):
         page_size: Optional[int] = None,
         where_document: Optional[WhereDocument] = {},
         include: Include = ["embeddings", "metadatas", "documents"],
+        after: Optional[str] = None,
     ) -> GetResult:
         """[Internal] Returns entries from a collection specified by UUID.
 
@@ -350,6 +351,8 @@ class BaseAPI(ABC):
             where_document: Conditional filtering on documents. Defaults to {}.
             include: The fields to include in the response.
                           Defaults to ["embeddings", "metadatas", "documents"].
+            after: The next_cursor of a previous result, to return the entries
+                   after it. Defaults to None.
         Returns:
             GetResult: The entries in the collection that match the query.
 
@@ -386,6 +389,7 @@ class BaseAPI(ABC):
         where: Where = {},
         where_document: WhereDocument = {},
         include: Include = ["embeddings", "metadatas", "documents", "distances"],
+        max_distance: Optional[float] = None,
     ) -> QueryResult:
         """[Internal] Performs a nearest neighbors query on a collection specified by UUID.
 
@@ -397,6 +401,8 @@ class BaseAPI(ABC):
             where_document: Conditional filtering on documents. Defaults to {}.
             include: The fields to include in the response.
                           Defaults to ["embeddings", "metadatas", "documents", "distances"].
+            max_distance: Only return the results within this distance of their
+                          query embedding. Defaults to None, for no limit.
 
         Returns:
             QueryResult: The results of the query.
@@ -516,6 +522,25 @@ class AdminAPI(ABC):
         """
         pass
 
+    @abstractmethod
+    def compact_collection(
+        self,
+        name: str,
+        tenant: str = DEFAULT_TENANT,
+        database: str = DEFAULT_DATABASE,
+    ) -> None:
+        """Rebuild the vector index of a collection from its live embeddings,
+        reclaiming the space and search time spent on deleted ones. Reads and writes
+        to the collection continue while the index is rebuilt.
+
+        Args:
+            name: The name of the collection to compact.
+            tenant: The tenant of the collection.
+            database: The database of the collection.
+
+        """
+        pass
+
 
 class ServerAPI(BaseAPI, AdminAPI, Component):
     """An API instance that extends the relevant Base API methods by passing
@@ -354,6 +354,7 @@ class Client(SharedSystemClient, ClientAPI):
         page_size: Optional[int] = None,
         where_document: Optional[WhereDocument] = {},
         include: Include = ["embeddings", "metadatas", "documents"],
+        after: Optional[str] = None,
     ) -> GetResult:
         return self._server._get(
             collection_id=collection_id,
@@ -366,6 +367,7 @@ class Client(SharedSystemClient, ClientAPI):
             page_size=page_size,
             where_document=where_document,
             include=include,
+            after=after,
         )
 
     def _delete(
@@ -391,6 +393,7 @@ class Client(SharedSystemClient, ClientAPI):
         where: Where = {},
         where_document: WhereDocument = {},
         include: Include = ["embeddings", "metadatas", "documents", "distances"],
+        max_distance: Optional[float] = None,
     ) -> QueryResult:
         return self._server._query(
             collection_id=collection_id,
@@ -399,6 +402,7 @@ class Client(SharedSystemClient, ClientAPI):
             where=where,
             where_document=where_document,
             include=include,
+            max_distance=max_distance,
         )
 
     @override
@@ -485,6 +489,17 @@ class AdminClient(SharedSystemClient, AdminAPI):
     def get_tenant(self, name: str) -> Tenant:
         return self._server.get_tenant(name=name)
 
+    @override
+    def compact_collection(
+        self,
+        name: str,
+        tenant: str = DEFAULT_TENANT,
+        database: str = DEFAULT_DATABASE,
+    ) -> None:
+        return self._server.compact_collection(
+            name=name, tenant=tenant, database=database
+        )
+
     @classmethod
     @override
     def from_system(
@@ -186,6 +186,20 @@ class FastAPI(ServerAPI):
         resp_json = json.loads(resp.text)
         return Tenant(name=resp_json["name"])
 
+    @trace_method("FastAPI.compact_collection", OpenTelemetryGranularity.OPERATION)
+    @override
+    def compact_collection(
+        self,
+        name: str,
+        tenant: str = DEFAULT_TENANT,
+        database: str = DEFAULT_DATABASE,
+    ) -> None:
+        resp = self._session.post(
+            self._api_url + "/collections/" + name + "/compact",
+            params={"tenant": tenant, "database": database},
+        )
+        raise_chroma_error(resp)
+
     @trace_method("FastAPI.list_collections", OpenTelemetryGranularity.OPERATION)
     @override
     def list_collections(
@@ -398,6 +412,7 @@ class FastAPI(ServerAPI):
         page_size: Optional[int] = None,
         where_document: Optional[WhereDocument] = {},
         include: Include = ["metadatas", "documents"],
+        after: Optional[str] = None,
     ) -> GetResult:
         if page and page_size:
             offset = (page - 1) * page_size
@@ -414,6 +429,7 @@ class FastAPI(ServerAPI):
                     "offset": offset,
                     "where_document": where_document,
                     "include": include,
+                    "after": after,
                 }
             ),
         )
@@ -428,6 +444,7 @@ class FastAPI(ServerAPI):
             data=None,
             uris=body.get("uris", None),
             included=body["included"],
+            next_cursor=body.get("next_cursor", None),
         )
 
     @trace_method("FastAPI._delete", OpenTelemetryGranularity.OPERATION)
@@ -556,6 +573,7 @@ class FastAPI(ServerAPI):
         where: Optional[Where] = {},
         where_document: Optional[WhereDocument] = {},
         include: Include = ["metadatas", "documents", "distances"],
+        max_distance: Optional[float] = None,
     ) -> QueryResult:
         """Gets the nearest neighbors of a single embedding"""
         resp = self._session.post(
@@ -567,6 +585,7 @@ class FastAPI(ServerAPI):
                     "where": where,
                     "where_document": where_document,
                     "include": include,
+                    "max_distance": max_distance,
                 }
             ),
         )
@@ -43,6 +43,7 @@ from chromadb.api.types import (
     validate_where,
     validate_where_document,
     validate_n_results,
+    validate_max_distance,
     validate_embeddings,
     validate_embedding_function,
 )
@@ -175,6 +176,7 @@ class Collection(BaseModel):
         offset: Optional[int] = None,
         where_document: Optional[WhereDocument] = None,
         include: Include = ["metadatas", "documents"],
+        after: Optional[str] = None,
     ) -> GetResult:
         """Get embeddings and their associate data from the data store. If no ids or where filter is provided returns
         all embeddings up to limit starting at offset.
@@ -186,9 +188,10 @@ class Collection(BaseModel):
             offset: The offset to start returning results from. Useful for paging results with limit. Optional.
             where_document: A WhereDocument type dict used to filter by the documents. E.g. `{$contains: {"text": "hello"}}`. Optional.
             include: A list of what to include in the results. Can contain `"embeddings"`, `"metadatas"`, `"documents"`. Ids are always included. Defaults to `["metadatas", "documents"]`. Optional.
+            after: The `next_cursor` of a previous result, to return the embeddings after it. Unlike offset, paging with it does not get slower with each page. Optional.
 
         Returns:
-            GetResult: A GetResult object containing the results.
+            GetResult: A GetResult object containing the results. If limit was reached, its `next_cursor` can be passed as `after` to get the next page.
 
         """
 
@@ -217,6 +220,7 @@ class Collection(BaseModel):
             offset,
             where_document=valid_where_document,
             include=valid_include,
+            after=after,
         )
 
         if (
@@ -258,6 +262,7 @@ class Collection(BaseModel):
         where: Optional[Where] = None,
         where_document: Optional[WhereDocument] = None,
         include: Include = ["metadatas", "documents", "distances"],
+        max_distance: Optional[float] = None,
     ) -> QueryResult:
         """Get the n_results nearest neighbor embeddings for provided query_embeddings or query_texts.
 
@@ -269,6 +274,7 @@ class Collection(BaseModel):
             where: A Where type dict used to filter results by. E.g. `{"$and": ["color" : "red", "price": {"$gte": 4.20}]}`. Optional.
             where_document: A WhereDocument type dict used to filter by the documents. E.g. `{$contains: {"text": "hello"}}`. Optional.
             include: A list of what to include in the results. Can contain `"embeddings"`, `"metadatas"`, `"documents"`, `"distances"`. Ids are always included. Defaults to `["metadatas", "documents", "distances"]`. Optional.
+            max_distance: Only return the neighbors within this distance of their query, up to n_results of them. Optional.
 
         Returns:
             QueryResult: A QueryResult object containing the results.
@@ -320,6 +326,9 @@ class Collection(BaseModel):
         )
         valid_include = validate_include(include, allow_distances=True)
         valid_n_results = validate_n_results(n_results)
+        valid_max_distance = (
+            validate_max_distance(max_distance) if max_distance is not None else None
+        )
 
         # If query_embeddings are not provided, we need to compute them from the inputs
         if valid_query_embeddings is None:
@@ -349,6 +358,7 @@ class Collection(BaseModel):
             where=valid_where,
             where_document=valid_where_document,
             include=include,
+            max_distance=valid_max_distance,
         )
 
         if (
@@ -0,0 +1,110 @@
+import hashlib
+import json
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+
+from chromadb.api.types import Embeddings, Include, QueryResult
+from chromadb.types import SeqId, Where, WhereDocument
+from chromadb.utils.lru_cache import LRUCache
+
+QueryKey = Tuple[Hashable, ...]
+
+
+class QueryResultCache:
+    """A bounded LRU cache of query results. Each result is stored with the versions,
+    the max_seqids, of the segments it was read from, and is only returned while they
+    are unchanged: any write to the collection makes its cached results stale."""
+
+    _lock: Lock
+    _cache: LRUCache[QueryKey, Tuple[Tuple[SeqId, ...], QueryResult]]
+    hits: int
+    misses: int
+
+    def __init__(self, capacity: int):
+        self._lock = Lock()
+        self._cache = LRUCache(capacity)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(
+        collection_id: UUID,
+        query_embeddings: Embeddings,
+        n_results: int,
+        where: Optional[Where],
+        where_document: Optional[WhereDocument],
+        include: Include,
+        max_distance: Optional[float],
+    ) -> QueryKey:
+        """Build the cache key of a query. The query embeddings are hashed, as
+        float32 like the indexes store them."""
+        embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        digest = hashlib.blake2b(embeddings.tobytes(), digest_size=16).digest()
+        return (
+            collection_id,
+            embeddings.shape,
+            digest,
+            n_results,
+            json.dumps(where, sort_keys=True),
+            json.dumps(where_document, sort_keys=True),
+            tuple(include),
+            max_distance,
+        )
+
+    def get(self, key: QueryKey, versions: Tuple[SeqId, ...]) -> Optional[QueryResult]:
+        """Return a copy of the result cached for the key, if it was read at the given
+        segment versions"""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] != versions:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return _copy_result(entry[1])
+
+    def set(
+        self, key: QueryKey, versions: Tuple[SeqId, ...], result: QueryResult
+    ) -> None:
+        """Cache a copy of the result of a query read at the given segment versions"""
+        with self._lock:
+            self._cache.set(key, (versions, _copy_result(result)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """The hit and miss counts and the number of cached results"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache.cache),
+            }
+
+
+def _copy_result(result: QueryResult) -> QueryResult:
+    """Copy the lists of a result down to the metadata dicts and embeddings they hold,
+    so that callers can modify the one they get"""
+    copy = dict(result)
+    for field, value in result.items():
+        if isinstance(value, list):
+            copy[field] = [
+                [_copy_value(item) for item in row] if isinstance(row, list) else row
+                for row in value
+            ]
+    return copy  # type: ignore[return-value]
+
+
+def _copy_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        # Metadata values are scalars
+        return dict(value)
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, list):
+        return list(value)
+    return value
@@ -15,6 +15,7 @@ from chromadb.telemetry.opentelemetry import (
 from chromadb.telemetry.product import ProductTelemetryClient
 from chromadb.ingest import Producer
 from chromadb.api.models.Collection import Collection
+from chromadb.api.query_cache import QueryKey, QueryResultCache
 from chromadb import __version__
 from chromadb.errors import InvalidDimensionException, InvalidCollectionException
 import chromadb.utils.embedding_functions as ef
@@ -43,6 +44,9 @@ from chromadb.api.types import (
     validate_where,
     validate_where_document,
     validate_batch,
+    validate_max_distance,
+    decode_cursor,
+    encode_cursor,
 )
 from chromadb.telemetry.product.events import (
     CollectionAddEvent,
@@ -54,9 +58,10 @@ from chromadb.telemetry.product.events import (
 )
 
 import chromadb.types as t
-from typing import Any, Optional, Sequence, Generator, List, cast, Set, Dict
+from typing import Any, Optional, Sequence, Generator, List, cast, Set, Dict, Tuple
 from overrides import override
 from uuid import UUID, uuid4
+import numpy as np
 import time
 import logging
 import re
@@ -97,6 +102,7 @@ class SegmentAPI(ServerAPI):
     _tenant_id: str
     _topic_ns: str
     _collection_cache: Dict[UUID, t.Collection]
+    _query_cache: Optional[QueryResultCache]
 
     def __init__(self, system: System):
         super().__init__(system)
@@ -108,6 +114,11 @@ class SegmentAPI(ServerAPI):
         self._opentelemetry_client = self.require(OpenTelemetryClient)
         self._producer = self.require(Producer)
         self._collection_cache = {}
+        self._query_cache = (
+            QueryResultCache(system.settings.chroma_query_cache_size)
+            if system.settings.chroma_query_cache_size > 0
+            else None
+        )
 
     @override
     def heartbeat(self) -> int:
@@ -145,6 +156,25 @@ class SegmentAPI(ServerAPI):
     def get_tenant(self, name: str) -> t.Tenant:
         return self._sysdb.get_tenant(name=name)
 
+    @trace_method("SegmentAPI.compact_collection", OpenTelemetryGranularity.OPERATION)
+    @override
+    def compact_collection(
+        self,
+        name: str,
+        tenant: str = DEFAULT_TENANT,
+        database: str = DEFAULT_DATABASE,
+    ) -> None:
+        existing = self._sysdb.get_collections(
+            name=name, tenant=tenant, database=database
+        )
+        if not existing:
+            raise ValueError(f"Collection {name} does not exist.")
+        collection_id = existing[0]["id"]
+        add_attributes_to_current_span({"collection_id": str(collection_id)})
+
+        vector_segment = self._manager.get_segment(collection_id, VectorReader)
+        vector_segment.compact()
+
     # TODO: Actually fix CollectionMetadata type to remove type: ignore flags. This is
     # necessary because changing the value type from `Any` to`` `Union[str, int, float]`
     # causes the system to somehow convert all values to strings.
@@ -492,6 +522,7 @@ class SegmentAPI(ServerAPI):
         page_size: Optional[int] = None,
         where_document: Optional[WhereDocument] = {},
         include: Include = ["embeddings", "metadatas", "documents"],
+        after: Optional[str] = None,
     ) -> GetResult:
         add_attributes_to_current_span(
             {
@@ -508,6 +539,7 @@ class SegmentAPI(ServerAPI):
             if where_document is not None and len(where_document) > 0
             else None
         )
+        after_id = decode_cursor(after) if after is not None else None
 
         metadata_segment = self._manager.get_segment(collection_id, MetadataReader)
 
@@ -524,6 +556,7 @@ class SegmentAPI(ServerAPI):
             ids=ids,
             limit=limit,
             offset=offset,
+            after=after_id,
         )
 
         if len(records) == 0:
@@ -536,6 +569,7 @@ class SegmentAPI(ServerAPI):
                 uris=[] if "uris" in include else None,
                 data=[] if "data" in include else None,
                 included=include,
+                next_cursor=None,
             )
 
         vectors: Sequence[t.VectorEmbeddingRecord] = []
@@ -570,7 +604,7 @@ class SegmentAPI(ServerAPI):
 
         return GetResult(
             ids=[r["id"] for r in records],
-            embeddings=[r["embedding"] for r in vectors]
+            embeddings=[_embedding(r["embedding"]) for r in vectors]
             if "embeddings" in include
             else None,
             metadatas=_clean_metadatas(metadatas)
@@ -580,6 +614,10 @@ class SegmentAPI(ServerAPI):
             uris=uris if "uris" in include else None,  # type: ignore
             data=None,
             included=include,
+            # A full page may be followed by more records
+            next_cursor=encode_cursor(records[-1]["id"])
+            if limit is not None and len(records) == limit
+            else None,
         )
 
     @trace_method("SegmentAPI._delete", OpenTelemetryGranularity.OPERATION)
@@ -671,6 +709,7 @@ class SegmentAPI(ServerAPI):
         where: Where = {},
         where_document: WhereDocument = {},
         include: Include = ["documents", "metadatas", "distances"],
+        max_distance: Optional[float] = None,
     ) -> QueryResult:
         add_attributes_to_current_span(
             {
@@ -685,10 +724,40 @@ class SegmentAPI(ServerAPI):
             if where_document is not None and len(where_document) > 0
             else where_document
         )
+        if max_distance is not None:
+            max_distance = validate_max_distance(max_distance)
 
         allowed_ids = None
 
         coll = self._get_collection(collection_id)
+
+        cache_key: Optional[QueryKey] = None
+        versions: Tuple[t.SeqId, ...] = ()
+        if self._query_cache is not None:
+            cache_key = QueryResultCache.key(
+                collection_id,
+                query_embeddings,
+                n_results,
+                where,
+                where_document,
+                include,
+                max_distance,
+            )
+            # Read before the query, so that a write made during it leaves the
+            # cached result stale
+            versions = self._segment_versions(collection_id)
+            cached = self._query_cache.get(cache_key, versions)
+            stats = self._query_cache.stats()
+            add_attributes_to_current_span(
+                {
+                    "query_cache_hit": cached is not None,
+                    "query_cache_hits": stats["hits"],
+                    "query_cache_misses": stats["misses"],
+                }
+            )
+            if cached is not None:
+                return cached
+
         for embedding in query_embeddings:
             self._validate_dimension(coll, len(embedding), update=False)
 
@@ -705,6 +774,7 @@ class SegmentAPI(ServerAPI):
             allowed_ids=allowed_ids,
             include_embeddings="embeddings" in include,
             options=None,
+            max_distance=max_distance,
         )
 
         vector_reader = self._manager.get_segment(collection_id, VectorReader)
@@ -722,7 +792,7 @@ class SegmentAPI(ServerAPI):
             if "distances" in include:
                 distances.append([r["distance"] for r in result])
             if "embeddings" in include:
-                embeddings.append([cast(Embedding, r["embedding"]) for r in result])
+                embeddings.append([_embedding(r["embedding"]) for r in result])
 
         if "documents" in include or "metadatas" in include or "uris" in include:
             all_ids: Set[str] = set()
@@ -766,7 +836,7 @@ class SegmentAPI(ServerAPI):
             )
         )
 
-        return QueryResult(
+        result = QueryResult(
             ids=ids,
             distances=distances if distances else None,
             metadatas=metadatas if metadatas else None,
@@ -776,6 +846,21 @@ class SegmentAPI(ServerAPI):
             data=None,
             included=include,
         )
+        if self._query_cache is not None and cache_key is not None:
+            self._query_cache.set(cache_key, versions, result)
+        return result
+
+    def _segment_versions(self, collection_id: UUID) -> Tuple[t.SeqId, ...]:
+        """The max_seqids of the segments a query reads, which change with every
+        write to the collection"""
+        return (
+            self._manager.get_segment(collection_id, VectorReader).max_seqid(),
+            self._manager.get_segment(collection_id, MetadataReader).max_seqid(),
+        )
+
+    def query_cache_stats(self) -> Optional[Dict[str, int]]:
+        """The hit and miss counts of the query result cache, if it is enabled"""
+        return self._query_cache.stats() if self._query_cache is not None else None
 
     @trace_method("SegmentAPI._peek", OpenTelemetryGranularity.OPERATION)
     @override
@@ -790,6 +875,8 @@ class SegmentAPI(ServerAPI):
     @override
     def reset_state(self) -> None:
         self._collection_cache = {}
+        if self._query_cache is not None:
+            self._query_cache.clear()
 
     @override
     def reset(self) -> bool:
@@ -897,6 +984,15 @@ def _records(
         yield record
 
 
+def _embedding(embedding: Optional[t.Vector]) -> Embedding:
+    """Convert an embedding returned by a vector segment, which may be a numpy
+    array view, to the list form returned to clients"""
+
+    if isinstance(embedding, np.ndarray):
+        return cast(Embedding, embedding.tolist())
+    return cast(Embedding, embedding)
+
+
 def _doc(metadata: Optional[t.Metadata]) -> Optional[str]:
     """Retrieve the document (if any) from a Metadata map"""
 
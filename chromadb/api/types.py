@@ -1,7 +1,8 @@
+import base64
 from typing import Optional, Union, TypeVar, List, Dict, Any, Tuple, cast
 from numpy.typing import NDArray
 import numpy as np
-from typing_extensions import Literal, TypedDict, Protocol
+from typing_extensions import Literal, NotRequired, TypedDict, Protocol
 import chromadb.errors as errors
 from chromadb.types import (
     Metadata,
@@ -158,6 +159,8 @@ class GetResult(TypedDict):
     data: Optional[Loadable]
     metadatas: Optional[List[Metadata]]
     included: Include
+    # The cursor to pass as after to get the next page, if the result was limited
+    next_cursor: NotRequired[Optional[str]]
 
 
 class QueryResult(TypedDict):
@@ -416,9 +419,16 @@ def validate_where_document(where_document: WhereDocument) -> WhereDocument:
             f"Expected where document to have exactly one operator, got {where_document}"
         )
     for operator, operand in where_document.items():
-        if operator not in ["$contains", "$not_contains", "$and", "$or"]:
+        if operator not in [
+            "$contains",
+            "$not_contains",
+            "$match",
+            "$phrase",
+            "$and",
+            "$or",
+        ]:
             raise ValueError(
-                f"Expected where document operator to be one of $contains, $and, $or, got {operator}"
+                f"Expected where document operator to be one of $contains, $not_contains, $match, $phrase, $and, $or, got {operator}"
             )
         if operator == "$and" or operator == "$or":
             if not isinstance(operand, list):
@@ -431,14 +441,18 @@ def validate_where_document(where_document: WhereDocument) -> WhereDocument:
                 )
             for where_document_expression in operand:
                 validate_where_document(where_document_expression)
-        # Value is a $contains operator
+        # Value is a $contains, $not_contains, $match or $phrase operator
         elif not isinstance(operand, str):
             raise ValueError(
-                f"Expected where document operand value for operator $contains to be a str, got {operand}"
+                f"Expected where document operand value for operator {operator} to be a str, got {operand}"
             )
         elif len(operand) == 0:
             raise ValueError(
-                "Expected where document operand value for operator $contains to be a non-empty str"
+                f"Expected where document operand value for operator {operator} to be a non-empty str"
+            )
+        elif operator in ("$match", "$phrase") and operand.isspace():
+            raise ValueError(
+                f"Expected where document operand value for operator {operator} to contain a term, got only whitespace"
             )
     return where_document
 
@@ -476,6 +490,36 @@ def validate_n_results(n_results: int) -> int:
     return n_results
 
 
+def validate_max_distance(max_distance: float) -> float:
+    """Validates max_distance to ensure it is a number. Distances can be negative in
+    the inner product space, so negative values are allowed."""
+    if not isinstance(max_distance, (int, float)) or isinstance(max_distance, bool):
+        raise ValueError(f"Expected max_distance to be a number, got {max_distance}")
+    if np.isnan(max_distance):
+        raise ValueError("Expected max_distance to be a number, got NaN")
+    return float(max_distance)
+
+
+def encode_cursor(id: ID) -> str:
+    """Encode the ID of the last entry of a page into the opaque cursor of the next"""
+    return base64.urlsafe_b64encode(id.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> ID:
+    """Validates a cursor returned by get, and decodes the ID of the entry it follows"""
+    if not isinstance(cursor, str):
+        raise ValueError(f"Expected cursor to be a str, got {cursor}")
+    try:
+        id = base64.b64decode(cursor, altchars=b"-_", validate=True).decode("utf-8")
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    # Decoding accepts other encodings of the same bytes, so the cursor must be the
+    # one get returns for the ID
+    if len(id) == 0 or encode_cursor(id) != cursor:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return id
+
+
 def validate_embeddings(embeddings: Embeddings) -> Embeddings:
     """Validates embeddings to ensure it is a list of list of ints, or floats"""
     if not isinstance(embeddings, list):
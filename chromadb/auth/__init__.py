@@ -175,6 +175,7 @@ class AuthzAction(str, Enum):
     COUNT = "collection:count"
     UPDATE = "collection:update"
     UPSERT = "collection:upsert"
+    COMPACT_COLLECTION = "collection:compact_collection"
 
 
 @dataclass
@@ -6,7 +6,9 @@ import uvicorn
 import os
 import webbrowser
 
+import chromadb
 from chromadb.cli.utils import set_log_file_path
+from chromadb.config import DEFAULT_DATABASE, DEFAULT_TENANT, Settings
 
 app = typer.Typer()
 
@@ -82,6 +84,33 @@ def run(
     uvicorn.run(**config)
 
 
+@app.command()  # type: ignore
+def compact(
+    collection: str = typer.Argument(..., help="The name of the collection."),
+    host: str = typer.Option(
+        "localhost", help="The host of the chroma server serving the collection."
+    ),
+    port: int = typer.Option(8000, help="The port of the chroma server."),
+    tenant: str = typer.Option(DEFAULT_TENANT, help="The tenant of the collection."),
+    database: str = typer.Option(
+        DEFAULT_DATABASE, help="The database of the collection."
+    ),
+) -> None:
+    """Rebuild the vector index of a collection without its deleted embeddings"""
+
+    # The server compacts the collection, as only the process serving a persist
+    # directory may write its indexes
+    client = chromadb.AdminClient(
+        Settings(
+            chroma_api_impl="chromadb.api.fastapi.FastAPI",
+            chroma_server_host=host,
+            chroma_server_http_port=port,
+        )
+    )
+    client.compact_collection(collection, tenant=tenant, database=database)
+    typer.echo(f"\033[1mCompacted collection\033[0m: \033[32m{collection}\033[0m")
+
+
 @app.command()  # type: ignore
 def help() -> None:
     """Opens help url in your browser"""
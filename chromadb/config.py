@@ -135,6 +135,19 @@ class Settings(BaseSettings):  # type: ignore
 
     chroma_memory_limit_bytes: int = 0
     chroma_segment_cache_policy: Optional[str] = None
+    # When positive, new persistent collections start with an exact flat vector
+    # segment that is promoted to hnsw once it holds this many embeddings
+    chroma_flat_segment_promotion_threshold: int = 0
+    # Collections whose segments are loaded in the background when a persistent
+    # system starts, by id or by name in the default tenant and database
+    chroma_warmup_collections: List[str] = []
+    # Also load the segments of this many of the collections most recently used
+    # before the last shutdown
+    chroma_warmup_recent_collections: int = 0
+    chroma_warmup_threads: int = 4
+    # How many query results SegmentAPI caches, 0 to disable the cache. A cached
+    # result is dropped as soon as its collection is written to.
+    chroma_query_cache_size: int = 0
 
     allow_reset: bool = False
 
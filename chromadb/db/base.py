@@ -1,12 +1,22 @@
-from typing import Any, Optional, Sequence, Tuple, Type
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
 from types import TracebackType
 from typing_extensions import Protocol, Self, Literal
 from abc import ABC, abstractmethod
-from threading import local
+from threading import Lock, local
 from overrides import override, EnforceOverrides
 import pypika
 import pypika.queries
 from chromadb.config import System, Component
+from chromadb.utils.lru_cache import LRUCache
 from uuid import UUID
 from itertools import islice, count
 
@@ -117,6 +127,16 @@ class SqlDB(Component):
         """Return a PyPika Parameter object for the given index"""
         return pypika.Parameter(self.parameter_format().format(idx))
 
+    def compiled_sql(
+        self,
+        key: Hashable,
+        build: Callable[..., pypika.queries.QueryBuilder],
+        *args: Any,
+    ) -> Tuple[str, Tuple[Any, ...]]:
+        """Return the SQL and parameters of a query shape for the given arguments,
+        compiling the shape only the first time. See StatementRegistry."""
+        return statements.get(key, build, *args, formatstr=self.parameter_format())
+
 
 _context = local()
 
@@ -190,3 +210,115 @@ def get_sql(
     sql = query.get_sql()
     params = tuple(_context.values)
     return sql, params
+
+
+class _Slot:
+    """The placeholder of an argument, or of an item of a list argument, in a
+    compiled statement. item is -1 for arguments that are not lists. Not a tuple, so
+    that ParameterValue does not take it for a list."""
+
+    __slots__ = ("arg", "item")
+
+    def __init__(self, arg: int, item: int):
+        self.arg = arg
+        self.item = item
+
+
+def _arity_bucket(n: int) -> int:
+    """Round the length of a list argument up to a power of two"""
+    return 0 if n == 0 else 1 << (n - 1).bit_length()
+
+
+class StatementRegistry:
+    """A process wide cache of compiled parameterized queries, so that a query shape
+    is built with PyPika and rendered by get_sql() only once, and later executions
+    reuse the same SQL text, which the driver's statement cache then also hits.
+
+    A shape is named by a hashable key and built by a function of its arguments, that
+    must only use them as ParameterValues. Arguments are bound as parameters whatever
+    their value, so None is bound as NULL, as in the VALUES of an insert. A comparison
+    with an argument that may be None does not belong in a compiled statement, as it
+    never matches NULL; the function should leave the filter out instead, and the key
+    say whether it is there. List and tuple arguments are IN lists: their length is
+    rounded up to an arity bucket and they are padded with their last item, which
+    leaves what they match unchanged. Anything else that changes the SQL, such as
+    the number of rows of an insert, must be part of the key.
+
+    Usage Example:
+
+        sql, params = statements.get(
+            "foo_by_col2",
+            lambda col2, ids: (
+                pypika.Query().from_("table")
+                .select("col1")
+                .where(Field("col2") == ParameterValue(col2))
+                .where(Field("id").isin(ParameterValue(ids)))
+            ),
+            "foo",
+            ["a", "b", "c"],
+        )
+    """
+
+    _lock: Lock
+    _compiled: LRUCache[Hashable, Tuple[str, Tuple[Any, ...]]]
+    hits: int
+    misses: int
+
+    def __init__(self, capacity: int = 1024):
+        self._lock = Lock()
+        self._compiled = LRUCache(capacity)
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        key: Hashable,
+        build: Callable[..., pypika.queries.QueryBuilder],
+        *args: Any,
+        formatstr: str = "?",
+    ) -> Tuple[str, Tuple[Any, ...]]:
+        """Return the SQL of the shape and the parameters for the given arguments"""
+        arities = tuple(
+            _arity_bucket(len(arg)) if isinstance(arg, (list, tuple)) else -1
+            for arg in args
+        )
+        shape = (key, formatstr, arities)
+        with self._lock:
+            compiled = self._compiled.get(shape)
+            if compiled is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if compiled is None:
+            slots = [
+                _Slot(i, -1) if arity < 0 else [_Slot(i, item) for item in range(arity)]
+                for i, arity in enumerate(arities)
+            ]
+            compiled = get_sql(build(*slots), formatstr)
+            with self._lock:
+                self._compiled.set(shape, compiled)
+
+        sql, slots = compiled
+        params = []
+        for slot in slots:
+            if not isinstance(slot, _Slot):
+                # A constant of the shape
+                params.append(slot)
+            elif slot.item < 0:
+                params.append(args[slot.arg])
+            else:
+                items = args[slot.arg]
+                params.append(items[min(slot.item, len(items) - 1)])
+        return sql, tuple(params)
+
+    def stats(self) -> Dict[str, int]:
+        """The hit and miss counts and the number of compiled shapes"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._compiled.cache),
+            }
+
+
+statements = StatementRegistry()
@@ -22,9 +22,10 @@ from chromadb.telemetry.opentelemetry import (
 )
 from overrides import override
 from collections import defaultdict
-from typing import Sequence, Optional, Dict, Set, Tuple, cast
+from typing import Any, List, Sequence, Optional, Dict, Set, Tuple, cast
 from uuid import UUID
 from pypika import Table, functions
+from pypika.queries import QueryBuilder
 import uuid
 import logging
 from chromadb.ingest.impl.utils import create_topic_name
@@ -84,6 +85,8 @@ class SqlEmbeddingsQueue(SqlDB, Producer, Consumer):
     _topic_namespace: str
     # How many variables are in the insert statement for a single record
     VARIABLES_PER_RECORD = 6
+    # The largest number of records whose insert statement is compiled once and kept
+    MAX_COMPILED_RECORDS = 64
 
     def __init__(self, system: System):
         self._subscriptions = defaultdict(set)
@@ -106,14 +109,17 @@ class SqlEmbeddingsQueue(SqlDB, Producer, Consumer):
             self._tenant, self._topic_namespace, collection_id
         )
         t = Table("embeddings_queue")
-        q = (
-            self.querybuilder()
-            .from_(t)
-            .where(t.topic == ParameterValue(topic_name))
-            .delete()
+        sql, params = self.compiled_sql(
+            "SqlEmbeddingsQueue.delete_log",
+            lambda topic: (
+                self.querybuilder()
+                .from_(t)
+                .where(t.topic == ParameterValue(topic))
+                .delete()
+            ),
+            topic_name,
         )
         with self.tx() as cur:
-            sql, params = get_sql(q, self.parameter_format())
             cur.execute(sql, params)
 
     @trace_method("SqlEmbeddingsQueue.submit_embedding", OpenTelemetryGranularity.ALL)
@@ -151,11 +157,23 @@ class SqlEmbeddingsQueue(SqlDB, Producer, Consumer):
         )
 
         t = Table("embeddings_queue")
-        insert = (
-            self.querybuilder()
-            .into(t)
-            .columns(t.operation, t.topic, t.id, t.vector, t.encoding, t.metadata)
-        )
+
+        def insert(*values: Any) -> QueryBuilder:
+            q = (
+                self.querybuilder()
+                .into(t)
+                .columns(t.operation, t.topic, t.id, t.vector, t.encoding, t.metadata)
+            )
+            for i in range(0, len(values), self.VARIABLES_PER_RECORD):
+                q = q.insert(
+                    *(
+                        ParameterValue(v)
+                        for v in values[i : i + self.VARIABLES_PER_RECORD]
+                    )
+                )
+            return q
+
+        values: List[Any] = []
         id_to_idx: Dict[str, int] = {}
         for embedding in embeddings:
             (
@@ -163,17 +181,28 @@ class SqlEmbeddingsQueue(SqlDB, Producer, Consumer):
                 encoding,
                 metadata,
             ) = self._prepare_vector_encoding_metadata(embedding)
-            insert = insert.insert(
-                ParameterValue(_operation_codes[embedding["operation"]]),
-                ParameterValue(topic_name),
-                ParameterValue(embedding["id"]),
-                ParameterValue(embedding_bytes),
-                ParameterValue(encoding),
-                ParameterValue(metadata),
+            values.extend(
+                (
+                    _operation_codes[embedding["operation"]],
+                    topic_name,
+                    embedding["id"],
+                    embedding_bytes,
+                    encoding,
+                    metadata,
+                )
             )
             id_to_idx[embedding["id"]] = len(id_to_idx)
         with self.tx() as cur:
-            sql, params = get_sql(insert, self.parameter_format())
+            if len(embeddings) <= self.MAX_COMPILED_RECORDS:
+                # The statement is compiled once per number of records
+                sql, params = self.compiled_sql(
+                    ("SqlEmbeddingsQueue.submit_embeddings", len(embeddings)),
+                    insert,
+                    *values,
+                )
+            else:
+                # Building the statement of a large batch is cheap next to inserting it
+                sql, params = get_sql(insert(*values), self.parameter_format())
             # The returning clause does not guarantee order, so we need to do reorder
             # the results. https://www.sqlite.org/lang_returning.html
             sql = f"{sql} RETURNING seq_id, id"  # Pypika doesn't support RETURNING
@@ -296,17 +325,22 @@ class SqlEmbeddingsQueue(SqlDB, Producer, Consumer):
         """Backfill the given subscription with any currently matching records in the
         DB"""
         t = Table("embeddings_queue")
-        q = (
-            self.querybuilder()
-            .from_(t)
-            .where(t.topic == ParameterValue(subscription.topic_name))
-            .where(t.seq_id > ParameterValue(subscription.start))
-            .where(t.seq_id <= ParameterValue(subscription.end))
-            .select(t.seq_id, t.operation, t.id, t.vector, t.encoding, t.metadata)
-            .orderby(t.seq_id)
+        sql, params = self.compiled_sql(
+            "SqlEmbeddingsQueue._backfill",
+            lambda topic, start, end: (
+                self.querybuilder()
+                .from_(t)
+                .where(t.topic == ParameterValue(topic))
+                .where(t.seq_id > ParameterValue(start))
+                .where(t.seq_id <= ParameterValue(end))
+                .select(t.seq_id, t.operation, t.id, t.vector, t.encoding, t.metadata)
+                .orderby(t.seq_id)
+            ),
+            subscription.topic_name,
+            subscription.start,
+            subscription.end,
         )
         with self.tx() as cur:
-            sql, params = get_sql(q, self.parameter_format())
             cur.execute(sql, params)
             rows = cur.fetchall()
             for row in rows:
@@ -350,9 +384,12 @@ class SqlEmbeddingsQueue(SqlDB, Producer, Consumer):
     def _next_seq_id(self) -> int:
         """Get the next SeqID for this database."""
         t = Table("embeddings_queue")
-        q = self.querybuilder().from_(t).select(functions.Max(t.seq_id))
+        sql, params = self.compiled_sql(
+            "SqlEmbeddingsQueue._next_seq_id",
+            lambda: self.querybuilder().from_(t).select(functions.Max(t.seq_id)),
+        )
         with self.tx() as cur:
-            cur.execute(q.get_sql())
+            cur.execute(sql, params)
             return int(cur.fetchone()[0]) + 1
 
     @trace_method("SqlEmbeddingsQueue._notify_all", OpenTelemetryGranularity.ALL)
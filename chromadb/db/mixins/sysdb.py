@@ -2,6 +2,7 @@ from typing import Optional, Sequence, Any, Tuple, cast, Dict, Union, Set
 from uuid import UUID
 from overrides import override
 from pypika import Table, Column
+from pypika.queries import QueryBuilder
 from itertools import groupby
 
 from chromadb.config import DEFAULT_DATABASE, DEFAULT_TENANT, System
@@ -82,14 +83,18 @@ class SqlSysDB(SqlDB, SysDB):
     def get_database(self, name: str, tenant: str = DEFAULT_TENANT) -> Database:
         with self.tx() as cur:
             databases = Table("databases")
-            q = (
-                self.querybuilder()
-                .from_(databases)
-                .select(databases.id, databases.name)
-                .where(databases.name == ParameterValue(name))
-                .where(databases.tenant_id == ParameterValue(tenant))
+            sql, params = self.compiled_sql(
+                "SqlSysDB.get_database",
+                lambda name, tenant: (
+                    self.querybuilder()
+                    .from_(databases)
+                    .select(databases.id, databases.name)
+                    .where(databases.name == ParameterValue(name))
+                    .where(databases.tenant_id == ParameterValue(tenant))
+                ),
+                name,
+                tenant,
             )
-            sql, params = get_sql(q, self.parameter_format())
             row = cur.execute(sql, params).fetchone()
             if not row:
                 raise NotFoundError(f"Database {name} not found for tenant {tenant}")
@@ -122,13 +127,16 @@ class SqlSysDB(SqlDB, SysDB):
     def get_tenant(self, name: str) -> Tenant:
         with self.tx() as cur:
             tenants = Table("tenants")
-            q = (
-                self.querybuilder()
-                .from_(tenants)
-                .select(tenants.id)
-                .where(tenants.id == ParameterValue(name))
+            sql, params = self.compiled_sql(
+                "SqlSysDB.get_tenant",
+                lambda name: (
+                    self.querybuilder()
+                    .from_(tenants)
+                    .select(tenants.id)
+                    .where(tenants.id == ParameterValue(name))
+                ),
+                name,
             )
-            sql, params = get_sql(q, self.parameter_format())
             row = cur.execute(sql, params).fetchone()
             if not row:
                 raise NotFoundError(f"Tenant {name} not found")
@@ -290,36 +298,49 @@ class SqlSysDB(SqlDB, SysDB):
         )
         segments_t = Table("segments")
         metadata_t = Table("segment_metadata")
-        q = (
-            self.querybuilder()
-            .from_(segments_t)
-            .select(
-                segments_t.id,
-                segments_t.type,
-                segments_t.scope,
-                segments_t.collection,
-                metadata_t.key,
-                metadata_t.str_value,
-                metadata_t.int_value,
-                metadata_t.float_value,
+
+        def segments_query(
+            id: Any, type: Any, scope: Any, collection: Any
+        ) -> QueryBuilder:
+            q = (
+                self.querybuilder()
+                .from_(segments_t)
+                .select(
+                    segments_t.id,
+                    segments_t.type,
+                    segments_t.scope,
+                    segments_t.collection,
+                    metadata_t.key,
+                    metadata_t.str_value,
+                    metadata_t.int_value,
+                    metadata_t.float_value,
+                )
+                .left_join(metadata_t)
+                .on(segments_t.id == metadata_t.segment_id)
+                .orderby(segments_t.id)
             )
-            .left_join(metadata_t)
-            .on(segments_t.id == metadata_t.segment_id)
-            .orderby(segments_t.id)
+            if filters[0]:
+                q = q.where(segments_t.id == ParameterValue(id))
+            if filters[1]:
+                q = q.where(segments_t.type == ParameterValue(type))
+            if filters[2]:
+                q = q.where(segments_t.scope == ParameterValue(scope))
+            if filters[3]:
+                q = q.where(segments_t.collection == ParameterValue(collection))
+            return q
+
+        args = (
+            self.uuid_to_db(id) if id else None,
+            type if type else None,
+            scope.value if scope else None,
+            self.uuid_to_db(collection) if collection else None,
+        )
+        # None is bound as NULL, so the filters that are left out are in the key
+        filters = tuple(arg is not None for arg in args)
+        sql, params = self.compiled_sql(
+            ("SqlSysDB.get_segments", filters), segments_query, *args
         )
-        if id:
-            q = q.where(segments_t.id == ParameterValue(self.uuid_to_db(id)))
-        if type:
-            q = q.where(segments_t.type == ParameterValue(type))
-        if scope:
-            q = q.where(segments_t.scope == ParameterValue(scope.value))
-        if collection:
-            q = q.where(
-                segments_t.collection == ParameterValue(self.uuid_to_db(collection))
-            )
-
         with self.tx() as cur:
-            sql, params = get_sql(q, self.parameter_format())
             rows = cur.execute(sql, params).fetchall()
             by_segment = groupby(rows, lambda r: cast(object, r[0]))
             segments = []
@@ -370,47 +391,63 @@ class SqlSysDB(SqlDB, SysDB):
         collections_t = Table("collections")
         metadata_t = Table("collection_metadata")
         databases_t = Table("databases")
-        q = (
-            self.querybuilder()
-            .from_(collections_t)
-            .select(
-                collections_t.id,
-                collections_t.name,
-                collections_t.dimension,
-                databases_t.name,
-                databases_t.tenant_id,
-                metadata_t.key,
-                metadata_t.str_value,
-                metadata_t.int_value,
-                metadata_t.float_value,
+
+        def collections_query(
+            id: Any, name: Any, tenant: Any, database: Any
+        ) -> QueryBuilder:
+            q = (
+                self.querybuilder()
+                .from_(collections_t)
+                .select(
+                    collections_t.id,
+                    collections_t.name,
+                    collections_t.dimension,
+                    databases_t.name,
+                    databases_t.tenant_id,
+                    metadata_t.key,
+                    metadata_t.str_value,
+                    metadata_t.int_value,
+                    metadata_t.float_value,
+                )
+                .left_join(metadata_t)
+                .on(collections_t.id == metadata_t.collection_id)
+                .left_join(databases_t)
+                .on(collections_t.database_id == databases_t.id)
+                .orderby(collections_t.id)
             )
-            .left_join(metadata_t)
-            .on(collections_t.id == metadata_t.collection_id)
-            .left_join(databases_t)
-            .on(collections_t.database_id == databases_t.id)
-            .orderby(collections_t.id)
-        )
-        if id:
-            q = q.where(collections_t.id == ParameterValue(self.uuid_to_db(id)))
-        if name:
-            q = q.where(collections_t.name == ParameterValue(name))
+            if filters[0]:
+                q = q.where(collections_t.id == ParameterValue(id))
+            if filters[1]:
+                q = q.where(collections_t.name == ParameterValue(name))
+            if filters[2]:
+                filter_databases_t = Table("databases")
+                q = q.where(
+                    collections_t.database_id
+                    == self.querybuilder()
+                    .select(filter_databases_t.id)
+                    .from_(filter_databases_t)
+                    .where(filter_databases_t.name == ParameterValue(database))
+                    .where(filter_databases_t.tenant_id == ParameterValue(tenant))
+                )
+            return q
 
         # Only if we have a name, tenant and database do we need to filter databases
         # Given an id, we can uniquely identify the collection so we don't need to filter databases
-        if id is None and tenant and database:
-            databases_t = Table("databases")
-            q = q.where(
-                collections_t.database_id
-                == self.querybuilder()
-                .select(databases_t.id)
-                .from_(databases_t)
-                .where(databases_t.name == ParameterValue(database))
-                .where(databases_t.tenant_id == ParameterValue(tenant))
-            )
+        filter_databases = id is None and tenant and database
+        args = (
+            self.uuid_to_db(id) if id else None,
+            name if name else None,
+            tenant if filter_databases else None,
+            database if filter_databases else None,
+        )
+        # None is bound as NULL, so the filters that are left out are in the key
+        filters = (args[0] is not None, args[1] is not None, bool(filter_databases))
+        sql, params = self.compiled_sql(
+            ("SqlSysDB.get_collections", filters), collections_query, *args
+        )
         # cant set limit and offset here because this is metadata and we havent reduced yet
 
         with self.tx() as cur:
-            sql, params = get_sql(q, self.parameter_format())
             rows = cur.execute(sql, params).fetchall()
             by_collection = groupby(rows, lambda r: cast(object, r[0]))
             collections = []
@@ -64,6 +64,13 @@ class InvalidHTTPVersion(ChromaError):
         return "InvalidHTTPVersion"
 
 
+class InvalidArgumentError(ChromaError):
+    @classmethod
+    @overrides
+    def name(cls) -> str:
+        return "InvalidArgument"
+
+
 class AuthorizationError(ChromaError):
     @overrides
     def code(self) -> int:
@@ -82,5 +89,6 @@ error_types: Dict[str, Type[ChromaError]] = {
     "DuplicateID": DuplicateIDError,
     "InvalidUUID": InvalidUUIDError,
     "InvalidHTTPVersion": InvalidHTTPVersion,
+    "InvalidArgument": InvalidArgumentError,
     "AuthorizationError": AuthorizationError,
 }
@@ -1,4 +1,4 @@
-from typing import Optional, Sequence, TypeVar, Type
+from typing import Dict, Optional, Sequence, TypeVar, Type, Union
 from abc import abstractmethod
 from chromadb.types import (
     Collection,
@@ -14,6 +14,7 @@ from chromadb.types import (
     Metadata,
 )
 from chromadb.config import Component, System
+from chromadb.errors import InvalidArgumentError
 from uuid import UUID
 from enum import Enum
 
@@ -22,6 +23,8 @@ class SegmentType(Enum):
     SQLITE = "urn:chroma:segment/metadata/sqlite"
     HNSW_LOCAL_MEMORY = "urn:chroma:segment/vector/hnsw-local-memory"
     HNSW_LOCAL_PERSISTED = "urn:chroma:segment/vector/hnsw-local-persisted"
+    IVF_LOCAL_PERSISTED = "urn:chroma:segment/vector/ivf-local-persisted"
+    FLAT_LOCAL_PERSISTED = "urn:chroma:segment/vector/flat-local-persisted"
     HNSW_DISTRIBUTED = "urn:chroma:segment/vector/hnsw-distributed"
     RECORD = "urn:chroma:segment/record"
 
@@ -68,8 +71,11 @@ class MetadataReader(SegmentImplementation):
         ids: Optional[Sequence[str]] = None,
         limit: Optional[int] = None,
         offset: Optional[int] = None,
+        after: Optional[str] = None,
     ) -> Sequence[MetadataEmbeddingRecord]:
-        """Query for embedding metadata."""
+        """Query for embedding metadata. Records are ordered by ID; if after is given,
+        only those with IDs after it are returned, which lets callers page through
+        records by the last ID of each page instead of an offset."""
         pass
 
 
@@ -89,9 +95,15 @@ class VectorReader(SegmentImplementation):
         self, query: VectorQuery
     ) -> Sequence[Sequence[VectorQueryResult]]:
         """Given a vector query, return the top-k nearest neighbors for vector in the
-        query."""
+        query. If the query has a max_distance, only the neighbors within it are
+        returned, so a vector may get fewer than k."""
         pass
 
+    def compact(self) -> None:
+        """Rebuild the segment's index from its live embeddings, reclaiming the space
+        and search time spent on deleted ones."""
+        raise InvalidArgumentError(f"{type(self).__name__} does not support compaction")
+
 
 class SegmentManager(Component):
     """Interface for a pluggable strategy for creating, retrieving and instantiating
@@ -127,3 +139,10 @@ class SegmentManager(Component):
         it can preload segments as needed. This is only a hint, and implementations are
         free to ignore it."""
         pass
+
+    def warmup_progress(self) -> Optional[Dict[str, Union[int, bool]]]:
+        """Return how far loading segments at startup got, with the number of
+        collections to load in "total", loaded in "loaded", failed to in "failed",
+        and whether it is "done". Returns None if no segments are loaded at startup,
+        which is the default."""
+        return None
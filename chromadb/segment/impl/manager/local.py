@@ -14,10 +14,17 @@ from chromadb.segment.impl.manager.cache.cache import (
     SegmentCache,
 )
 import os
+import time
 
 from chromadb.config import System, get_class
 from chromadb.db.system import SysDB
+from chromadb.ingest import Consumer
 from overrides import override
+from chromadb.segment.impl.manager.warmup import (
+    SegmentWarmup,
+    read_recent_collections,
+    write_recent_collections,
+)
 from chromadb.segment.impl.vector.local_persistent_hnsw import (
     PersistentLocalHnswSegment,
 )
@@ -27,7 +34,7 @@ from chromadb.telemetry.opentelemetry import (
     trace_method,
 )
 from chromadb.types import Collection, Operation, Segment, SegmentScope, Metadata
-from typing import Dict, Type, Sequence, Optional, cast
+from typing import Dict, List, Type, Sequence, Optional, Union, cast
 from uuid import UUID, uuid4
 import platform
 
@@ -44,10 +51,22 @@ SEGMENT_TYPE_IMPLS = {
     SegmentType.SQLITE: "chromadb.segment.impl.metadata.sqlite.SqliteMetadataSegment",
     SegmentType.HNSW_LOCAL_MEMORY: "chromadb.segment.impl.vector.local_hnsw.LocalHnswSegment",
     SegmentType.HNSW_LOCAL_PERSISTED: "chromadb.segment.impl.vector.local_persistent_hnsw.PersistentLocalHnswSegment",
+    SegmentType.IVF_LOCAL_PERSISTED: "chromadb.segment.impl.vector.local_persistent_ivf.PersistentLocalIvfSegment",
+    SegmentType.FLAT_LOCAL_PERSISTED: "chromadb.segment.impl.vector.local_persistent_flat.PersistentLocalFlatSegment",
+}
+
+# Vector segment types whose instances are PersistentLocalHnswSegments
+PERSISTED_VECTOR_SEGMENT_TYPES = {
+    SegmentType.HNSW_LOCAL_PERSISTED.value,
+    SegmentType.IVF_LOCAL_PERSISTED.value,
+    SegmentType.FLAT_LOCAL_PERSISTED.value,
 }
 
 
 class LocalSegmentManager(SegmentManager):
+    # Records the most recently used collections on shutdown, to warm up on start
+    RECENT_COLLECTIONS_FILE = "recent_collections.json"
+
     _sysdb: SysDB
     _system: System
     _opentelemetry_client: OpenTelemetryClient
@@ -57,11 +76,20 @@ class LocalSegmentManager(SegmentManager):
     ]  # LRU cache to manage file handles across vector segment instances
     _vector_segment_type: SegmentType = SegmentType.HNSW_LOCAL_MEMORY
     _lock: Lock
+    # Held while creating the instance of a segment, so that different segments can
+    # be created concurrently
+    _instance_locks: Dict[UUID, Lock]
     _max_file_handles: int
+    # When each collection was last used since startup
+    _last_used: Dict[UUID, float]
+    _warmup: Optional[SegmentWarmup]
 
     def __init__(self, system: System):
         super().__init__(system)
         self._sysdb = self.require(SysDB)
+        # Segments subscribe to the consumer when they start, so it must be running
+        # before segments are warmed up
+        self.require(Consumer)
         self._system = system
         self._opentelemetry_client = system.require(OpenTelemetryClient)
         self.logger = logging.getLogger(__name__)
@@ -82,6 +110,9 @@ class LocalSegmentManager(SegmentManager):
             self.segment_cache[SegmentScope.VECTOR] = BasicCache()
 
         self._lock = Lock()
+        self._instance_locks = {}
+        self._last_used = {}
+        self._warmup = None
 
         # TODO: prototyping with distributed segment for now, but this should be a configurable option
         # we need to think about how to handle this configuration
@@ -115,19 +146,100 @@ class LocalSegmentManager(SegmentManager):
         for instance in self._instances.values():
             instance.start()
         super().start()
+        if self._system.settings.require("is_persistent"):
+            collection_ids = self._warmup_collection_ids()
+            if len(collection_ids) > 0:
+                self._warmup = SegmentWarmup(
+                    collection_ids,
+                    self._warm_up_collection,
+                    self._system.settings.chroma_warmup_threads,
+                )
+                self._warmup.start()
 
     @override
     def stop(self) -> None:
+        if self._warmup is not None:
+            self._warmup.stop()
+        if self._system.settings.require("is_persistent"):
+            self._write_recent_collections()
         for instance in self._instances.values():
             instance.stop()
         super().stop()
 
+    @override
+    def warmup_progress(self) -> Optional[Dict[str, Union[int, bool]]]:
+        if self._warmup is None:
+            return None
+        return self._warmup.progress()
+
+    def _warmup_collection_ids(self) -> List[UUID]:
+        """Return the collections to warm up: those listed by
+        chroma_warmup_collections, then the chroma_warmup_recent_collections most
+        recently used ones which still exist"""
+        settings = self._system.settings
+        collection_ids: List[UUID] = []
+        for entry in settings.chroma_warmup_collections:
+            try:
+                collection_id: Optional[UUID] = UUID(entry)
+            except ValueError:
+                collection_id = None
+            if collection_id is not None:
+                collections = self._sysdb.get_collections(id=collection_id)
+            else:
+                collections = self._sysdb.get_collections(name=entry)
+            if len(collections) == 0:
+                self.logger.warning(f"Cannot warm up unknown collection {entry}")
+            collection_ids.extend(c["id"] for c in collections)
+
+        n_recent = settings.chroma_warmup_recent_collections
+        if n_recent > 0:
+            recent = read_recent_collections(self._recent_collections_file())
+            for collection_id in recent[:n_recent]:
+                if len(self._sysdb.get_collections(id=collection_id)) > 0:
+                    collection_ids.append(collection_id)
+        return list(dict.fromkeys(collection_ids))
+
+    def _warm_up_collection(self, collection_id: UUID) -> None:
+        """Create and start the segments of a collection, and load its vector index"""
+        self._instance_for(collection_id, SegmentScope.METADATA)
+        instance = self._instance_for(collection_id, SegmentScope.VECTOR)
+        if isinstance(instance, PersistentLocalHnswSegment):
+            with self._lock:
+                self._vector_instances_file_handle_cache.set(collection_id, instance)
+            instance.preload()
+
+    def _write_recent_collections(self) -> None:
+        """Record the chroma_warmup_recent_collections most recently used
+        collections, followed by those recorded last time that were not used since"""
+        n_recent = self._system.settings.chroma_warmup_recent_collections
+        if n_recent <= 0:
+            return
+        path = self._recent_collections_file()
+        recent = sorted(self._last_used, key=self._last_used.__getitem__, reverse=True)
+        recent.extend(
+            collection_id
+            for collection_id in read_recent_collections(path)
+            if collection_id not in self._last_used
+        )
+        try:
+            write_recent_collections(path, recent[:n_recent])
+        except OSError:
+            self.logger.exception("Failed to record the recently used collections")
+
+    def _recent_collections_file(self) -> str:
+        return os.path.join(
+            self._system.settings.require("persist_directory"),
+            self.RECENT_COLLECTIONS_FILE,
+        )
+
     @override
     def reset_state(self) -> None:
         for instance in self._instances.values():
             instance.stop()
             instance.reset_state()
         self._instances = {}
+        self._instance_locks = {}
+        self._last_used = {}
         self.segment_cache[SegmentScope.VECTOR].reset()
         super().reset_state()
 
@@ -137,14 +249,42 @@ class LocalSegmentManager(SegmentManager):
     )
     @override
     def create_segments(self, collection: Collection) -> Sequence[Segment]:
-        vector_segment = _segment(
-            self._vector_segment_type, SegmentScope.VECTOR, collection
-        )
+        vector_segment_type = self._collection_vector_segment_type(collection)
+        vector_segment = _segment(vector_segment_type, SegmentScope.VECTOR, collection)
+        if vector_segment_type == SegmentType.FLAT_LOCAL_PERSISTED:
+            # Record the threshold the segment is created with, unless the collection
+            # sets its own
+            vector_segment["metadata"] = {
+                "flat:promotion_threshold": self._system.settings.chroma_flat_segment_promotion_threshold,
+                **(vector_segment["metadata"] or {}),
+            }
         metadata_segment = _segment(
             SegmentType.SQLITE, SegmentScope.METADATA, collection
         )
         return [vector_segment, metadata_segment]
 
+    def _collection_vector_segment_type(self, collection: Collection) -> SegmentType:
+        """Collections whose metadata sets any ivf: or flat: parameter use an IVF or
+        flat segment. Other persistent collections use a flat segment if
+        chroma_flat_segment_promotion_threshold is set, and the default vector
+        segment type otherwise."""
+        metadata = collection.get("metadata", None) or {}
+        is_persistent = self._system.settings.require("is_persistent")
+        if any(key.startswith("ivf:") for key in metadata):
+            if not is_persistent:
+                raise ValueError("IVF collections require a persistent client")
+            return SegmentType.IVF_LOCAL_PERSISTED
+        if any(key.startswith("flat:") for key in metadata):
+            if not is_persistent:
+                raise ValueError("Flat collections require a persistent client")
+            return SegmentType.FLAT_LOCAL_PERSISTED
+        if (
+            is_persistent
+            and self._system.settings.chroma_flat_segment_promotion_threshold > 0
+        ):
+            return SegmentType.FLAT_LOCAL_PERSISTED
+        return self._vector_segment_type
+
     @trace_method(
         "LocalSegmentManager.delete_segments",
         OpenTelemetryGranularity.OPERATION_AND_SEGMENT,
@@ -154,17 +294,19 @@ class LocalSegmentManager(SegmentManager):
         segments = self._sysdb.get_segments(collection=collection_id)
         for segment in segments:
             if segment["id"] in self._instances:
-                if segment["type"] == SegmentType.HNSW_LOCAL_PERSISTED.value:
+                if segment["type"] in PERSISTED_VECTOR_SEGMENT_TYPES:
                     instance = self.get_segment(collection_id, VectorReader)
                     instance.delete()
                 elif segment["type"] == SegmentType.SQLITE.value:
                     instance = self.get_segment(collection_id, MetadataReader)
                     instance.delete()
                 del self._instances[segment["id"]]
+            self._instance_locks.pop(segment["id"], None)
             if segment["scope"] is SegmentScope.VECTOR:
                 self.segment_cache[SegmentScope.VECTOR].pop(collection_id)
             if segment["scope"] is SegmentScope.METADATA:
                 self.segment_cache[SegmentScope.METADATA].pop(collection_id)
+        self._last_used.pop(collection_id, None)
         return [s["id"] for s in segments]
 
     def _get_segment_disk_size(self, collection_id: UUID) -> int:
@@ -206,16 +348,23 @@ class LocalSegmentManager(SegmentManager):
         else:
             raise ValueError(f"Invalid segment type: {type}")
 
+        self._last_used[collection_id] = time.time()
+        return cast(S, self._instance_for(collection_id, scope))
+
+    def _instance_for(
+        self, collection_id: UUID, scope: SegmentScope
+    ) -> SegmentImplementation:
         segment = self.segment_cache[scope].get(collection_id)
         if segment is None:
             segment = self._get_segment_sysdb(collection_id, scope)
             self.segment_cache[scope].set(collection_id, segment)
 
-        # Instances must be atomically created, so we use a lock to ensure that only one thread
-        # creates the instance.
+        # Instances must be atomically created, so we use a lock per segment to ensure
+        # that only one thread creates its instance.
         with self._lock:
-            instance = self._instance(segment)
-        return cast(S, instance)
+            instance_lock = self._instance_locks.setdefault(segment["id"], Lock())
+        with instance_lock:
+            return self._instance(segment)
 
     @trace_method(
         "LocalSegmentManager.hint_use_collection",
@@ -245,7 +394,8 @@ class LocalSegmentManager(SegmentManager):
             cls = self._cls(segment)
             instance = cls(self._system, segment)
             instance.start()
-            self._instances[segment["id"]] = instance
+            with self._lock:
+                self._instances[segment["id"]] = instance
         return self._instances[segment["id"]]
 
 
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Sequence, Union
+from uuid import UUID
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentWarmup:
+    """Loads the segments of a list of collections ahead of their first use, on a
+    thread pool in the background, and tracks how far it got."""
+
+    _collection_ids: List[UUID]
+    _load: Callable[[UUID], None]
+    _num_threads: int
+    _lock: Lock
+    _executor: Optional[ThreadPoolExecutor]
+    _loaded: int
+    _failed: int
+    _cancelled: int
+
+    def __init__(
+        self,
+        collection_ids: Sequence[UUID],
+        load: Callable[[UUID], None],
+        num_threads: int,
+    ):
+        self._collection_ids = list(collection_ids)
+        self._load = load
+        self._num_threads = max(1, num_threads)
+        self._lock = Lock()
+        self._executor = None
+        self._loaded = 0
+        self._failed = 0
+        self._cancelled = 0
+
+    def start(self) -> None:
+        """Start loading the collections without waiting for them"""
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._num_threads, thread_name_prefix="segment-warmup"
+        )
+        for collection_id in self._collection_ids:
+            future = self._executor.submit(self._load, collection_id)
+            future.add_done_callback(
+                lambda f, collection_id=collection_id: self._done(collection_id, f)
+            )
+
+    def wait(self) -> None:
+        """Block until every collection has been loaded or failed to"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def stop(self) -> None:
+        """Cancel the collections not being loaded yet, and wait for the others"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def progress(self) -> Dict[str, Union[int, bool]]:
+        """How many of the collections were loaded, failed to or are left"""
+        with self._lock:
+            total = len(self._collection_ids)
+            return {
+                "total": total,
+                "loaded": self._loaded,
+                "failed": self._failed,
+                "done": self._loaded + self._failed + self._cancelled == total,
+            }
+
+    def _done(self, collection_id: UUID, future: "Future[None]") -> None:
+        with self._lock:
+            if future.cancelled():
+                self._cancelled += 1
+            elif future.exception() is not None:
+                self._failed += 1
+                logger.error(
+                    f"Failed to warm up collection {collection_id}",
+                    exc_info=future.exception(),
+                )
+            else:
+                self._loaded += 1
+
+
+def read_recent_collections(path: str) -> List[UUID]:
+    """Return the collections recorded by write_recent_collections, most recently
+    used first, or none if the file does not exist or cannot be read"""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path) as f:
+            return [UUID(id) for id in json.load(f)["collections"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        logger.warning(f"Ignoring unreadable recent collections file {path}")
+        return []
+
+
+def write_recent_collections(path: str, collection_ids: Sequence[UUID]) -> None:
+    """Record the given collections, most recently used first"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"collections": [str(id) for id in collection_ids]}, f)
+    os.replace(tmp_path, path)
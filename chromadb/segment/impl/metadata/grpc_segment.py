@@ -62,9 +62,16 @@ class GrpcMetadataSegment(MetadataReader):
         ids: Optional[Sequence[str]] = None,
         limit: Optional[int] = None,
         offset: Optional[int] = None,
+        after: Optional[str] = None,
     ) -> Sequence[MetadataEmbeddingRecord]:
         """Query for embedding metadata."""
 
+        if after is not None:
+            # The QueryMetadataRequest has no field for it
+            raise NotImplementedError(
+                "Paging with after is not supported by the gRPC metadata segment"
+            )
+
         where_pb = self._where_to_proto(where)
         where_document_pb = self._where_document_to_proto(where_document)
         request: pb.QueryMetadataRequest = pb.QueryMetadataRequest(
@@ -1,4 +1,15 @@
-from typing import Optional, Sequence, Any, Tuple, cast, Generator, Union, Dict, List
+from typing import (
+    Optional,
+    Sequence,
+    Any,
+    Set,
+    Tuple,
+    cast,
+    Generator,
+    Union,
+    Dict,
+    List,
+)
 from chromadb.segment import MetadataReader
 from chromadb.ingest import Consumer
 from chromadb.config import System
@@ -22,7 +33,6 @@ from chromadb.types import (
     LogRecord,
     SeqId,
     Operation,
-    UpdateMetadata,
     LiteralValue,
     WhereOperator,
 )
@@ -30,15 +40,46 @@ from uuid import UUID
 from pypika import Table, Tables
 from pypika.queries import QueryBuilder
 import pypika.functions as fn
-from pypika.terms import Criterion
+from pypika.enums import Comparator
+from pypika.terms import BasicCriterion, Criterion
 from itertools import groupby
 from functools import reduce
-import sqlite3
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# The statements of the batched write path. They are plain SQL so that each is
+# prepared once and then served from the connection's statement cache.
+_UPSERT_MAX_SEQ_ID = (
+    "INSERT OR REPLACE INTO max_seq_id (segment_id, seq_id) VALUES (?, ?)"
+)
+_UPSERT_EMBEDDING = (
+    "INSERT INTO embeddings (segment_id, embedding_id, seq_id) VALUES (?, ?, ?) "
+    "ON CONFLICT (segment_id, embedding_id) DO UPDATE SET seq_id = excluded.seq_id"
+)
+_DELETE_EMBEDDING = "DELETE FROM embeddings WHERE id = ?"
+_UPSERT_METADATA = (
+    "INSERT INTO embedding_metadata "
+    "(id, key, string_value, int_value, float_value, bool_value) "
+    "VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (id, key) DO UPDATE SET string_value = excluded.string_value, "
+    "int_value = excluded.int_value, float_value = excluded.float_value, "
+    "bool_value = excluded.bool_value"
+)
+_DELETE_METADATA = "DELETE FROM embedding_metadata WHERE id = ?"
+_DELETE_METADATA_KEY = "DELETE FROM embedding_metadata WHERE id = ? AND key = ?"
+_INSERT_FULLTEXT = (
+    "INSERT INTO embedding_fulltext_search (rowid, string_value) VALUES (?, ?)"
+)
+_DELETE_FULLTEXT = "DELETE FROM embedding_fulltext_search WHERE rowid = ?"
+# The trigram tokenizer of the full text search table can only match terms of at
+# least three characters
+_MIN_MATCH_LENGTH = 3
+# Embedding IDs per row ID lookup. Its arity bucket stays below SQLite's default
+# limit of 999 variables.
+_LOOKUP_CHUNK_SIZE = 512
+
 
 class SqliteMetadataSegment(MetadataReader):
     _consumer: Consumer
@@ -76,13 +117,16 @@ class SqliteMetadataSegment(MetadataReader):
     @override
     def max_seqid(self) -> SeqId:
         t = Table("max_seq_id")
-        q = (
-            self._db.querybuilder()
-            .from_(t)
-            .select(t.seq_id)
-            .where(t.segment_id == ParameterValue(self._db.uuid_to_db(self._id)))
+        sql, params = self._db.compiled_sql(
+            "SqliteMetadataSegment.max_seqid",
+            lambda segment_id: (
+                self._db.querybuilder()
+                .from_(t)
+                .select(t.seq_id)
+                .where(t.segment_id == ParameterValue(segment_id))
+            ),
+            self._db.uuid_to_db(self._id),
         )
-        sql, params = get_sql(q)
         with self._db.tx() as cur:
             result = cur.execute(sql, params).fetchone()
 
@@ -95,15 +139,16 @@ class SqliteMetadataSegment(MetadataReader):
     @override
     def count(self) -> int:
         embeddings_t = Table("embeddings")
-        q = (
-            self._db.querybuilder()
-            .from_(embeddings_t)
-            .where(
-                embeddings_t.segment_id == ParameterValue(self._db.uuid_to_db(self._id))
-            )
-            .select(fn.Count(embeddings_t.id))
+        sql, params = self._db.compiled_sql(
+            "SqliteMetadataSegment.count",
+            lambda segment_id: (
+                self._db.querybuilder()
+                .from_(embeddings_t)
+                .where(embeddings_t.segment_id == ParameterValue(segment_id))
+                .select(fn.Count(embeddings_t.id))
+            ),
+            self._db.uuid_to_db(self._id),
         )
-        sql, params = get_sql(q)
         with self._db.tx() as cur:
             result = cur.execute(sql, params).fetchone()[0]
             return cast(int, result)
@@ -117,8 +162,10 @@ class SqliteMetadataSegment(MetadataReader):
         ids: Optional[Sequence[str]] = None,
         limit: Optional[int] = None,
         offset: Optional[int] = None,
+        after: Optional[str] = None,
     ) -> Sequence[MetadataEmbeddingRecord]:
-        """Query for embedding metadata."""
+        """Query for embedding metadata. Paging with after seeks to the page in the
+        (segment_id, embedding_id) index, rather than skipping the offset."""
         embeddings_t, metadata_t, fulltext_t = Tables(
             "embeddings", "embedding_metadata", "embedding_fulltext_search"
         )
@@ -129,41 +176,21 @@ class SqliteMetadataSegment(MetadataReader):
         if limit < 0:
             raise ValueError("Limit cannot be negative")
 
-        q = (
-            (
-                self._db.querybuilder()
-                .from_(embeddings_t)
-                .left_join(metadata_t)
-                .on(embeddings_t.id == metadata_t.id)
-            )
-            .select(
-                embeddings_t.id,
-                embeddings_t.embedding_id,
-                embeddings_t.seq_id,
-                metadata_t.key,
-                metadata_t.string_value,
-                metadata_t.int_value,
-                metadata_t.float_value,
-                metadata_t.bool_value,
-            )
-            .orderby(embeddings_t.embedding_id)
-        )
-
         # If there is a query that touches the metadata table, it uses
         # where and where_document filters, we treat this case seperately
         if where is not None or where_document is not None:
+            # Each filter selects the ids that match it from an index of
+            # embedding_metadata or from the full text index, so the embeddings are
+            # looked up by those ids rather than scanned
             metadata_q = (
                 self._db.querybuilder()
-                .from_(metadata_t)
-                .select(metadata_t.id)
-                .join(embeddings_t)
-                .on(embeddings_t.id == metadata_t.id)
+                .from_(embeddings_t)
+                .select(embeddings_t.id)
                 .orderby(embeddings_t.embedding_id)
                 .where(
                     embeddings_t.segment_id
                     == ParameterValue(self._db.uuid_to_db(self._id))
                 )
-                .distinct()  # These are embedding ids
             )
 
             if where:
@@ -182,46 +209,90 @@ class SqliteMetadataSegment(MetadataReader):
                 metadata_q = metadata_q.where(
                     embeddings_t.embedding_id.isin(ParameterValue(ids))
                 )
+            if after is not None:
+                metadata_q = metadata_q.where(
+                    embeddings_t.embedding_id > ParameterValue(after)
+                )
 
             metadata_q = metadata_q.limit(limit)
             metadata_q = metadata_q.offset(offset)
 
-            q = q.where(embeddings_t.id.isin(metadata_q))
+            sql, params = get_sql(self._records_query(metadata_q))
         else:
             # In the case where we don't use the metadata table
             # We have to apply limit/offset to embeddings and then join
-            # with metadata
-            embeddings_q = (
-                self._db.querybuilder()
-                .from_(embeddings_t)
-                .select(embeddings_t.id)
-                .where(
-                    embeddings_t.segment_id
-                    == ParameterValue(self._db.uuid_to_db(self._id))
+            # with metadata. The query then has a fixed shape, which is compiled
+            # once.
+            def embeddings_query(
+                segment_id: Any, ids: Any, after: Any, limit: Any, offset: Any
+            ) -> QueryBuilder:
+                embeddings_q = (
+                    self._db.querybuilder()
+                    .from_(embeddings_t)
+                    .select(embeddings_t.id)
+                    .where(embeddings_t.segment_id == ParameterValue(segment_id))
+                    .orderby(embeddings_t.embedding_id)
+                    .limit(ParameterValue(limit))
+                    .offset(ParameterValue(offset))
                 )
-                .orderby(embeddings_t.embedding_id)
-                .limit(limit)
-                .offset(offset)
-            )
 
-            if ids is not None:
-                embeddings_q = embeddings_q.where(
-                    embeddings_t.embedding_id.isin(ParameterValue(ids))
-                )
+                if has_ids:
+                    embeddings_q = embeddings_q.where(
+                        embeddings_t.embedding_id.isin(ParameterValue(ids))
+                    )
+                if has_after:
+                    embeddings_q = embeddings_q.where(
+                        embeddings_t.embedding_id > ParameterValue(after)
+                    )
 
-            q = q.where(embeddings_t.id.isin(embeddings_q))
+                return self._records_query(embeddings_q)
+
+            has_ids = ids is not None
+            has_after = after is not None
+            sql, params = self._db.compiled_sql(
+                ("SqliteMetadataSegment.get_metadata", has_ids, has_after),
+                embeddings_query,
+                self._db.uuid_to_db(self._id),
+                list(ids) if ids is not None else None,
+                after,
+                limit,
+                offset,
+            )
 
         with self._db.tx() as cur:
             # Execute the query with the limit and offset already applied
-            return list(self._records(cur, q))
+            return list(self._records(cur, sql, params))
+
+    def _records_query(self, ids_q: QueryBuilder) -> QueryBuilder:
+        """Select the rows of the records whose IDs are selected by ids_q"""
+        embeddings_t, metadata_t = Tables("embeddings", "embedding_metadata")
+        return (
+            (
+                self._db.querybuilder()
+                .from_(embeddings_t)
+                .left_join(metadata_t)
+                .on(embeddings_t.id == metadata_t.id)
+            )
+            .select(
+                embeddings_t.id,
+                embeddings_t.embedding_id,
+                embeddings_t.seq_id,
+                metadata_t.key,
+                metadata_t.string_value,
+                metadata_t.int_value,
+                metadata_t.float_value,
+                metadata_t.bool_value,
+            )
+            .orderby(embeddings_t.embedding_id)
+            .where(embeddings_t.id.isin(ids_q))
+        )
 
     def _records(
-        self, cur: Cursor, q: QueryBuilder
+        self, cur: Cursor, sql: str, params: Tuple[Any, ...]
     ) -> Generator[MetadataEmbeddingRecord, None, None]:
-        """Given a cursor and a QueryBuilder, yield a generator of records. Assumes
+        """Given a cursor and a query, yield a generator of records. Assumes
         cursor returns rows in ID order."""
 
-        sql, params = get_sql(q)
         cur.execute(sql, params)
 
         cur_iterator = iter(cur.fetchone, None)
@@ -255,258 +326,140 @@ class SqliteMetadataSegment(MetadataReader):
             metadata=metadata or None,
         )
 
-    @trace_method("SqliteMetadataSegment._insert_record", OpenTelemetryGranularity.ALL)
-    def _insert_record(self, cur: Cursor, record: LogRecord, upsert: bool) -> None:
-        """Add or update a single EmbeddingRecord into the DB"""
-
-        t = Table("embeddings")
-        q = (
-            self._db.querybuilder()
-            .into(t)
-            .columns(t.segment_id, t.embedding_id, t.seq_id)
-            .where(t.segment_id == ParameterValue(self._db.uuid_to_db(self._id)))
-            .where(t.embedding_id == ParameterValue(record["operation_record"]["id"]))
-        ).insert(
-            ParameterValue(self._db.uuid_to_db(self._id)),
-            ParameterValue(record["operation_record"]["id"]),
-            ParameterValue(_encode_seq_id(record["log_offset"])),
-        )
-        sql, params = get_sql(q)
-        sql = sql + "RETURNING id"
-        try:
-            id = cur.execute(sql, params).fetchone()[0]
-        except sqlite3.IntegrityError:
-            # Can't use INSERT OR REPLACE here because it changes the primary key.
-            if upsert:
-                # Cast here because the OpenTel decorators obfuscate the type
-                return cast(None, self._update_record(cur, record))
-            else:
-                logger.warning(
-                    f"Insert of existing embedding ID: {record['operation_record']['id']}"
-                )
-                # We are trying to add for a record that already exists. Fail the call.
-                # We don't throw an exception since this is in principal an async path
-                return
-
-        if record["operation_record"]["metadata"]:
-            self._update_metadata(cur, id, record["operation_record"]["metadata"])
+    @trace_method("SqliteMetadataSegment._write_metadata", OpenTelemetryGranularity.ALL)
+    def _write_metadata(self, records: Sequence[LogRecord]) -> None:
+        """Write embedding metadata to the database. Care should be taken to ensure
+        records are append-only (that is, that seq-ids should increase monotonically)
 
-    @trace_method(
-        "SqliteMetadataSegment._update_metadata", OpenTelemetryGranularity.ALL
-    )
-    def _update_metadata(self, cur: Cursor, id: int, metadata: UpdateMetadata) -> None:
-        """Update the metadata for a single EmbeddingRecord"""
-        t = Table("embedding_metadata")
-        to_delete = [k for k, v in metadata.items() if v is None]
-        if to_delete:
-            q = (
-                self._db.querybuilder()
-                .from_(t)
-                .where(t.id == ParameterValue(id))
-                .where(t.key.isin(ParameterValue(to_delete)))
-                .delete()
+        The records are written in runs in which no embedding ID repeats, so the
+        operations of a run are independent and each kind is applied with one
+        executemany. The max_seq_id is written once, for the last record."""
+        if len(records) == 0:
+            return
+        with self._db.tx() as cur:
+            for run in _distinct_id_runs(records):
+                self._write_run(cur, run)
+            cur.execute(
+                _UPSERT_MAX_SEQ_ID,
+                (
+                    self._db.uuid_to_db(self._id),
+                    _encode_seq_id(max(r["log_offset"] for r in records)),
+                ),
             )
-            sql, params = get_sql(q)
-            cur.execute(sql, params)
-
-        self._insert_metadata(cur, id, metadata)
 
-    @trace_method(
-        "SqliteMetadataSegment._insert_metadata", OpenTelemetryGranularity.ALL
-    )
-    def _insert_metadata(self, cur: Cursor, id: int, metadata: UpdateMetadata) -> None:
-        """Insert or update each metadata row for a single embedding record"""
-        t = Table("embedding_metadata")
-        q = (
-            self._db.querybuilder()
-            .into(t)
-            .columns(
-                t.id,
-                t.key,
-                t.string_value,
-                t.int_value,
-                t.float_value,
-                t.bool_value,
-            )
+    @trace_method("SqliteMetadataSegment._write_run", OpenTelemetryGranularity.ALL)
+    def _write_run(self, cur: Cursor, records: Sequence[LogRecord]) -> None:
+        """Write records with distinct embedding IDs to the DB"""
+        segment_id = self._db.uuid_to_db(self._id)
+        rowids = self._embedding_rowids(
+            cur, [r["operation_record"]["id"] for r in records]
         )
-        for key, value in metadata.items():
-            if isinstance(value, str):
-                q = q.insert(
-                    ParameterValue(id),
-                    ParameterValue(key),
-                    ParameterValue(value),
-                    None,
-                    None,
-                    None,
-                )
-            # isinstance(True, int) evaluates to True, so we need to check for bools separately
-            elif isinstance(value, bool):
-                q = q.insert(
-                    ParameterValue(id),
-                    ParameterValue(key),
-                    None,
-                    None,
-                    None,
-                    ParameterValue(value),
-                )
-            elif isinstance(value, int):
-                q = q.insert(
-                    ParameterValue(id),
-                    ParameterValue(key),
-                    None,
-                    ParameterValue(value),
-                    None,
-                    None,
-                )
-            elif isinstance(value, float):
-                q = q.insert(
-                    ParameterValue(id),
-                    ParameterValue(key),
-                    None,
-                    None,
-                    ParameterValue(value),
-                    None,
-                )
 
-        sql, params = get_sql(q)
-        sql = sql.replace("INSERT", "INSERT OR REPLACE")
-        if sql:
-            cur.execute(sql, params)
-
-        if "chroma:document" in metadata:
-            t = Table("embedding_fulltext_search")
+        deletes: List[Tuple[int]] = []
+        writes: List[LogRecord] = []
+        for record in records:
+            id = record["operation_record"]["id"]
+            operation = record["operation_record"]["operation"]
+            if operation == Operation.DELETE:
+                if id in rowids:
+                    deletes.append((rowids.pop(id),))
+                else:
+                    logger.warning(f"Delete of nonexisting embedding ID: {id}")
+            elif operation == Operation.ADD and id in rowids:
+                # We are trying to add for a record that already exists. Fail the call.
+                # We don't throw an exception since this is in principal an async path
+                logger.warning(f"Insert of existing embedding ID: {id}")
+            elif operation == Operation.UPDATE and id not in rowids:
+                logger.warning(f"Update of nonexisting embedding ID: {id}")
+            else:
+                writes.append(record)
 
-            def insert_into_fulltext_search() -> None:
-                q = (
-                    self._db.querybuilder()
-                    .into(t)
-                    .columns(t.rowid, t.string_value)
-                    .insert(
-                        ParameterValue(id),
-                        ParameterValue(metadata["chroma:document"]),
-                    )
+        if deletes:
+            # Manually delete metadata; cannot use cascade because
+            # that triggers on replace
+            cur.executemany(_DELETE_FULLTEXT, deletes)
+            cur.executemany(_DELETE_METADATA, deletes)
+            cur.executemany(_DELETE_EMBEDDING, deletes)
+        if not writes:
+            return
+
+        # Inserts and updates alike set the seq_id. Can't use INSERT OR REPLACE here
+        # because it changes the primary key.
+        cur.executemany(
+            _UPSERT_EMBEDDING,
+            [
+                (
+                    segment_id,
+                    r["operation_record"]["id"],
+                    _encode_seq_id(r["log_offset"]),
                 )
-                sql, params = get_sql(q)
-                cur.execute(sql, params)
-
-            try:
-                insert_into_fulltext_search()
-            except sqlite3.IntegrityError:
-                q = (
-                    self._db.querybuilder()
-                    .from_(t)
-                    .where(t.rowid == ParameterValue(id))
-                    .delete()
+                for r in writes
+            ],
+        )
+        inserted = [
+            r["operation_record"]["id"]
+            for r in writes
+            if r["operation_record"]["id"] not in rowids
+        ]
+        if inserted:
+            rowids.update(self._embedding_rowids(cur, inserted))
+
+        deleted_keys: List[Tuple[int, str]] = []
+        values: List[Tuple[Any, ...]] = []
+        documents: List[Tuple[int, Optional[str]]] = []
+        for record in writes:
+            metadata = record["operation_record"]["metadata"]
+            if not metadata:
+                continue
+            rowid = rowids[record["operation_record"]["id"]]
+            for key, value in metadata.items():
+                if value is None:
+                    deleted_keys.append((rowid, key))
+                elif isinstance(value, str):
+                    values.append((rowid, key, value, None, None, None))
+                # isinstance(True, int) evaluates to True, so we need to check for bools separately
+                elif isinstance(value, bool):
+                    values.append((rowid, key, None, None, None, value))
+                elif isinstance(value, int):
+                    values.append((rowid, key, None, value, None, None))
+                elif isinstance(value, float):
+                    values.append((rowid, key, None, None, value, None))
+            if "chroma:document" in metadata:
+                documents.append(
+                    (rowid, cast(Optional[str], metadata["chroma:document"]))
                 )
-                sql, params = get_sql(q)
-                cur.execute(sql, params)
-                insert_into_fulltext_search()
 
-    @trace_method("SqliteMetadataSegment._delete_record", OpenTelemetryGranularity.ALL)
-    def _delete_record(self, cur: Cursor, record: LogRecord) -> None:
-        """Delete a single EmbeddingRecord from the DB"""
+        if deleted_keys:
+            cur.executemany(_DELETE_METADATA_KEY, deleted_keys)
+        if values:
+            cur.executemany(_UPSERT_METADATA, values)
+        if documents:
+            # FTS5 tables don't support upserts, so replaced documents are deleted
+            # first and then all are loaded at once
+            cur.executemany(_DELETE_FULLTEXT, [(rowid,) for rowid, _ in documents])
+            cur.executemany(_INSERT_FULLTEXT, documents)
+
+    def _embedding_rowids(self, cur: Cursor, ids: Sequence[str]) -> Dict[str, int]:
+        """Look up the row IDs of the given embedding IDs that exist in the segment"""
         t = Table("embeddings")
-        fts_t = Table("embedding_fulltext_search")
-        q = (
-            self._db.querybuilder()
-            .from_(t)
-            .where(t.segment_id == ParameterValue(self._db.uuid_to_db(self._id)))
-            .where(t.embedding_id == ParameterValue(record["operation_record"]["id"]))
-            .delete()
-        )
-        q_fts = (
-            self._db.querybuilder()
-            .from_(fts_t)
-            .delete()
-            .where(
-                fts_t.rowid.isin(
+        segment_id = self._db.uuid_to_db(self._id)
+        rowids: Dict[str, int] = {}
+        for start in range(0, len(ids), _LOOKUP_CHUNK_SIZE):
+            sql, params = self._db.compiled_sql(
+                "SqliteMetadataSegment._embedding_rowids",
+                lambda segment_id, ids: (
                     self._db.querybuilder()
                     .from_(t)
-                    .select(t.id)
-                    .where(
-                        t.segment_id == ParameterValue(self._db.uuid_to_db(self._id))
-                    )
-                    .where(
-                        t.embedding_id
-                        == ParameterValue(record["operation_record"]["id"])
-                    )
-                )
-            )
-        )
-        cur.execute(*get_sql(q_fts))
-        sql, params = get_sql(q)
-        sql = sql + " RETURNING id"
-        result = cur.execute(sql, params).fetchone()
-        if result is None:
-            logger.warning(
-                f"Delete of nonexisting embedding ID: {record['operation_record']['id']}"
-            )
-        else:
-            id = result[0]
-
-            # Manually delete metadata; cannot use cascade because
-            # that triggers on replace
-            metadata_t = Table("embedding_metadata")
-
-            q = (
-                self._db.querybuilder()
-                .from_(metadata_t)
-                .where(metadata_t.id == ParameterValue(id))
-                .delete()
-            )
-            sql, params = get_sql(q)
-            cur.execute(sql, params)
-
-    @trace_method("SqliteMetadataSegment._update_record", OpenTelemetryGranularity.ALL)
-    def _update_record(self, cur: Cursor, record: LogRecord) -> None:
-        """Update a single EmbeddingRecord in the DB"""
-        t = Table("embeddings")
-        q = (
-            self._db.querybuilder()
-            .update(t)
-            .set(t.seq_id, ParameterValue(_encode_seq_id(record["log_offset"])))
-            .where(t.segment_id == ParameterValue(self._db.uuid_to_db(self._id)))
-            .where(t.embedding_id == ParameterValue(record["operation_record"]["id"]))
-        )
-        sql, params = get_sql(q)
-        sql = sql + " RETURNING id"
-        result = cur.execute(sql, params).fetchone()
-        if result is None:
-            logger.warning(
-                f"Update of nonexisting embedding ID: {record['operation_record']['id']}"
+                    .select(t.embedding_id, t.id)
+                    .where(t.segment_id == ParameterValue(segment_id))
+                    .where(t.embedding_id.isin(ParameterValue(ids)))
+                ),
+                segment_id,
+                list(ids[start : start + _LOOKUP_CHUNK_SIZE]),
             )
-        else:
-            id = result[0]
-            if record["operation_record"]["metadata"]:
-                self._update_metadata(cur, id, record["operation_record"]["metadata"])
-
-    @trace_method("SqliteMetadataSegment._write_metadata", OpenTelemetryGranularity.ALL)
-    def _write_metadata(self, records: Sequence[LogRecord]) -> None:
-        """Write embedding metadata to the database. Care should be taken to ensure
-        records are append-only (that is, that seq-ids should increase monotonically)"""
-        with self._db.tx() as cur:
-            for record in records:
-                q = (
-                    self._db.querybuilder()
-                    .into(Table("max_seq_id"))
-                    .columns("segment_id", "seq_id")
-                    .insert(
-                        ParameterValue(self._db.uuid_to_db(self._id)),
-                        ParameterValue(_encode_seq_id(record["log_offset"])),
-                    )
-                )
-                sql, params = get_sql(q)
-                sql = sql.replace("INSERT", "INSERT OR REPLACE")
-                cur.execute(sql, params)
-
-                if record["operation_record"]["operation"] == Operation.ADD:
-                    self._insert_record(cur, record, False)
-                elif record["operation_record"]["operation"] == Operation.UPSERT:
-                    self._insert_record(cur, record, True)
-                elif record["operation_record"]["operation"] == Operation.DELETE:
-                    self._delete_record(cur, record)
-                elif record["operation_record"]["operation"] == Operation.UPDATE:
-                    self._update_record(cur, record)
+            for embedding_id, rowid in cur.execute(sql, params).fetchall():
+                rowids[embedding_id] = rowid
+        return rowids
 
     @trace_method(
         "SqliteMetadataSegment._where_map_criterion", OpenTelemetryGranularity.ALL
@@ -537,7 +490,7 @@ class SqliteMetadataSegment(MetadataReader):
                     .where(metadata_t.key == ParameterValue(k))
                     .where(_where_clause(expr, metadata_t))
                 )
-                clause.append(metadata_t.id.isin(sq))
+                clause.append(embeddings_t.id.isin(sq))
         return reduce(lambda x, y: x & y, clause)
 
     @trace_method(
@@ -569,33 +522,59 @@ class SqliteMetadataSegment(MetadataReader):
                 ]
                 return reduce(lambda x, y: x | y, criteria)
             elif k == "$contains":
-                v = cast(str, v)
-                search_term = f"%{v}%"
-
-                sq = (
-                    self._db.querybuilder()
-                    .from_(fulltext_t)
-                    .select(fulltext_t.rowid)
-                    .where(fulltext_t.string_value.like(ParameterValue(search_term)))
+                return embeddings_t.id.isin(
+                    self._contains_query(cast(str, v), fulltext_t)
                 )
-                return metadata_t.id.isin(sq)
             elif k == "$not_contains":
-                v = cast(str, v)
-                search_term = f"%{v}%"
-
-                sq = (
+                # The documents that do not contain the term
+                documents = (
                     self._db.querybuilder()
                     .from_(fulltext_t)
                     .select(fulltext_t.rowid)
-                    .where(
-                        fulltext_t.string_value.not_like(ParameterValue(search_term))
-                    )
+                    .where(fulltext_t.string_value.notnull())
                 )
+                return embeddings_t.id.isin(documents) & embeddings_t.id.notin(
+                    self._contains_query(cast(str, v), fulltext_t)
+                )
+            elif k == "$match" or k == "$phrase":
+                v = cast(str, v)
+                terms = v.split() if k == "$match" else [v]
+                if len(terms) == 0:
+                    raise ValueError(f"Expected {k} to contain a term, got {v!r}")
+                # Terms too short for the trigram index are searched for with instr
+                # instead, which only scans the documents the others matched
+                fts_terms = [term for term in terms if len(term) >= _MIN_MATCH_LENGTH]
+                sq = self._db.querybuilder().from_(fulltext_t).select(fulltext_t.rowid)
+                if len(fts_terms) > 0:
+                    sq = sq.where(
+                        _match(
+                            fulltext_t,
+                            " AND ".join(_fts_phrase(term) for term in fts_terms),
+                        )
+                    )
+                for term in terms:
+                    if len(term) < _MIN_MATCH_LENGTH:
+                        sq = sq.where(_contains_ignoring_case(fulltext_t, term))
                 return embeddings_t.id.isin(sq)
             else:
                 raise ValueError(f"Unknown where_doc operator {k}")
         raise ValueError("Empty where_doc")
 
+    def _contains_query(self, term: str, fulltext_t: Table) -> QueryBuilder:
+        """Select the documents that contain the term. The trigram index narrows them
+        down with a MATCH, which ignores case, and LIKE then compares them with the
+        term. Terms that are too short for trigrams, or contain LIKE wildcards, are
+        only compared with LIKE."""
+        q = (
+            self._db.querybuilder()
+            .from_(fulltext_t)
+            .select(fulltext_t.rowid)
+            .where(fulltext_t.string_value.like(ParameterValue(f"%{term}%")))
+        )
+        if len(term) >= _MIN_MATCH_LENGTH and not any(c in term for c in "%_"):
+            q = q.where(_match(fulltext_t, _fts_phrase(term)))
+        return q
+
     @trace_method("SqliteMetadataSegment.delete", OpenTelemetryGranularity.ALL)
     @override
     def delete(self) -> None:
@@ -653,6 +632,52 @@ class SqliteMetadataSegment(MetadataReader):
             cur.execute(*get_sql(q))
 
 
+def _distinct_id_runs(records: Sequence[LogRecord]) -> List[Sequence[LogRecord]]:
+    """Split records into consecutive runs in which no embedding ID repeats"""
+    runs: List[Sequence[LogRecord]] = []
+    start = 0
+    seen: Set[str] = set()
+    for i, record in enumerate(records):
+        id = record["operation_record"]["id"]
+        if id in seen:
+            runs.append(records[start:i])
+            start = i
+            seen = set()
+        seen.add(id)
+    runs.append(records[start:])
+    return runs
+
+
+class _FullTextComparator(Comparator):  # type: ignore
+    match = " MATCH "
+
+
+def _match(fulltext_t: Table, query: str) -> Criterion:
+    """Return a criterion matching the full text search table with a FTS5 query"""
+    return BasicCriterion(
+        _FullTextComparator.match, fulltext_t.string_value, ParameterValue(query)
+    )
+
+
+def _contains_ignoring_case(fulltext_t: Table, term: str) -> Criterion:
+    """Return a criterion matching the documents that contain the term, ignoring
+    ASCII case. Unlike LIKE, it has no wildcards."""
+    return (
+        fn.Function(
+            "instr",
+            fn.Lower(fulltext_t.string_value),
+            fn.Lower(ParameterValue(term)),
+        )
+        > 0
+    )
+
+
+def _fts_phrase(term: str) -> str:
+    """Quote a term as an FTS5 phrase, which the trigram tokenizer matches anywhere in
+    a document, ignoring case"""
+    return '"' + term.replace('"', '""') + '"'
+
+
 def _encode_seq_id(seq_id: SeqId) -> bytes:
     """Encode a SeqID into a byte array"""
     if seq_id.bit_length() <= 64:
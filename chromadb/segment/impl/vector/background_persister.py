@@ -0,0 +1,84 @@
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundPersister:
+    """Runs a flush callback on a dedicated thread, off the write path.
+
+    Requests made while a flush is pending or running are coalesced: the callback is
+    expected to write everything that is dirty at the time it runs, so any number of
+    requests arriving during a flush are served by a single follow-up flush. The
+    thread is started on the first request. A flush may request another one, which
+    is served even if the persister is stopping.
+    """
+
+    _flush: Callable[[], None]
+    _name: str
+    _condition: threading.Condition
+    _thread: Optional[threading.Thread]
+    # Whether a flush has been requested and not started yet
+    _pending: bool
+    # Whether a flush is currently running
+    _flushing: bool
+    _stopped: bool
+
+    def __init__(self, flush: Callable[[], None], name: str):
+        self._flush = flush
+        self._name = name
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pending = False
+        self._flushing = False
+        self._stopped = False
+
+    def request(self) -> None:
+        """Ask for a flush without waiting for it"""
+        with self._condition:
+            if self._stopped and threading.current_thread() is not self._thread:
+                raise RuntimeError("Cannot request a flush from a stopped persister")
+            self._pending = True
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=self._name, daemon=True
+                )
+                self._thread.start()
+            self._condition.notify_all()
+
+    def wait(self) -> None:
+        """Block until every flush requested so far has completed"""
+        with self._condition:
+            while self._pending or self._flushing:
+                self._condition.wait()
+
+    def stop(self, flush: bool = True) -> None:
+        """Stop the thread, first completing any requested flush unless flush is
+        False"""
+        with self._condition:
+            if not flush:
+                self._pending = False
+            self._stopped = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                self._pending = False
+                self._flushing = True
+            try:
+                self._flush()
+            except Exception:
+                logger.exception(f"Background flush failed in {self._name}")
+            finally:
+                with self._condition:
+                    self._flushing = False
+                    self._condition.notify_all()
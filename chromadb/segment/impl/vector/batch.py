@@ -1,118 +1,177 @@
-from typing import Dict, List, Set, cast
+from typing import AbstractSet, Dict, List, Optional
 
-from chromadb.types import LogRecord, Operation, SeqId, Vector
+import numpy as np
+import numpy.typing as npt
 
+from chromadb.errors import InvalidDimensionException
+from chromadb.types import LogRecord, Operation, SeqId
 
-class Batch:
-    """Used to model the set of changes as an atomic operation"""
 
-    _ids_to_records: Dict[str, LogRecord]
-    _deleted_ids: Set[str]
-    _written_ids: Set[str]
-    _upsert_add_ids: Set[str]  # IDs that are being added in an upsert
+class Batch:
+    """Used to model the set of changes as an atomic operation.
+
+    Changes are stored by column: each id the batch touches gets a row, holding the
+    state of the id after its last change, whether it existed before the batch, and
+    the seq_id of its last change. Written vectors are copied into one preallocated
+    float32 array, so that they can be passed to the index as is. A later change to
+    an id overwrites its row, which dedups the changes made to the same id.
+    """
+
+    _INITIAL_CAPACITY = 64
+
+    # Row states
+    _WRITTEN = 1
+    _DELETED = 2
+
+    _rows: Dict[str, int]
+    _ids: List[str]
+    _states: npt.NDArray[np.uint8]
+    _existed: npt.NDArray[np.bool_]
+    _seq_ids: npt.NDArray[np.int64]
+    # Allocated on the first write, once the dimensionality is known
+    _vectors: Optional[npt.NDArray[np.float32]]
     add_count: int
     update_count: int
+    _delete_count: int
     max_seq_id: SeqId
 
     def __init__(self) -> None:
-        self._ids_to_records = {}
-        self._deleted_ids = set()
-        self._written_ids = set()
-        self._upsert_add_ids = set()
+        self._rows = {}
+        self._ids = []
+        self._states = np.zeros(self._INITIAL_CAPACITY, dtype=np.uint8)
+        self._existed = np.zeros(self._INITIAL_CAPACITY, dtype=np.bool_)
+        self._seq_ids = np.zeros(self._INITIAL_CAPACITY, dtype=np.int64)
+        self._vectors = None
         self.add_count = 0
         self.update_count = 0
+        self._delete_count = 0
         self.max_seq_id = 0
 
     def __len__(self) -> int:
         """Get the number of changes in this batch"""
-        return len(self._written_ids) + len(self._deleted_ids)
+        return self.add_count + self.update_count + self._delete_count
 
     def get_deleted_ids(self) -> List[str]:
         """Get the list of deleted embeddings in this batch"""
-        return list(self._deleted_ids)
+        return self._ids_where(self._deleted_mask())
 
     def get_written_ids(self) -> List[str]:
         """Get the list of written embeddings in this batch"""
-        return list(self._written_ids)
-
-    def get_written_vectors(self, ids: List[str]) -> List[Vector]:
-        """Get the list of vectors to write in this batch"""
-        return [
-            cast(Vector, self._ids_to_records[id]["operation_record"]["embedding"])
-            for id in ids
-        ]
-
-    def get_record(self, id: str) -> LogRecord:
-        """Get the record for a given ID"""
-        return self._ids_to_records[id]
+        return self._ids_where(self._written_mask())
+
+    def get_ids(self) -> AbstractSet[str]:
+        """Get the ids of all embeddings written or deleted in this batch, as a view
+        that follows later changes"""
+        return self._rows.keys()
+
+    def get_written_vectors(self, ids: List[str]) -> npt.NDArray[np.float32]:
+        """Get the vectors to write for the given ids of written embeddings, as a
+        contiguous float32 array with a row per id"""
+        if self._vectors is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        rows = np.fromiter((self._rows[id] for id in ids), dtype=np.int64)
+        return self._vectors[rows]
+
+    def get_written_seq_ids(self, ids: List[str]) -> List[SeqId]:
+        """Get the seq_ids of the last changes to the given ids"""
+        rows = np.fromiter((self._rows[id] for id in ids), dtype=np.int64)
+        return self._seq_ids[rows].tolist()  # type: ignore[no-any-return]
+
+    def is_written(self, id: str) -> bool:
+        """Check if a given ID is written"""
+        row = self._rows.get(id)
+        return row is not None and self._states[row] == self._WRITTEN
 
     def is_deleted(self, id: str) -> bool:
         """Check if a given ID is deleted"""
-        return id in self._deleted_ids
+        row = self._rows.get(id)
+        return (
+            row is not None
+            and self._states[row] == self._DELETED
+            and bool(self._existed[row])
+        )
 
     @property
     def delete_count(self) -> int:
-        return len(self._deleted_ids)
+        return self._delete_count
 
     def apply(self, record: LogRecord, exists_already: bool = False) -> None:
         """Apply an embedding record to this batch. Records passed to this method are assumed to be validated for correctness.
         For example, a delete or update presumes the ID exists in the index. An add presumes the ID does not exist in the index.
         The exists_already flag should be set to True if the ID does exist in the index, and False otherwise.
         """
-
-        id = record["operation_record"]["id"]
-        if record["operation_record"]["operation"] == Operation.DELETE:
-            # If the ID was previously written, remove it from the written set
-            # And update the add/update/delete counts
-            if id in self._written_ids:
-                self._written_ids.remove(id)
-                if (
-                    self._ids_to_records[id]["operation_record"]["operation"]
-                    == Operation.ADD
-                ):
-                    self.add_count -= 1
-                elif (
-                    self._ids_to_records[id]["operation_record"]["operation"]
-                    == Operation.UPDATE
-                ):
-                    self.update_count -= 1
-                    self._deleted_ids.add(id)
-                elif (
-                    self._ids_to_records[id]["operation_record"]["operation"]
-                    == Operation.UPSERT
-                ):
-                    if id in self._upsert_add_ids:
-                        self.add_count -= 1
-                        self._upsert_add_ids.remove(id)
-                    else:
-                        self.update_count -= 1
-                        self._deleted_ids.add(id)
-            elif id not in self._deleted_ids:
-                self._deleted_ids.add(id)
-
-            # Remove the record from the batch
-            if id in self._ids_to_records:
-                del self._ids_to_records[id]
-
+        operation_record = record["operation_record"]
+        id = operation_record["id"]
+        operation = operation_record["operation"]
+
+        row = self._rows.get(id)
+        if row is None:
+            # Whether the id is in the index is known from its first change in the
+            # batch, later changes only change its state
+            existed = operation in (Operation.DELETE, Operation.UPDATE) or (
+                operation == Operation.UPSERT and exists_already
+            )
+            row = self._add_row(id, existed)
         else:
-            self._ids_to_records[id] = record
-            self._written_ids.add(id)
-
-            # If the ID was previously deleted, remove it from the deleted set
-            # And update the delete count
-            if id in self._deleted_ids:
-                self._deleted_ids.remove(id)
-
-            # Update the add/update counts
-            if record["operation_record"]["operation"] == Operation.UPSERT:
-                if not exists_already:
-                    self.add_count += 1
-                    self._upsert_add_ids.add(id)
-                else:
-                    self.update_count += 1
-            elif record["operation_record"]["operation"] == Operation.ADD:
-                self.add_count += 1
-            elif record["operation_record"]["operation"] == Operation.UPDATE:
-                self.update_count += 1
+            self._count(row, -1)
 
+        if operation == Operation.DELETE:
+            self._states[row] = self._DELETED
+        else:
+            self._write_vector(row, operation_record["embedding"])
+            self._states[row] = self._WRITTEN
+        self._count(row, 1)
+        self._seq_ids[row] = record["log_offset"]
         self.max_seq_id = max(self.max_seq_id, record["log_offset"])
+
+    def _add_row(self, id: str, existed: bool) -> int:
+        row = len(self._ids)
+        if row == len(self._states):
+            self._grow(2 * row)
+        self._rows[id] = row
+        self._ids.append(id)
+        self._existed[row] = existed
+        return row
+
+    def _count(self, row: int, delta: int) -> None:
+        """Add the change in a row to the counts, or remove it with a delta of -1"""
+        state = self._states[row]
+        existed = self._existed[row]
+        if state == self._WRITTEN:
+            if existed:
+                self.update_count += delta
+            else:
+                self.add_count += delta
+        elif state == self._DELETED and existed:
+            self._delete_count += delta
+
+    def _write_vector(self, row: int, vector: Optional[object]) -> None:
+        vector = np.asarray(vector, dtype=np.float32)
+        if self._vectors is None:
+            self._vectors = np.zeros((len(self._states), len(vector)), dtype=np.float32)
+        elif vector.shape != (self._vectors.shape[1],):
+            raise InvalidDimensionException(
+                f"Dimensionality of ({len(vector)}) does not match the "
+                + f"dimensionality of the batch ({self._vectors.shape[1]})"
+            )
+        self._vectors[row] = vector
+
+    def _grow(self, capacity: int) -> None:
+        added = capacity - len(self._states)
+        self._states = np.concatenate([self._states, np.zeros(added, np.uint8)])
+        self._existed = np.concatenate([self._existed, np.zeros(added, np.bool_)])
+        self._seq_ids = np.concatenate([self._seq_ids, np.zeros(added, np.int64)])
+        if self._vectors is not None:
+            self._vectors = np.concatenate(
+                [self._vectors, np.zeros((added, self._vectors.shape[1]), np.float32)]
+            )
+
+    def _written_mask(self) -> npt.NDArray[np.bool_]:
+        return self._states[: len(self._ids)] == self._WRITTEN
+
+    def _deleted_mask(self) -> npt.NDArray[np.bool_]:
+        n = len(self._ids)
+        return (self._states[:n] == self._DELETED) & self._existed[:n]
+
+    def _ids_where(self, mask: npt.NDArray[np.bool_]) -> List[str]:
+        return [self._ids[row] for row in np.flatnonzero(mask)]
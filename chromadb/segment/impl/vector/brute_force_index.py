@@ -1,14 +1,16 @@
-from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+from typing import Dict, List, Optional, Sequence, cast
 import numpy as np
 import numpy.typing as npt
+from chromadb.utils import distance_functions
+from chromadb.utils.distance_functions import NORM_EPS, within_distance
 from chromadb.types import (
     LogRecord,
+    Vector,
     VectorEmbeddingRecord,
     VectorQuery,
     VectorQueryResult,
 )
 
-from chromadb.utils import distance_functions
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,135 +19,291 @@ logger = logging.getLogger(__name__)
 class BruteForceIndex:
     """A lightweight, numpy based brute force index that is used for batches that have not been indexed into hnsw yet. It is not
     thread safe and callers should ensure that only one thread is accessing it at a time.
+
+    Vectors are stored as float32, the same precision hnswlib uses, alongside the L2
+    norm of every slot so that distance computations reduce to a single dot product
+    per pair. Embeddings are returned as numpy array views rather than Python lists.
+
+    Slots are append only: every upsert writes new slots past the high-water mark,
+    and updates and deletes only record the version at which the previous slot of an
+    id died. Written slots are never changed again, and clearing the index allocates
+    new arrays. A view returned by view() therefore shares the arrays of the index
+    and sees it as of the time it was taken, without copying them.
     """
 
+    # The version a slot dies at while it is live
+    _LIVE = np.iinfo(np.int64).max
+
+    # The slot of each live id
     id_to_index: Dict[str, int]
-    index_to_id: Dict[int, str]
-    id_to_seq_id: Dict[str, int]
-    deleted_ids: Set[str]
-    free_indices: List[int]
+    # The id of each slot below the high-water mark
+    index_to_id: List[str]
     size: int
     dimensionality: int
-    distance_fn: Callable[[npt.NDArray[Any], npt.NDArray[Any]], float]
-    vectors: npt.NDArray[Any]
+    space: str
+    vectors: npt.NDArray[np.float32]
+    # The L2 norm of the vector stored in each slot
+    norms: npt.NDArray[np.float32]
+    # The version at which each slot died, _LIVE for live ones
+    dead_at: npt.NDArray[np.int64]
+    # The number of slots written since the index was last cleared
+    high_water: int
+    # Incremented by every view, so that slots dying later stay live in it
+    version: int
 
     def __init__(self, size: int, dimensionality: int, space: str = "l2"):
-        if space == "l2":
-            self.distance_fn = distance_functions.l2
-        elif space == "ip":
-            self.distance_fn = distance_functions.ip
-        elif space == "cosine":
-            self.distance_fn = distance_functions.cosine
-        else:
+        if space not in ("l2", "ip", "cosine"):
             raise Exception(f"Unknown distance function: {space}")
-
-        self.id_to_index = {}
-        self.index_to_id = {}
-        self.id_to_seq_id = {}
-        self.deleted_ids = set()
-        self.free_indices = list(range(size))
-        self.size = size
+        self.space = space
         self.dimensionality = dimensionality
-        self.vectors = np.zeros((size, dimensionality))
+        self.version = 0
+        self._allocate(size)
 
     def __len__(self) -> int:
         return len(self.id_to_index)
 
-    def clear(self) -> None:
+    def _allocate(self, size: int) -> None:
         self.id_to_index = {}
-        self.index_to_id = {}
-        self.id_to_seq_id = {}
-        self.deleted_ids.clear()
-        self.free_indices = list(range(self.size))
-        self.vectors.fill(0)
+        self.index_to_id = []
+        self.size = size
+        self.vectors = np.empty((size, self.dimensionality), dtype=np.float32)
+        self.norms = np.empty(size, dtype=np.float32)
+        self.dead_at = np.full(size, self._LIVE, dtype=np.int64)
+        self.high_water = 0
 
-    def upsert(self, records: List[LogRecord]) -> None:
-        if len(records) + len(self) > self.size:
-            raise Exception(
-                "Index with capacity {} and {} current entries cannot add {} records".format(
-                    self.size, len(self), len(records)
-                )
-            )
+    def clear(self) -> None:
+        # Views may still read the current arrays
+        self._allocate(self.size)
+
+    def view(self) -> "BruteForceIndexView":
+        """Return a read-only view of the index as it is now, which later changes to
+        the index do not affect"""
+        view = BruteForceIndexView(
+            space=self.space,
+            vectors=self.vectors,
+            norms=self.norms,
+            dead_at=self.dead_at,
+            index_to_id=self.index_to_id,
+            high_water=self.high_water,
+            version=self.version,
+        )
+        self.version += 1
+        return view
 
-        for i, record in enumerate(records):
+    def upsert(self, records: List[LogRecord]) -> None:
+        if len(records) == 0:
+            return
+        self._reserve(len(records))
+        slots = np.arange(self.high_water, self.high_water + len(records))
+        for record, slot in zip(records, slots.tolist()):
             id = record["operation_record"]["id"]
-            vector = record["operation_record"]["embedding"]
-            self.id_to_seq_id[id] = record["log_offset"]
-            if id in self.deleted_ids:
-                self.deleted_ids.remove(id)
-
-            # TODO: It may be faster to use multi-index selection on the vectors array
-            if id in self.id_to_index:
-                # Update
-                index = self.id_to_index[id]
-                self.vectors[index] = vector
-            else:
-                # Add
-                next_index = self.free_indices.pop()
-                self.id_to_index[id] = next_index
-                self.index_to_id[next_index] = id
-                self.vectors[next_index] = vector
+            previous = self.id_to_index.get(id)
+            if previous is not None:
+                self.dead_at[previous] = self.version
+            self.id_to_index[id] = slot
+            self.index_to_id.append(id)
+
+        self.vectors[slots] = np.asarray(
+            [record["operation_record"]["embedding"] for record in records],
+            dtype=np.float32,
+        )
+        self.norms[slots] = np.linalg.norm(self.vectors[slots], axis=1)
+        self.high_water += len(records)
+
+    def _reserve(self, n: int) -> None:
+        """Make room for n more slots past the high-water mark. The live slots are
+        moved to new arrays, which are grown unless dead slots take up at least half
+        of the current ones. Views keep the arrays they share."""
+        if self.high_water + n <= self.size:
+            return
+        live = len(self.id_to_index)
+        size = self.size if 2 * (live + n) <= self.size else 2 * (live + n)
+        ids = list(self.id_to_index.keys())
+        slots = np.fromiter(self.id_to_index.values(), dtype=np.intp, count=live)
+        vectors, norms = self.vectors, self.norms
+        self._allocate(size)
+        self.vectors[:live] = vectors[slots]
+        self.norms[:live] = norms[slots]
+        self.id_to_index = {id: slot for slot, id in enumerate(ids)}
+        self.index_to_id = ids
+        self.high_water = live
 
     def delete(self, records: List[LogRecord]) -> None:
         for record in records:
             id = record["operation_record"]["id"]
-            if id in self.id_to_index:
-                index = self.id_to_index[id]
-                self.deleted_ids.add(id)
-                del self.id_to_index[id]
-                del self.index_to_id[index]
-                del self.id_to_seq_id[id]
-                self.vectors[index].fill(np.NaN)
-                self.free_indices.append(index)
+            index = self.id_to_index.pop(id, None)
+            if index is not None:
+                self.dead_at[index] = self.version
             else:
                 logger.warning(f"Delete of nonexisting embedding ID: {id}")
 
     def has_id(self, id: str) -> bool:
         """Returns whether the index contains the given ID"""
-        return id in self.id_to_index and id not in self.deleted_ids
+        return id in self.id_to_index
+
+    def get_vectors(
+        self, ids: Optional[Sequence[str]] = None
+    ) -> Sequence[VectorEmbeddingRecord]:
+        return self._current().get_vectors(ids)
+
+    def query(self, query: VectorQuery) -> Sequence[Sequence[VectorQueryResult]]:
+        return self._current().query(query)
+
+    def _current(self) -> "BruteForceIndexView":
+        """A view of the index as it is now, which is only valid until it changes"""
+        return BruteForceIndexView(
+            space=self.space,
+            vectors=self.vectors,
+            norms=self.norms,
+            dead_at=self.dead_at,
+            index_to_id=self.index_to_id,
+            high_water=self.high_water,
+            version=self.version,
+            id_to_index=self.id_to_index,
+        )
+
+
+class BruteForceIndexView:
+    """A read-only view of a BruteForceIndex as of the version it was taken at. It
+    holds the slots below the high-water mark of that time which had not died by
+    then. It never changes, so any number of threads may read it."""
+
+    space: str
+    vectors: npt.NDArray[np.float32]
+    norms: npt.NDArray[np.float32]
+    dead_at: npt.NDArray[np.int64]
+    index_to_id: List[str]
+    high_water: int
+    version: int
+    # Built on first use from the live slots
+    _id_to_index: Optional[Dict[str, int]]
+
+    def __init__(
+        self,
+        space: str,
+        vectors: npt.NDArray[np.float32],
+        norms: npt.NDArray[np.float32],
+        dead_at: npt.NDArray[np.int64],
+        index_to_id: List[str],
+        high_water: int,
+        version: int,
+        id_to_index: Optional[Dict[str, int]] = None,
+    ):
+        self.space = space
+        self.vectors = vectors
+        self.norms = norms
+        self.dead_at = dead_at
+        self.index_to_id = index_to_id
+        self.high_water = high_water
+        self.version = version
+        self._id_to_index = id_to_index
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._live()))
+
+    def _live(self) -> npt.NDArray[np.bool_]:
+        """Whether each slot below the high-water mark is live in this view"""
+        return cast(
+            npt.NDArray[np.bool_], self.dead_at[: self.high_water] > self.version
+        )
+
+    def id_to_index(self) -> Dict[str, int]:
+        """The slot of each live id"""
+        if self._id_to_index is None:
+            self._id_to_index = {
+                self.index_to_id[slot]: slot
+                for slot in np.flatnonzero(self._live()).tolist()
+            }
+        return self._id_to_index
+
+    def has_id(self, id: str) -> bool:
+        """Returns whether the view contains the given ID"""
+        return id in self.id_to_index()
 
     def get_vectors(
         self, ids: Optional[Sequence[str]] = None
     ) -> Sequence[VectorEmbeddingRecord]:
-        target_ids = ids or self.id_to_index.keys()
+        id_to_index = self.id_to_index()
+        target_ids = ids or list(id_to_index.keys())
 
+        # Gather all requested rows at once; each returned embedding is a view into
+        # this copy, so later writes to the buffer do not alter the results.
+        vectors = self.vectors[[id_to_index[id] for id in target_ids]]
         return [
-            VectorEmbeddingRecord(
-                id=id,
-                embedding=self.vectors[self.id_to_index[id]].tolist(),
-            )
-            for id in target_ids
+            VectorEmbeddingRecord(id=id, embedding=cast(Vector, vector))
+            for id, vector in zip(target_ids, vectors)
         ]
 
     def query(self, query: VectorQuery) -> Sequence[Sequence[VectorQueryResult]]:
-        np_query = np.array(query["vectors"])
-        allowed_ids = (
-            None if query["allowed_ids"] is None else set(query["allowed_ids"])
-        )
-        distances = np.apply_along_axis(
-            lambda query: np.apply_along_axis(self.distance_fn, 1, self.vectors, query),
-            1,
-            np_query,
+        """Return the top-k nearest live entries for each query vector, sorted by
+        ascending distance. All query vectors are scored in a single matrix
+        product against the occupied slots of the buffer."""
+        n_queries = len(query["vectors"])
+        mask = self._live()
+        if query["allowed_ids"] is not None:
+            id_to_index = self.id_to_index()
+            mask = np.zeros(self.high_water, dtype=bool)
+            allowed_slots = [
+                id_to_index[id] for id in query["allowed_ids"] if id in id_to_index
+            ]
+            mask[allowed_slots] = True
+        slots = np.flatnonzero(mask)
+
+        k = min(query["k"], len(slots))
+        if n_queries == 0 or k <= 0:
+            return [[] for _ in range(n_queries)]
+
+        np_query = np.asarray(query["vectors"], dtype=np.float32)
+        distances = distance_functions.pairwise(
+            self.space, np_query, self.vectors[slots], self.norms[slots]
         )
+        top, _ = distance_functions.top_k(distances, k)
+        top_slots = slots[top]
+
+        # The expanded distances are only used to select candidates, which are then
+        # rescored exactly and sorted
+        top_vectors = self.vectors[top_slots]
+        top_distances = self._exact_distances(np_query, top_vectors)
+        order = np.argsort(top_distances, axis=1, kind="stable")
+        top_slots = np.take_along_axis(top_slots, order, axis=1)
+        top_distances = np.take_along_axis(top_distances, order, axis=1)
+        top_vectors = np.take_along_axis(top_vectors, order[:, :, None], axis=1)
+        counts = within_distance(top_distances, query.get("max_distance"))
+
+        include_embeddings = query["include_embeddings"]
+        results: List[List[VectorQueryResult]] = []
+        for i, (slot_row, distance_row, count) in enumerate(
+            zip(top_slots.tolist(), top_distances.tolist(), counts.tolist())
+        ):
+            results.append(
+                [
+                    VectorQueryResult(
+                        id=self.index_to_id[slot],
+                        distance=distance,
+                        embedding=cast(Vector, top_vectors[i, j])
+                        if include_embeddings
+                        else None,
+                    )
+                    for j, (slot, distance) in enumerate(
+                        zip(slot_row[:count], distance_row[:count])
+                    )
+                ]
+            )
+        return results
 
-        indices = np.argsort(distances).tolist()
-        # Filter out deleted labels
-        filtered_results = []
-        for i, index_list in enumerate(indices):
-            curr_results = []
-            for j in index_list:
-                # If the index is in the index_to_id map, then it has been added
-                if j in self.index_to_id:
-                    id = self.index_to_id[j]
-                    if id not in self.deleted_ids and (
-                        allowed_ids is None or id in allowed_ids
-                    ):
-                        curr_results.append(
-                            VectorQueryResult(
-                                id=id,
-                                distance=distances[i][j].item(),
-                                embedding=self.vectors[j].tolist(),
-                            )
-                        )
-            filtered_results.append(curr_results)
-        return filtered_results
+    def _exact_distances(
+        self, queries: npt.NDArray[np.float32], vectors: npt.NDArray[np.float32]
+    ) -> npt.NDArray[np.float64]:
+        """Compute the distances between each query vector (n_queries, dim) and its
+        own candidate vectors (n_queries, k, dim) in float64."""
+        queries_64 = queries.astype(np.float64)
+        vectors_64 = vectors.astype(np.float64)
+        if self.space == "l2":
+            diffs = vectors_64 - queries_64[:, None, :]
+            return np.einsum("ijk,ijk->ij", diffs, diffs)
+        dots = np.einsum("ijk,ik->ij", vectors_64, queries_64)
+        if self.space == "ip":
+            return 1 - dots
+        query_norms = np.linalg.norm(queries_64, axis=1) + NORM_EPS
+        vector_norms = np.linalg.norm(vectors_64, axis=2) + NORM_EPS
+        return 1 - dots / (query_norms[:, None] * vector_norms)
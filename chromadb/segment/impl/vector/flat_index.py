@@ -0,0 +1,170 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from chromadb.segment.impl.vector.mapped_index import MappedIndex, label_filter_mask
+from chromadb.utils import distance_functions
+
+
+class FlatIndex(MappedIndex):
+    """An exact vector index that answers queries by computing the distance to every
+    live vector, in batched matrix products.
+
+    Vectors are stored by label in a single float32 array, which is memory-mapped
+    from one file when the index is persistent. Which labels are live is part of the
+    metadata.
+    """
+
+    METADATA_FILE = "flat_index.npz"
+    VECTORS_FILE = "flat_vectors.bin"
+
+    # Scan at most this many bytes of vectors at once
+    _SCAN_CHUNK_BYTES = 1 << 24
+
+    # Label states
+    _UNUSED = 0
+    _LIVE = 1
+    _DELETED = 2
+
+    _states: npt.NDArray[np.uint8]
+
+    def __init__(self, space: str, dim: int):
+        super().__init__(space, dim)
+        self._layouts[self.VECTORS_FILE] = (np.float32, (dim,))
+
+    def add_items(self, data: Any, ids: Sequence[int]) -> None:
+        """Add or update the vectors of the given labels"""
+        vectors, labels = self._items(data, ids)
+        if len(labels) == 0:
+            return
+        if labels.max() >= len(self._states):
+            self._grow_labels(int(labels.max()) + 1)
+        new_labels = np.unique(labels[self._states[labels] == self._UNUSED])
+        if self._element_count + len(new_labels) > self._max_elements:
+            raise RuntimeError("The number of elements exceeds the specified limit")
+
+        self._write(labels, vectors)
+        self._states[labels] = self._LIVE
+        self._element_count += len(new_labels)
+
+    def mark_deleted(self, label: int) -> None:
+        """Delete the given label. Deleting it again is a no-op, so that replaying a
+        delete whose effect was already persisted succeeds."""
+        if label >= len(self._states) or self._states[label] == self._UNUSED:
+            raise RuntimeError("Label not found")
+        self._states[label] = self._DELETED
+
+    def get_items(self, ids: Sequence[int]) -> List[List[float]]:
+        """Return the full-precision vectors of the given labels"""
+        labels = np.asarray(ids, dtype=np.int64)
+        if len(labels) == 0:
+            return []
+        if (
+            labels.max() >= len(self._states)
+            or (self._states[labels] != self._LIVE).any()
+        ):
+            raise RuntimeError("Label not found")
+        vectors = self._stored(self.VECTORS_FILE)
+        return vectors[labels].tolist()  # type: ignore[no-any-return]
+
+    def knn_query(
+        self,
+        data: Any,
+        k: int = 1,
+        num_threads: int = -1,
+        filter: Optional[Callable[[int], bool]] = None,
+    ) -> Tuple[npt.NDArray[np.uint64], npt.NDArray[np.float32]]:
+        """Return the labels and distances of the k nearest live vectors to each
+        query, for the labels accepted by filter"""
+        queries = self._normalized(np.atleast_2d(np.asarray(data, dtype=np.float32)))
+        n_queries = len(queries)
+
+        live = np.flatnonzero(self._states == self._LIVE)
+        if filter is not None:
+            live = live[label_filter_mask(live, filter)]
+        if len(live) < k:
+            raise RuntimeError(
+                "Cannot return the results in a contigious 2D array. Probably ef or M is too small"
+            )
+        if k == 0 or n_queries == 0:
+            return self._no_results(n_queries)
+
+        # The candidates are selected by the distances of pairwise, which expands
+        # l2, and then rescored exactly
+        candidates = self._candidates(queries, live, k)
+        labels, distances = self._rerank(
+            queries, candidates, self._stored(self.VECTORS_FILE)[candidates], k
+        )
+        return labels.astype(np.uint64), distances
+
+    def _init(self, rows: int) -> None:
+        self._states = np.zeros(rows, dtype=np.uint8)
+        for name in self._layouts:
+            self._store(name, rows)
+
+    def _load(self, data: Any) -> None:
+        self._states = data["states"]
+        self._element_count = int(np.count_nonzero(self._states != self._UNUSED))
+
+    def _metadata(self) -> Dict[str, Any]:
+        return {"states": self._states}
+
+    def _grow_labels(self, rows: int) -> None:
+        current = len(self._states)
+        if rows <= current:
+            return
+        rows = max(rows, int(current * 1.5))
+        self._states = np.concatenate(
+            [self._states, np.zeros(rows - current, dtype=np.uint8)]
+        )
+        for name in self._layouts:
+            self._grow_stored(name, rows)
+
+    def _write(
+        self, labels: npt.NDArray[np.int64], vectors: npt.NDArray[np.float32]
+    ) -> None:
+        """Store the vectors of the given labels"""
+        self._stored(self.VECTORS_FILE)[labels] = vectors
+
+    def _candidates(
+        self, queries: npt.NDArray[np.float32], labels: npt.NDArray[np.int64], k: int
+    ) -> npt.NDArray[np.int64]:
+        """Return the candidates for the k nearest of the given labels to each
+        query"""
+        return self._scan(queries, labels, k)
+
+    def _scan(
+        self, queries: npt.NDArray[np.float32], labels: npt.NDArray[np.int64], n: int
+    ) -> npt.NDArray[np.int64]:
+        """Return the n of the given labels nearest to each query by the distances
+        to their _scanned_vectors, scanning them in chunks"""
+        # Cosine vectors are normalized on insertion, so it reduces to ip
+        space = "ip" if self.space == "cosine" else self.space
+        chunk_size = max(n, self._SCAN_CHUNK_BYTES // self._scanned_row_bytes())
+
+        best_labels = np.zeros((len(queries), 0), dtype=np.int64)
+        best_distances = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(labels), chunk_size):
+            chunk = labels[start : start + chunk_size]
+            distances = distance_functions.pairwise(
+                space, queries, self._scanned_vectors(chunk)
+            )
+            chunk_labels = np.concatenate(
+                [best_labels, np.broadcast_to(chunk, distances.shape)], axis=1
+            )
+            distances = np.concatenate([best_distances, distances], axis=1)
+            top, best_distances = distance_functions.top_k(distances, n)
+            best_labels = np.take_along_axis(chunk_labels, top, axis=1)
+        return best_labels
+
+    def _scanned_vectors(self, labels: npt.NDArray[np.int64]) -> npt.NDArray[Any]:
+        """Return the vectors scanned for the given sorted labels"""
+        vectors = self._stored(self.VECTORS_FILE)
+        # Contiguous labels are scanned in place rather than copied
+        if labels[-1] - labels[0] + 1 == len(labels):
+            return vectors[labels[0] : labels[-1] + 1]
+        return vectors[labels]
+
+    def _scanned_row_bytes(self) -> int:
+        return self._row_bytes(self.VECTORS_FILE)
@@ -0,0 +1,24 @@
+from typing import Dict
+
+from chromadb.segment.impl.vector.hnsw_params import Params, Validator
+from chromadb.types import Metadata
+
+flat_param_validators: Dict[str, Validator] = {
+    "flat:promotion_threshold": lambda p: isinstance(p, int) and p > 0,
+}
+
+
+class FlatParams(Params):
+    # Promote the segment to an hnsw index once it holds this many embeddings
+    promotion_threshold: int
+
+    def __init__(self, metadata: Metadata):
+        metadata = metadata or {}
+        self.promotion_threshold = int(metadata.get("flat:promotion_threshold", 50000))
+
+    @staticmethod
+    def extract(metadata: Metadata) -> Metadata:
+        """Validate and return only the relevant flat params"""
+        segment_metadata = FlatParams._select(metadata, prefix="flat:")
+        FlatParams._validate(segment_metadata, flat_param_validators, kind="flat")
+        return segment_metadata
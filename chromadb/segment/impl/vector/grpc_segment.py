@@ -73,11 +73,15 @@ class GrpcVectorSegment(VectorReader, EnforceOverrides):
             segment_id=self._segment["id"].hex,
         )
         response: QueryVectorsResponse = self._vector_reader_stub.QueryVectors(request)
+        # The query service has no radius, so the results are cut off here
+        max_distance = query.get("max_distance")
         results: List[List[VectorQueryResult]] = []
         for result in response.results:
             curr_result: List[VectorQueryResult] = []
             for r in result.results:
-                curr_result.append(from_proto_vector_query_result(r))
+                vector_result = from_proto_vector_query_result(r)
+                if max_distance is None or vector_result["distance"] <= max_distance:
+                    curr_result.append(vector_result)
             results.append(curr_result)
         return results
 
@@ -1,7 +1,8 @@
 import multiprocessing
 import re
-from typing import Any, Callable, Dict, Union
+from typing import Any, Callable, Dict, Optional, Union
 
+from chromadb.segment.impl.vector.quantization import QUANTIZATIONS
 from chromadb.types import Metadata
 
 
@@ -14,33 +15,41 @@ param_validators: Dict[str, Validator] = {
     "hnsw:M": lambda p: isinstance(p, int),
     "hnsw:num_threads": lambda p: isinstance(p, int),
     "hnsw:resize_factor": lambda p: isinstance(p, (int, float)),
+    "hnsw:compaction_threshold": lambda p: isinstance(p, (int, float)) and 0 <= p <= 1,
 }
 
 # Extra params used for persistent hnsw
 persistent_param_validators: Dict[str, Validator] = {
     "hnsw:batch_size": lambda p: isinstance(p, int) and p > 2,
     "hnsw:sync_threshold": lambda p: isinstance(p, int) and p > 2,
+    "hnsw:background_persist": lambda p: isinstance(p, bool),
+    "hnsw:bulk_load": lambda p: isinstance(p, bool),
+    "hnsw:quantization": lambda p: p in QUANTIZATIONS,
 }
 
 
 class Params:
     @staticmethod
-    def _select(metadata: Metadata) -> Dict[str, Any]:
+    def _select(metadata: Metadata, prefix: str = "hnsw:") -> Dict[str, Any]:
         segment_metadata = {}
         for param, value in metadata.items():
-            if param.startswith("hnsw:"):
+            if param.startswith(prefix):
                 segment_metadata[param] = value
         return segment_metadata
 
     @staticmethod
-    def _validate(metadata: Dict[str, Any], validators: Dict[str, Validator]) -> None:
+    def _validate(
+        metadata: Dict[str, Any], validators: Dict[str, Validator], kind: str = "HNSW"
+    ) -> None:
         """Validates the metadata"""
         # Validate it
         for param, value in metadata.items():
             if param not in validators:
-                raise ValueError(f"Unknown HNSW parameter: {param}")
+                raise ValueError(f"Unknown {kind} parameter: {param}")
             if not validators[param](value):
-                raise ValueError(f"Invalid value for HNSW parameter: {param} = {value}")
+                raise ValueError(
+                    f"Invalid value for {kind} parameter: {param} = {value}"
+                )
 
 
 class HnswParams(Params):
@@ -50,6 +59,8 @@ class HnswParams(Params):
     M: int
     num_threads: int
     resize_factor: float
+    # Compact the index once this fraction of its elements are deleted, 0 disables
+    compaction_threshold: float
 
     def __init__(self, metadata: Metadata):
         metadata = metadata or {}
@@ -61,6 +72,7 @@ class HnswParams(Params):
             metadata.get("hnsw:num_threads", multiprocessing.cpu_count())
         )
         self.resize_factor = float(metadata.get("hnsw:resize_factor", 1.2))
+        self.compaction_threshold = float(metadata.get("hnsw:compaction_threshold", 0))
 
     @staticmethod
     def extract(metadata: Metadata) -> Metadata:
@@ -73,11 +85,21 @@ class HnswParams(Params):
 class PersistentHnswParams(HnswParams):
     batch_size: int
     sync_threshold: int
+    background_persist: bool
+    # Add large batches of new embeddings straight to the index even once the
+    # collection is not empty
+    bulk_load: bool
+    # Store quantized vectors in a flat index instead of the hnsw graph
+    quantization: Optional[str]
 
     def __init__(self, metadata: Metadata):
         super().__init__(metadata)
         self.batch_size = int(metadata.get("hnsw:batch_size", 100))
         self.sync_threshold = int(metadata.get("hnsw:sync_threshold", 1000))
+        self.background_persist = bool(metadata.get("hnsw:background_persist", False))
+        self.bulk_load = bool(metadata.get("hnsw:bulk_load", False))
+        quantization = metadata.get("hnsw:quantization")
+        self.quantization = str(quantization) if quantization is not None else None
 
     @staticmethod
     def extract(metadata: Metadata) -> Metadata:
@@ -0,0 +1,246 @@
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from chromadb.types import SeqId
+
+
+class IdLabelMap:
+    """A compact bidirectional mapping between embedding ids and hnswlib labels, which
+    also records the seq_id of the write that produced each label.
+
+    Ids are interned as utf-8 bytes in a single buffer. Label-indexed numpy arrays
+    hold the offset and length of each id in that buffer along with its seq_id, and an
+    open-addressing hash table of labels (with linear probing) maps ids back to
+    labels. This costs a few dozen bytes per entry on top of the id itself, compared
+    to several hundred for the equivalent Python dicts.
+
+    It is not thread safe and callers should ensure that only one thread writes to it
+    at a time.
+    """
+
+    __slots__ = (
+        "_ids",
+        "_offsets",
+        "_lengths",
+        "_seq_ids",
+        "_table",
+        "_count",
+        "_table_used",
+        "_garbage",
+    )
+
+    _EMPTY = -1
+    _TOMBSTONE = -2
+    _INITIAL_LABELS = 1024
+    _INITIAL_TABLE = 2048
+    # Only rewrite the id buffer once it holds at least this many bytes of removed ids
+    _MIN_GARBAGE = 1 << 16
+    _INT64_MIN = -(1 << 63)
+    _INT64_MAX = (1 << 63) - 1
+
+    # Interned utf-8 bytes of every id, including removed ones until the next rebuild
+    _ids: bytearray
+    # Label-indexed offset of the id in _ids, or -1 if the label is unused
+    _offsets: npt.NDArray[np.int64]
+    _lengths: npt.NDArray[np.int32]
+    # Widened to an object array once a seq_id does not fit in 64 bits
+    _seq_ids: npt.NDArray[np.int64]
+    # Open-addressing hash table of labels, keyed by the hash of the id bytes
+    _table: npt.NDArray[np.int64]
+    _count: int
+    # Number of table slots that are occupied or tombstoned
+    _table_used: int
+    # Number of bytes in _ids belonging to removed ids
+    _garbage: int
+
+    def __init__(self) -> None:
+        self._ids = bytearray()
+        self._offsets = np.full(self._INITIAL_LABELS, -1, dtype=np.int64)
+        self._lengths = np.zeros(self._INITIAL_LABELS, dtype=np.int32)
+        self._seq_ids = np.zeros(self._INITIAL_LABELS, dtype=np.int64)
+        self._table = np.full(self._INITIAL_TABLE, self._EMPTY, dtype=np.int64)
+        self._count = 0
+        self._table_used = 0
+        self._garbage = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, id: str) -> bool:
+        return self.get_label(id) is not None
+
+    def get_label(self, id: str) -> Optional[int]:
+        """Return the label of the given id, or None if it is not present"""
+        id_bytes = id.encode("utf-8")
+        position = self._find(id_bytes)
+        if position < 0:
+            return None
+        return int(self._table[position])
+
+    def get_seq_id(self, id: str) -> Optional[SeqId]:
+        """Return the seq_id of the given id, or None if it is not present"""
+        label = self.get_label(id)
+        if label is None:
+            return None
+        return int(self._seq_ids[label])
+
+    def get_id(self, label: int) -> str:
+        """Return the id of the given label, raising a KeyError if it is unused"""
+        if label >= len(self._offsets) or self._offsets[label] < 0:
+            raise KeyError(label)
+        offset = int(self._offsets[label])
+        return self._ids[offset : offset + int(self._lengths[label])].decode("utf-8")
+
+    def get_ids(self, labels: Iterable[int]) -> List[str]:
+        """Return the ids of the given labels, raising a KeyError if any is unused"""
+        labels = np.asarray(labels, dtype=np.int64)
+        if len(labels) == 0:
+            return []
+        if labels.max() >= len(self._offsets) or (self._offsets[labels] < 0).any():
+            raise KeyError(labels.tolist())
+        ids = self._ids
+        return [
+            ids[offset : offset + length].decode("utf-8")
+            for offset, length in zip(
+                self._offsets[labels].tolist(), self._lengths[labels].tolist()
+            )
+        ]
+
+    def labels(self) -> npt.NDArray[np.int64]:
+        """Return all labels currently in use"""
+        return np.flatnonzero(self._offsets >= 0)
+
+    def ids(self) -> List[str]:
+        """Return all ids currently present"""
+        return self.get_ids(self.labels())
+
+    def items(self) -> Iterator[Tuple[str, int, SeqId]]:
+        """Iterate over the (id, label, seq_id) triples currently present"""
+        labels = self.labels()
+        return zip(
+            self.get_ids(labels), labels.tolist(), self._seq_ids[labels].tolist()
+        )
+
+    def set(self, id: str, label: int, seq_id: SeqId) -> None:
+        """Map the given id to the given label, replacing any previous label"""
+        id_bytes = id.encode("utf-8")
+        position = self._find(id_bytes)
+        if position >= 0:
+            previous = int(self._table[position])
+            if previous == label:
+                self._set_seq_id(label, seq_id)
+                return
+            self._release_label(previous)
+            self._table[position] = label
+        else:
+            if (self._table_used + 1) * 3 > len(self._table) * 2:
+                self._rebuild_table(len(self._table) * 2)
+            position = self._insert_position(id_bytes)
+            if self._table[position] == self._EMPTY:
+                self._table_used += 1
+            self._table[position] = label
+            self._count += 1
+
+        if label >= len(self._offsets):
+            self._grow_labels(label + 1)
+        self._offsets[label] = len(self._ids)
+        self._lengths[label] = len(id_bytes)
+        self._set_seq_id(label, seq_id)
+        self._ids += id_bytes
+
+    def remove(self, id: str) -> Optional[int]:
+        """Remove the given id, returning its label or None if it was not present"""
+        position = self._find(id.encode("utf-8"))
+        if position < 0:
+            return None
+        label = int(self._table[position])
+        self._table[position] = self._TOMBSTONE
+        self._count -= 1
+        self._release_label(label)
+        if self._garbage > self._MIN_GARBAGE and self._garbage * 2 > len(self._ids):
+            self._compact_ids()
+        return label
+
+    def _release_label(self, label: int) -> None:
+        self._garbage += int(self._lengths[label])
+        self._offsets[label] = -1
+        self._lengths[label] = 0
+
+    def _find(self, id_bytes: bytes) -> int:
+        """Return the table position holding the given id, or -1 if it is absent"""
+        table = self._table
+        mask = len(table) - 1
+        position = hash(id_bytes) & mask
+        while True:
+            label = int(table[position])
+            if label == self._EMPTY:
+                return -1
+            if label != self._TOMBSTONE:
+                offset = int(self._offsets[label])
+                length = int(self._lengths[label])
+                if (
+                    length == len(id_bytes)
+                    and self._ids[offset : offset + length] == id_bytes
+                ):
+                    return position
+            position = (position + 1) & mask
+
+    def _insert_position(self, id_bytes: bytes) -> int:
+        """Return the first free or tombstoned position along the probe sequence of an
+        id that is known to be absent"""
+        table = self._table
+        mask = len(table) - 1
+        position = hash(id_bytes) & mask
+        while table[position] >= 0:
+            position = (position + 1) & mask
+        return position
+
+    def _rebuild_table(self, capacity: int) -> None:
+        # Keep the table at most half full after a rebuild, which also drops tombstones
+        while capacity < self._count * 2:
+            capacity *= 2
+        self._table = np.full(capacity, self._EMPTY, dtype=np.int64)
+        mask = capacity - 1
+        ids = self._ids
+        labels = self.labels()
+        for label, offset, length in zip(
+            labels.tolist(),
+            self._offsets[labels].tolist(),
+            self._lengths[labels].tolist(),
+        ):
+            position = hash(bytes(ids[offset : offset + length])) & mask
+            while self._table[position] != self._EMPTY:
+                position = (position + 1) & mask
+            self._table[position] = label
+        self._table_used = len(labels)
+
+    def _set_seq_id(self, label: int, seq_id: SeqId) -> None:
+        if self._seq_ids.dtype != object and not (
+            self._INT64_MIN <= seq_id <= self._INT64_MAX
+        ):
+            self._seq_ids = self._seq_ids.astype(object)
+        self._seq_ids[label] = seq_id
+
+    def _grow_labels(self, min_size: int) -> None:
+        size = max(min_size, len(self._offsets) * 2)
+        extra = size - len(self._offsets)
+        self._offsets = np.concatenate(
+            [self._offsets, np.full(extra, -1, dtype=np.int64)]
+        )
+        self._lengths = np.concatenate([self._lengths, np.zeros(extra, np.int32)])
+        self._seq_ids = np.concatenate([self._seq_ids, np.zeros(extra, np.int64)])
+
+    def _compact_ids(self) -> None:
+        """Rewrite the interned id buffer without the bytes of removed ids"""
+        ids = self._ids
+        labels = self.labels()
+        offsets = self._offsets[labels]
+        lengths = self._lengths[labels].astype(np.int64)
+        self._ids = bytearray().join(
+            ids[offset : offset + length]
+            for offset, length in zip(offsets.tolist(), lengths.tolist())
+        )
+        self._offsets[labels] = np.cumsum(lengths) - lengths
+        self._garbage = 0
@@ -0,0 +1,282 @@
+import mmap
+import os
+import struct
+import zlib
+from typing import Iterable, Optional, Tuple
+
+from chromadb.segment.impl.vector.id_label_map import IdLabelMap
+from chromadb.types import SeqId
+
+
+class IdLabelStoreCorruptedError(Exception):
+    """Raised when a committed region of the store fails its checksum"""
+
+    pass
+
+
+class IdLabelStoreHeader:
+    """The fixed size header of an IdLabelStore. It carries everything a segment needs
+    to know about its index without reading the mapping entries."""
+
+    dimensionality: Optional[int]
+    total_elements_added: int
+    max_seq_id: SeqId
+    count: int
+    # Byte offset up to which entries are committed. Anything past it is a torn or
+    # uncommitted write and is ignored.
+    committed_length: int
+    # Number of entries in the committed region, used to decide when to compact
+    entry_count: int
+    # Incremented by every commit. The header is written to alternating slots, and
+    # the valid one with the highest generation is current.
+    generation: int
+
+    def __init__(
+        self,
+        dimensionality: Optional[int],
+        total_elements_added: int,
+        max_seq_id: SeqId,
+        count: int,
+        committed_length: int = 0,
+        entry_count: int = 0,
+        generation: int = 0,
+    ):
+        self.dimensionality = dimensionality
+        self.total_elements_added = total_elements_added
+        self.max_seq_id = max_seq_id
+        self.count = count
+        self.committed_length = committed_length
+        self.entry_count = entry_count
+        self.generation = generation
+
+
+class IdLabelStore:
+    """An append-only, checksummed file storing the IdLabelMap of a
+    PersistentLocalHnswSegment.
+
+    Each sync appends only the entries that changed since the previous one and then
+    writes the fixed size header to commit them, so the cost of a sync grows with
+    the size of the delta rather than the size of the collection. The header is
+    written to the one of two slots that does not hold the current header, so a
+    torn header write leaves the previous commit in place. The file is rewritten
+    from the live entries once superseded entries dominate it.
+
+    Layout: two header slots (see IdLabelStoreHeader), followed by entries of the
+    form (op, id length, label, seq_id, id bytes, crc32). Seq ids are stored as
+    signed 128 bit integers. It is not thread safe.
+    """
+
+    MAGIC = b"CHROMAIL"
+    VERSION = 2
+
+    _HEADER = struct.Struct("<8sIiQq16sqqq")
+    _CRC = struct.Struct("<I")
+    _SLOT_SIZE = _HEADER.size + _CRC.size
+    _HEADER_SIZE = 2 * _SLOT_SIZE
+    _ENTRY = struct.Struct("<BIq16s")
+    _SEQ_ID_BYTES = 16
+
+    _PUT = 1
+    _DELETE = 2
+
+    # Compact once the file holds this many times more entries than live ids
+    COMPACTION_FACTOR = 2
+    # Never compact files with fewer entries than this
+    COMPACTION_MIN_ENTRIES = 10000
+
+    _path: str
+    _header: Optional[IdLabelStoreHeader]
+
+    def __init__(self, path: str):
+        self._path = path
+        self._header = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self._path)
+
+    def read_header(self) -> IdLabelStoreHeader:
+        """Read and validate the current header, without touching the entries. Of
+        the two header slots, the valid one with the highest generation is current."""
+        with open(self._path, "rb") as f:
+            data = f.read(self._HEADER_SIZE)
+        headers = [
+            self._decode_header(data[offset : offset + self._SLOT_SIZE])
+            for offset in (0, self._SLOT_SIZE)
+        ]
+        valid = [header for header in headers if header is not None]
+        if len(valid) == 0:
+            raise IdLabelStoreCorruptedError(
+                f"No valid header in {self._path}, it is truncated or corrupted"
+            )
+        self._header = max(valid, key=lambda header: header.generation)
+        return self._header
+
+    def load(self) -> IdLabelMap:
+        """Replay the committed entries into an IdLabelMap"""
+        header = self._header or self.read_header()
+        id_labels = IdLabelMap()
+        if header.committed_length > self._HEADER_SIZE:
+            with open(self._path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    for op, id, label, seq_id in self._entries(
+                        data, header.committed_length
+                    ):
+                        if op == self._PUT:
+                            id_labels.set(id, label, seq_id)
+                        else:
+                            id_labels.remove(id)
+        return id_labels
+
+    def append(
+        self,
+        header: IdLabelStoreHeader,
+        puts: Iterable[Tuple[str, int, SeqId]],
+        deletes: Iterable[str],
+    ) -> None:
+        """Durably append the given changes and commit them along with the header"""
+        if not self.exists():
+            self._write_new(header, puts)
+            return
+        current = self._header or self.read_header()
+        buffer = bytearray()
+        entry_count = current.entry_count
+        for id in deletes:
+            buffer += self._encode(self._DELETE, id, -1, -1)
+            entry_count += 1
+        for id, label, seq_id in puts:
+            buffer += self._encode(self._PUT, id, label, seq_id)
+            entry_count += 1
+
+        with open(self._path, "r+b") as f:
+            f.seek(current.committed_length)
+            f.write(buffer)
+            # Drop anything left behind by a previously torn write
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+            header.committed_length = current.committed_length + len(buffer)
+            header.entry_count = entry_count
+            # Write to the slot not holding the current header
+            header.generation = current.generation + 1
+            f.seek(header.generation % 2 * self._SLOT_SIZE)
+            f.write(self._encode_header(header))
+            f.flush()
+            os.fsync(f.fileno())
+        self._header = header
+
+    def should_compact(self) -> bool:
+        header = self._header
+        if header is None:
+            return False
+        return (
+            header.entry_count >= self.COMPACTION_MIN_ENTRIES
+            and header.entry_count > self.COMPACTION_FACTOR * header.count
+        )
+
+    def compact(
+        self, header: IdLabelStoreHeader, entries: Iterable[Tuple[str, int, SeqId]]
+    ) -> None:
+        """Atomically replace the file with one holding only the given live
+        (id, label, seq_id) entries"""
+        self._write_new(header, entries)
+
+    def _write_new(
+        self, header: IdLabelStoreHeader, puts: Iterable[Tuple[str, int, SeqId]]
+    ) -> None:
+        buffer = bytearray()
+        entry_count = 0
+        for id, label, seq_id in puts:
+            buffer += self._encode(self._PUT, id, label, seq_id)
+            entry_count += 1
+        header.committed_length = self._HEADER_SIZE + len(buffer)
+        header.entry_count = entry_count
+        header.generation = 0
+
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            # The second slot is left empty, which fails its checksum
+            f.write(self._encode_header(header))
+            f.write(bytes(self._SLOT_SIZE))
+            f.write(buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+        self._header = header
+
+    def _encode_header(self, header: IdLabelStoreHeader) -> bytes:
+        data = self._HEADER.pack(
+            self.MAGIC,
+            self.VERSION,
+            -1 if header.dimensionality is None else header.dimensionality,
+            header.generation,
+            header.total_elements_added,
+            self._encode_seq_id(header.max_seq_id),
+            header.count,
+            header.committed_length,
+            header.entry_count,
+        )
+        return data + self._CRC.pack(zlib.crc32(data))
+
+    def _decode_header(self, data: bytes) -> Optional[IdLabelStoreHeader]:
+        """Decode a header slot, or return None if it is truncated or corrupted"""
+        if len(data) != self._SLOT_SIZE:
+            return None
+        (crc,) = self._CRC.unpack_from(data, self._HEADER.size)
+        if zlib.crc32(data[: self._HEADER.size]) != crc:
+            return None
+        (
+            magic,
+            version,
+            dimensionality,
+            generation,
+            total_elements_added,
+            max_seq_id,
+            count,
+            committed_length,
+            entry_count,
+        ) = self._HEADER.unpack_from(data)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise IdLabelStoreCorruptedError(
+                f"Unsupported id/label store format in {self._path}"
+            )
+        return IdLabelStoreHeader(
+            dimensionality=None if dimensionality < 0 else dimensionality,
+            total_elements_added=total_elements_added,
+            max_seq_id=int.from_bytes(max_seq_id, "little", signed=True),
+            count=count,
+            committed_length=committed_length,
+            entry_count=entry_count,
+            generation=generation,
+        )
+
+    def _encode_seq_id(self, seq_id: SeqId) -> bytes:
+        try:
+            return seq_id.to_bytes(self._SEQ_ID_BYTES, "little", signed=True)
+        except OverflowError:
+            raise ValueError(
+                f"Seq id {seq_id} does not fit in {self._SEQ_ID_BYTES * 8} bits"
+            )
+
+    def _encode(self, op: int, id: str, label: int, seq_id: SeqId) -> bytes:
+        id_bytes = id.encode("utf-8")
+        data = (
+            self._ENTRY.pack(op, len(id_bytes), label, self._encode_seq_id(seq_id))
+            + id_bytes
+        )
+        return data + self._CRC.pack(zlib.crc32(data))
+
+    def _entries(
+        self, data: mmap.mmap, end: int
+    ) -> Iterable[Tuple[int, str, int, SeqId]]:
+        offset = self._HEADER_SIZE
+        while offset < end:
+            op, id_length, label, seq_id_bytes = self._ENTRY.unpack_from(data, offset)
+            id_end = offset + self._ENTRY.size + id_length
+            (crc,) = self._CRC.unpack_from(data, id_end)
+            if zlib.crc32(data[offset:id_end]) != crc:
+                raise IdLabelStoreCorruptedError(
+                    f"Entry checksum mismatch at offset {offset} in {self._path}"
+                )
+            id = data[offset + self._ENTRY.size : id_end].decode("utf-8")
+            yield op, id, label, int.from_bytes(seq_id_bytes, "little", signed=True)
+            offset = id_end + self._CRC.size
@@ -0,0 +1,418 @@
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from chromadb.segment.impl.vector.mapped_index import MappedIndex, label_filter_mask
+from chromadb.utils import distance_functions
+
+# Compute the distances of at most this many vector/centroid pairs at once
+_ASSIGN_CHUNK_PAIRS = 1 << 24
+
+
+def nearest_centroids(
+    vectors: npt.NDArray[np.float32], centroids: npt.NDArray[np.float32]
+) -> npt.NDArray[np.intp]:
+    """Return the index of the l2-nearest centroid of each vector"""
+    chunk_size = max(1, _ASSIGN_CHUNK_PAIRS // max(len(centroids), 1))
+    assignments = np.empty(len(vectors), dtype=np.intp)
+    centroid_norms = np.linalg.norm(centroids, axis=1)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start : start + chunk_size]
+        distances = distance_functions.pairwise("l2", chunk, centroids, centroid_norms)
+        assignments[start : start + chunk_size] = np.argmin(distances, axis=1)
+    return assignments
+
+
+def kmeans(
+    vectors: npt.NDArray[np.float32], k: int, iterations: int = 10, seed: int = 0
+) -> npt.NDArray[np.float32]:
+    """Train at most k centroids on the given vectors with Lloyd's algorithm, starting
+    from k distinct vectors. Clusters left empty are reseeded with random vectors."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=k)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts[filled])[:-1]])
+        sums = np.add.reduceat(vectors[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty) > 0:
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty))]
+    return centroids
+
+
+class IvfIndex(MappedIndex):
+    """An inverted file index. Vectors are partitioned into lists by their nearest
+    k-means centroid, and a query only scans the lists of the nprobe centroids
+    nearest to it.
+
+    Until train_size vectors have been added there are no centroids, and all vectors
+    go to a single list that queries scan exhaustively. The centroids are then
+    trained on the vectors added so far, and those vectors are redistributed.
+
+    Each list is a chain of fixed-size blocks of float32 vectors. When persistent, the
+    blocks live in one memory-mapped file, so queries only page in the lists they
+    probe. The centroids and the label and block bookkeeping are part of the
+    metadata.
+    """
+
+    METADATA_FILE = "ivf_index.npz"
+    # Formatted with the generation of the file, which changes when the vectors are
+    # redistributed
+    VECTORS_FILE = "ivf_vectors.{}.bin"
+    BLOCK_SIZE = 256
+
+    # Label slots of labels that are not in the index
+    _UNUSED = -1
+    _DELETED = -2
+
+    nlist: int
+    nprobe: int
+    train_size: int
+    _centroids: Optional[npt.NDArray[np.float32]]
+    _generation: int
+    # Vector files of earlier generations, deleted once the metadata no longer
+    # refers to them
+    _stale_files: List[str]
+    # The label in each slot, 0 for slots that are free or were deleted
+    _slot_labels: npt.NDArray[np.int64]
+    # The list each block belongs to, and how many of its slots are used
+    _block_lists: npt.NDArray[np.int32]
+    _block_fills: npt.NDArray[np.int32]
+    _n_blocks: int
+    # The blocks of each list, in order
+    _list_blocks: List[List[int]]
+    # The slot of each label, or _UNUSED or _DELETED
+    _label_slots: npt.NDArray[np.int64]
+
+    def __init__(
+        self, space: str, dim: int, nlist: int, nprobe: int, train_size: int
+    ) -> None:
+        super().__init__(space, dim)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self._centroids = None
+        self._generation = 0
+        self._stale_files = []
+        self._n_blocks = 0
+        self._list_blocks = [[]]
+        # The vector in each slot
+        self._layouts[self.VECTORS_FILE] = (np.float32, (dim,))
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def set_ef(self, ef: int) -> None:
+        """Accepted for compatibility with hnswlib. The accuracy of queries is
+        controlled by nprobe instead."""
+        pass
+
+    def add_items(self, data: Any, ids: Sequence[int]) -> None:
+        """Add or update the vectors of the given labels"""
+        vectors, labels = self._items(data, ids)
+        if len(labels) == 0:
+            return
+        # If a label is given more than once, its last vector wins
+        _, last = np.unique(labels[::-1], return_index=True)
+        keep = np.sort(len(labels) - 1 - last)
+        vectors, labels = vectors[keep], labels[keep]
+
+        if labels.max() >= len(self._label_slots):
+            self._grow_labels(int(labels.max()) + 1)
+        current = self._label_slots[labels]
+        n_new = int(np.count_nonzero(current == self._UNUSED))
+        if self._element_count + n_new > self._max_elements:
+            raise RuntimeError("The number of elements exceeds the specified limit")
+
+        # Updated vectors may move to another list, so their old slots are freed
+        self._slot_labels[current[current >= 0]] = 0
+        self._label_slots[labels] = self._append(vectors, labels)
+        self._element_count += n_new
+
+        if (
+            self._centroids is None
+            and np.count_nonzero(self._label_slots >= 0) >= self.train_size
+        ):
+            self._train()
+
+    def mark_deleted(self, label: int) -> None:
+        """Delete the given label. Deleting it again is a no-op, like for
+        QuantizedFlatIndex."""
+        if label >= len(self._label_slots) or self._label_slots[label] == self._UNUSED:
+            raise RuntimeError("Label not found")
+        slot = self._label_slots[label]
+        if slot >= 0:
+            self._slot_labels[slot] = 0
+            self._label_slots[label] = self._DELETED
+
+    def get_items(self, ids: Sequence[int]) -> List[List[float]]:
+        labels = np.asarray(ids, dtype=np.int64)
+        if len(labels) == 0:
+            return []
+        if labels.max() >= len(self._label_slots) or (
+            (self._label_slots[labels] < 0).any()
+        ):
+            raise RuntimeError("Label not found")
+        vectors = self._mapped_vectors()
+        return vectors[self._label_slots[labels]].tolist()  # type: ignore[no-any-return]
+
+    def knn_query(
+        self,
+        data: Any,
+        k: int = 1,
+        num_threads: int = -1,
+        filter: Optional[Callable[[int], bool]] = None,
+        nprobe: Optional[int] = None,
+    ) -> Tuple[npt.NDArray[np.uint64], npt.NDArray[np.float32]]:
+        """Return the labels and distances of the k nearest live vectors to each
+        query, for the labels accepted by filter. At least nprobe lists are scanned
+        per query, and more if they hold fewer than k accepted vectors."""
+        queries = self._normalized(np.atleast_2d(np.asarray(data, dtype=np.float32)))
+        n_queries = len(queries)
+        if k == 0 or n_queries == 0:
+            return self._no_results(n_queries)
+        nprobe = nprobe if nprobe is not None else self.nprobe
+
+        # The accepted slots of each list, computed for the lists that are probed
+        list_slots: Dict[int, npt.NDArray[np.int64]] = {}
+
+        def accepted_slots(list_id: int) -> npt.NDArray[np.int64]:
+            if list_id not in list_slots:
+                slots = self._list_slots(list_id)
+                labels = self._slot_labels[slots]
+                slots = slots[labels > 0]
+                if filter is not None:
+                    slots = slots[label_filter_mask(self._slot_labels[slots], filter)]
+                list_slots[list_id] = slots
+            return list_slots[list_id]
+
+        # Pick the lists each query probes, in order of their centroid's distance
+        if self._centroids is None:
+            order = np.zeros((n_queries, 1), dtype=np.intp)
+        else:
+            order = np.argsort(
+                distance_functions.pairwise("l2", queries, self._centroids), axis=1
+            )
+        probes: Dict[int, List[int]] = {}
+        for i, row in enumerate(order.tolist()):
+            n_candidates = 0
+            for j, list_id in enumerate(row):
+                if j >= nprobe and n_candidates >= k:
+                    break
+                probes.setdefault(list_id, []).append(i)
+                n_candidates += len(accepted_slots(list_id))
+            if n_candidates < k:
+                raise RuntimeError(
+                    "Cannot return the results in a contigious 2D array. Probably ef or M is too small"
+                )
+
+        # Score each probed list once for all the queries probing it
+        vectors = self._mapped_vectors()
+        candidate_slots: List[List[npt.NDArray[np.int64]]] = [
+            [] for _ in range(n_queries)
+        ]
+        candidate_distances: List[List[npt.NDArray[np.float32]]] = [
+            [] for _ in range(n_queries)
+        ]
+        for list_id, query_indices in probes.items():
+            slots = accepted_slots(list_id)
+            if len(slots) == 0:
+                continue
+            distances = distance_functions.pairwise(
+                self.space if self.space == "l2" else "ip",
+                queries[query_indices],
+                vectors[slots],
+            )
+            for row, i in zip(distances, query_indices):
+                candidate_slots[i].append(slots)
+                candidate_distances[i].append(row)
+
+        result_slots = np.empty((n_queries, k), dtype=np.int64)
+        for i in range(n_queries):
+            slots = np.concatenate(candidate_slots[i])
+            top, _ = distance_functions.top_k(
+                np.concatenate(candidate_distances[i])[None, :], k
+            )
+            result_slots[i] = slots[top[0]]
+
+        # The expanded l2 distances are only used to select the results, which are
+        # then rescored exactly and sorted
+        result_slots, distances = self._rerank(
+            queries, result_slots, vectors[result_slots], k
+        )
+        return self._slot_labels[result_slots].astype(np.uint64), distances
+
+    def persist_dirty(self) -> None:
+        """Write the index's metadata to disk, and then delete the vectors files of
+        earlier generations"""
+        super().persist_dirty()
+        for path in self._stale_files:
+            if os.path.exists(path):
+                os.remove(path)
+        self._stale_files = []
+
+    def _init(self, rows: int) -> None:
+        self._centroids = None
+        self._label_slots = np.full(rows, self._UNUSED, dtype=np.int64)
+        self._reset_blocks(max(1, -(-(rows - 1) // self.BLOCK_SIZE)))
+
+    def _load(self, data: Any) -> None:
+        self._generation = int(data["generation"])
+        self._n_blocks = int(data["n_blocks"])
+        self._centroids = data["centroids"] if bool(data["trained"]) else None
+        self._label_slots = data["label_slots"]
+        self._slot_labels = data["slot_labels"]
+        self._block_lists = data["block_lists"]
+        self._block_fills = data["block_fills"]
+        self._element_count = int(np.count_nonzero(self._label_slots != self._UNUSED))
+        self._index_list_blocks()
+
+    def _matches(self, data: Any) -> bool:
+        return super()._matches(data) and int(data["nlist"]) == self.nlist
+
+    def _metadata(self) -> Dict[str, Any]:
+        return {
+            "nlist": self.nlist,
+            "generation": self._generation,
+            "n_blocks": self._n_blocks,
+            "trained": self._centroids is not None,
+            "centroids": self._centroids
+            if self._centroids is not None
+            else np.zeros((0, self.dim), dtype=np.float32),
+            "label_slots": self._label_slots,
+            "slot_labels": self._slot_labels,
+            "block_lists": self._block_lists,
+            "block_fills": self._block_fills,
+        }
+
+    def _file(self, name: str) -> str:
+        return name.format(self._generation)
+
+    def _mapped_vectors(self) -> npt.NDArray[np.float32]:
+        return self._stored(self.VECTORS_FILE)
+
+    def _reset_blocks(self, n_blocks: int) -> None:
+        """Replace the vectors with empty storage for the given number of blocks. A
+        persistent index writes them to a file of a new generation."""
+        rows = n_blocks * self.BLOCK_SIZE
+        self._slot_labels = np.zeros(rows, dtype=np.int64)
+        self._block_lists = np.full(n_blocks, -1, dtype=np.int32)
+        self._block_fills = np.zeros(n_blocks, dtype=np.int32)
+        self._n_blocks = 0
+        self._list_blocks = [
+            []
+            for _ in range(len(self._centroids) if self._centroids is not None else 1)
+        ]
+        # The current file is checked for rather than its map, which may have been
+        # dropped by close_file_handles
+        if self._location is not None:
+            current = self._path(self._file(self.VECTORS_FILE))
+            if os.path.exists(current):
+                self._stale_files.append(current)
+                self._generation += 1
+        self._store(self.VECTORS_FILE, rows)
+
+    def _grow_blocks(self, n_blocks: int) -> None:
+        current = len(self._block_lists)
+        extra = n_blocks - current
+        rows = extra * self.BLOCK_SIZE
+        self._slot_labels = np.concatenate(
+            [self._slot_labels, np.zeros(rows, dtype=np.int64)]
+        )
+        self._block_lists = np.concatenate(
+            [self._block_lists, np.full(extra, -1, dtype=np.int32)]
+        )
+        self._block_fills = np.concatenate(
+            [self._block_fills, np.zeros(extra, dtype=np.int32)]
+        )
+        self._grow_stored(self.VECTORS_FILE, n_blocks * self.BLOCK_SIZE)
+
+    def _grow_labels(self, size: int) -> None:
+        current = len(self._label_slots)
+        if size <= current:
+            return
+        size = max(size, int(current * 1.5))
+        self._label_slots = np.concatenate(
+            [
+                self._label_slots,
+                np.full(size - current, self._UNUSED, dtype=np.int64),
+            ]
+        )
+
+    def _index_list_blocks(self) -> None:
+        """Rebuild the block chain of each list from the list of each block"""
+        n_lists = len(self._centroids) if self._centroids is not None else 1
+        self._list_blocks = [[] for _ in range(n_lists)]
+        for block, list_id in enumerate(self._block_lists[: self._n_blocks].tolist()):
+            self._list_blocks[list_id].append(block)
+
+    def _list_slots(self, list_id: int) -> npt.NDArray[np.int64]:
+        """Return the used slots of the blocks of a list"""
+        blocks = np.asarray(self._list_blocks[list_id], dtype=np.int64)
+        offsets = np.arange(self.BLOCK_SIZE)
+        slots = blocks[:, None] * self.BLOCK_SIZE + offsets
+        return slots[offsets < self._block_fills[blocks][:, None]]
+
+    def _assign(self, vectors: npt.NDArray[np.float32]) -> npt.NDArray[np.intp]:
+        if self._centroids is None:
+            return np.zeros(len(vectors), dtype=np.intp)
+        return nearest_centroids(vectors, self._centroids)
+
+    def _append(
+        self, vectors: npt.NDArray[np.float32], labels: npt.NDArray[np.int64]
+    ) -> npt.NDArray[np.int64]:
+        """Write vectors to the end of the lists of their nearest centroids, returning
+        the slots they were written to"""
+        lists = self._assign(vectors)
+        slots = np.empty(len(labels), dtype=np.int64)
+        order = np.argsort(lists, kind="stable")
+        list_ids, starts = np.unique(lists[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for list_id, start, end in zip(list_ids.tolist(), starts, ends):
+            slots[order[start:end]] = self._reserve(list_id, int(end - start))
+        self._mapped_vectors()[slots] = vectors
+        self._slot_labels[slots] = labels
+        return slots
+
+    def _reserve(self, list_id: int, n: int) -> npt.NDArray[np.int64]:
+        """Reserve n slots at the end of a list, adding blocks to it as needed"""
+        blocks = self._list_blocks[list_id]
+        reserved = []
+        while n > 0:
+            if len(blocks) == 0 or self._block_fills[blocks[-1]] == self.BLOCK_SIZE:
+                blocks.append(self._new_block(list_id))
+            block = blocks[-1]
+            fill = int(self._block_fills[block])
+            count = min(self.BLOCK_SIZE - fill, n)
+            start = block * self.BLOCK_SIZE + fill
+            reserved.append(np.arange(start, start + count, dtype=np.int64))
+            self._block_fills[block] += count
+            n -= count
+        return np.concatenate(reserved)
+
+    def _new_block(self, list_id: int) -> int:
+        if self._n_blocks == len(self._block_lists):
+            self._grow_blocks(max(2 * self._n_blocks, 1))
+        block = self._n_blocks
+        self._block_lists[block] = list_id
+        self._block_fills[block] = 0
+        self._n_blocks += 1
+        return block
+
+    def _train(self) -> None:
+        """Train the centroids on the live vectors and redistribute them"""
+        labels = np.flatnonzero(self._label_slots >= 0)
+        vectors = np.array(self._mapped_vectors()[self._label_slots[labels]])
+        self._centroids = kmeans(vectors, self.nlist)
+        # Each list may end with a partially filled block
+        n_blocks = -(-len(labels) // self.BLOCK_SIZE) + len(self._centroids)
+        self._reset_blocks(max(n_blocks, len(self._block_lists)))
+        self._label_slots[labels] = self._append(vectors, labels)
@@ -0,0 +1,37 @@
+from typing import Dict
+
+from chromadb.segment.impl.vector.hnsw_params import Params, Validator
+from chromadb.types import Metadata
+
+ivf_param_validators: Dict[str, Validator] = {
+    "ivf:nlist": lambda p: isinstance(p, int) and p > 0,
+    "ivf:nprobe": lambda p: isinstance(p, int) and p > 0,
+    "ivf:train_size": lambda p: isinstance(p, int) and p > 0,
+}
+
+
+class IvfParams(Params):
+    # The number of lists the vectors are partitioned into
+    nlist: int
+    # The number of lists a query scans by default
+    nprobe: int
+    # The number of vectors the centroids of the lists are trained on
+    train_size: int
+
+    def __init__(self, metadata: Metadata):
+        metadata = metadata or {}
+        self.nlist = int(metadata.get("ivf:nlist", 256))
+        self.nprobe = int(metadata.get("ivf:nprobe", 16))
+        self.train_size = int(metadata.get("ivf:train_size", 40 * self.nlist))
+
+    @staticmethod
+    def extract(metadata: Metadata) -> Metadata:
+        """Validate and return only the relevant ivf params"""
+        segment_metadata = IvfParams._select(metadata, prefix="ivf:")
+        IvfParams._validate(segment_metadata, ivf_param_validators, kind="IVF")
+        params = IvfParams(segment_metadata)
+        if params.train_size < params.nlist:
+            raise ValueError(
+                f"ivf:train_size ({params.train_size}) must be at least ivf:nlist ({params.nlist})"
+            )
+        return segment_metadata
@@ -0,0 +1,57 @@
+import threading
+from typing import Any, Callable, Optional
+
+import hnswlib
+
+
+class LazyIndex:
+    """A proxy for a persistent index that is only loaded from disk on first use.
+
+    Any attribute access other than the file handle calls below loads the index,
+    once, and is then delegated to it. Concurrent first uses wait for a single load.
+    """
+
+    _load: Callable[[], hnswlib.Index]
+    _name: str
+    _lock: threading.Lock
+    _index: Optional[hnswlib.Index]
+
+    def __init__(self, load: Callable[[], hnswlib.Index], name: str):
+        self._load = load
+        self._name = name
+        self._lock = threading.Lock()
+        self._index = None
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the index has been loaded"""
+        return self._index is not None
+
+    def get(self) -> hnswlib.Index:
+        """Return the index, loading it if that has not happened yet"""
+        index = self._index
+        if index is not None:
+            return index
+        with self._lock:
+            if self._index is None:
+                self._index = self._load()
+            return self._index
+
+    def open_file_handles(self) -> None:
+        """Open the file handles of the index if it is loaded. An index that is not
+        loaded yet opens them when it is."""
+        with self._lock:
+            if self._index is not None:
+                self._index.open_file_handles()
+
+    def close_file_handles(self) -> None:
+        """Close the file handles of the index if it is loaded, without loading it"""
+        with self._lock:
+            if self._index is not None:
+                self._index.close_file_handles()
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not found on the proxy itself
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
@@ -1,12 +1,16 @@
+from enum import Enum
 from overrides import override
-from typing import Optional, Sequence, Dict, Set, List, cast
+import threading
+from typing import Callable, Dict, Optional, Sequence, List, Set, Tuple, Union, cast
 from uuid import UUID
 from chromadb.segment import VectorReader
 from chromadb.ingest import Consumer
 from chromadb.config import System, Settings
 from chromadb.segment.impl.vector.batch import Batch
 from chromadb.segment.impl.vector.hnsw_params import HnswParams
+from chromadb.segment.impl.vector.id_label_map import IdLabelMap
 from chromadb.telemetry.opentelemetry import (
+    add_attributes_to_current_span,
     OpenTelemetryClient,
     OpenTelemetryGranularity,
     trace_method,
@@ -24,6 +28,9 @@ from chromadb.types import (
 )
 from chromadb.errors import InvalidDimensionException
 import hnswlib
+import numpy as np
+import numpy.typing as npt
+from chromadb.utils import distance_functions
 from chromadb.utils.read_write_lock import ReadWriteLock, ReadRWLock, WriteRWLock
 import logging
 
@@ -32,6 +39,17 @@ logger = logging.getLogger(__name__)
 DEFAULT_CAPACITY = 1000
 
 
+class FilteredSearchStrategy(Enum):
+    """How a vector query restricted to a set of allowed ids is served"""
+
+    # No restriction, or every id in the index is allowed
+    UNFILTERED = "unfiltered"
+    # Exact distances over just the allowed vectors
+    EXACT = "exact"
+    # An hnsw search that skips labels outside of a bitmap of allowed labels
+    INDEX_FILTER = "index_filter"
+
+
 class LocalHnswSegment(VectorReader):
     _id: UUID
     _consumer: Consumer
@@ -47,12 +65,17 @@ class LocalHnswSegment(VectorReader):
 
     _lock: ReadWriteLock
 
-    _id_to_label: Dict[str, int]
-    _label_to_id: Dict[int, str]
-    # Note: As of the time of writing, this mapping is no longer needed.
-    # We merely keep it around for easy compatibility with the old code and
-    # debugging purposes.
-    _id_to_seq_id: Dict[str, SeqId]
+    # Serializes compactions
+    _compaction_lock: threading.Lock
+    # Ids written or deleted while a compaction rebuilds the index, None otherwise
+    _compaction_changes: Optional[Set[str]]
+    # The thread running an automatically triggered compaction
+    _compaction_thread: Optional[threading.Thread]
+
+    # Maps ids to labels and back. It also records the seq_id of each label, which
+    # as of the time of writing is no longer needed. We merely keep it around for
+    # easy compatibility with the old code and debugging purposes.
+    _id_labels: IdLabelMap
 
     _opentelemtry_client: OpenTelemetryClient
 
@@ -68,11 +91,12 @@ class LocalHnswSegment(VectorReader):
         self._total_elements_added = 0
         self._max_seq_id = self._consumer.min_seqid()
 
-        self._id_to_seq_id = {}
-        self._id_to_label = {}
-        self._label_to_id = {}
+        self._id_labels = IdLabelMap()
 
         self._lock = ReadWriteLock()
+        self._compaction_lock = threading.Lock()
+        self._compaction_changes = None
+        self._compaction_thread = None
         self._opentelemtry_client = system.require(OpenTelemetryClient)
         super().__init__(system, segment)
 
@@ -99,6 +123,7 @@ class LocalHnswSegment(VectorReader):
         super().stop()
         if self._subscription:
             self._consumer.unsubscribe(self._subscription)
+        self._join_compaction()
 
     @trace_method("LocalHnswSegment.get_vectors", OpenTelemetryGranularity.ALL)
     @override
@@ -106,19 +131,19 @@ class LocalHnswSegment(VectorReader):
         self, ids: Optional[Sequence[str]] = None
     ) -> Sequence[VectorEmbeddingRecord]:
         if ids is None:
-            labels = list(self._label_to_id.keys())
+            labels = self._id_labels.labels().tolist()
         else:
             labels = []
             for id in ids:
-                if id in self._id_to_label:
-                    labels.append(self._id_to_label[id])
+                label = self._id_labels.get_label(id)
+                if label is not None:
+                    labels.append(label)
 
         results = []
         if self._index is not None:
             vectors = cast(Sequence[Vector], self._index.get_items(labels))
 
-            for label, vector in zip(labels, vectors):
-                id = self._label_to_id[label]
+            for id, vector in zip(self._id_labels.get_ids(labels), vectors):
                 results.append(VectorEmbeddingRecord(id=id, embedding=vector))
 
         return results
@@ -131,57 +156,198 @@ class LocalHnswSegment(VectorReader):
         if self._index is None:
             return [[] for _ in range(len(query["vectors"]))]
 
-        k = query["k"]
-        size = len(self._id_to_label)
-
-        if k > size:
-            logger.warning(
-                f"Number of requested results {k} is greater than number of elements in index {size}, updating n_results = {size}"
-            )
-            k = size
+        # The id/label mappings are only changed under the write lock
+        with ReadRWLock(self._lock):
+            k = query["k"]
+            size = len(self._id_labels)
 
-        labels: Set[int] = set()
-        ids = query["allowed_ids"]
-        if ids is not None:
-            labels = {self._id_to_label[id] for id in ids if id in self._id_to_label}
-            if len(labels) < k:
-                k = len(labels)
+            if k > size:
+                logger.warning(
+                    f"Number of requested results {k} is greater than number of elements in index {size}, updating n_results = {size}"
+                )
+                k = size
+
+            strategy = FilteredSearchStrategy.UNFILTERED
+            labels: List[int] = []
+            ids = query["allowed_ids"]
+            if ids is not None:
+                labels = list(
+                    {
+                        label
+                        for label in map(self._id_labels.get_label, ids)
+                        if label is not None
+                    }
+                )
+                if len(labels) < k:
+                    k = len(labels)
+                strategy = self._plan_filtered_search(len(labels), k)
+                add_attributes_to_current_span(
+                    {
+                        "filter_strategy": strategy.value,
+                        "allowed_label_count": len(labels),
+                    }
+                )
 
-        def filter_function(label: int) -> bool:
-            return label in labels
+            query_vectors = query["vectors"]
+            max_distance = query.get("max_distance")
 
-        query_vectors = query["vectors"]
+            if strategy == FilteredSearchStrategy.EXACT:
+                return self._exact_search(
+                    query_vectors, labels, k, query["include_embeddings"], max_distance
+                )
 
-        with ReadRWLock(self._lock):
-            result_labels, distances = self._index.knn_query(
-                query_vectors, k=k, filter=filter_function if ids else None
+            filter = None
+            if strategy == FilteredSearchStrategy.INDEX_FILTER:
+                bitmap = np.zeros(self._total_elements_added + 1, dtype=np.uint8)
+                bitmap[labels] = 1
+                # hnswlib calls the filter for every candidate node. A bound builtin
+                # method avoids running a Python frame for each of those calls.
+                filter = bitmap.tobytes().__getitem__
+
+            if max_distance is None:
+                result_labels, distances = self._knn_query(
+                    query_vectors, k, filter, query["options"]
+                )
+            else:
+                result_labels, distances = self._range_knn_query(
+                    query_vectors, k, filter, query["options"], max_distance
+                )
+            counts = distance_functions.within_distance(distances, max_distance)
+            # The results of each row within max_distance, flattened row by row
+            valid = np.arange(result_labels.shape[1]) < counts[:, None]
+            valid_labels = result_labels[valid]
+
+            result_ids = self._id_labels.get_ids(valid_labels)
+
+            items: Optional[List[List[float]]] = None
+            if query["include_embeddings"] and valid_labels.size > 0:
+                # Fetch every distinct result label in a single call rather than one
+                # call per result
+                unique_labels, inverse = np.unique(valid_labels, return_inverse=True)
+                items = self._index.get_items(unique_labels)
+
+        embeddings: Optional[npt.NDArray[np.float32]] = None
+        if items is not None:
+            # Converted outside of the lock, as this does not touch the index
+            embeddings = np.asarray(items, dtype=np.float32)[inverse]
+
+        all_results: List[List[VectorQueryResult]] = []
+        start = 0
+        for count, row_distances in zip(counts.tolist(), distances.tolist()):
+            all_results.append(
+                [
+                    VectorQueryResult(
+                        id=result_ids[start + j],
+                        distance=distance,
+                        embedding=cast(Vector, embeddings[start + j])
+                        if embeddings is not None
+                        else None,
+                    )
+                    for j, distance in enumerate(row_distances[:count])
+                ]
             )
-
-            # TODO: these casts are not correct, hnswlib returns np
-            # distances = cast(List[List[float]], distances)
-            # result_labels = cast(List[List[int]], result_labels)
-
-            all_results: List[List[VectorQueryResult]] = []
-            for result_i in range(len(result_labels)):
-                results: List[VectorQueryResult] = []
-                for label, distance in zip(
-                    result_labels[result_i], distances[result_i]
-                ):
-                    id = self._label_to_id[label]
-                    if query["include_embeddings"]:
-                        embedding = self._index.get_items([label])[0]
-                    else:
-                        embedding = None
-                    results.append(
-                        VectorQueryResult(
-                            id=id,
-                            distance=distance.item(),
-                            embedding=embedding,
-                        )
+            start += count
+        return all_results
+
+    def _knn_query(
+        self,
+        query_vectors: Sequence[Vector],
+        k: int,
+        filter: Optional[Callable[[int], bool]],
+        options: Optional[Dict[str, Union[str, int, float, bool]]],
+    ) -> Tuple[npt.NDArray[np.uint64], npt.NDArray[np.float32]]:
+        """Search the index. Subclasses whose index takes search parameters read them
+        from the query options."""
+        index = cast(hnswlib.Index, self._index)
+        return index.knn_query(query_vectors, k=k, filter=filter)  # type: ignore[no-any-return]
+
+    def _range_knn_query(
+        self,
+        query_vectors: Sequence[Vector],
+        k: int,
+        filter: Optional[Callable[[int], bool]],
+        options: Optional[Dict[str, Union[str, int, float, bool]]],
+        max_distance: float,
+    ) -> Tuple[npt.NDArray[np.uint64], npt.NDArray[np.float32]]:
+        """Search the index for up to k neighbors within max_distance of each query
+        vector. hnswlib has no radius search, so the search starts with as many
+        neighbors as it visits anyway, ef, and doubles that only for the query vectors
+        whose neighbors all lie within max_distance: it stops expanding once the
+        candidates exceed the radius. Rows that stopped early are padded with inf
+        distances."""
+        vectors = np.asarray(query_vectors, dtype=np.float32)
+        labels = np.zeros((len(vectors), k), dtype=np.uint64)
+        distances = np.full((len(vectors), k), np.inf, dtype=np.float32)
+        pending = np.arange(len(vectors))
+        round_k = max(1, min(k, self._params.search_ef))
+        while len(pending) > 0 and k > 0:
+            round_labels, round_distances = self._knn_query(
+                vectors[pending], round_k, filter, options
+            )
+            labels[pending, :round_k] = round_labels
+            distances[pending, :round_k] = round_distances
+            if round_k == k:
+                break
+            pending = pending[round_distances[:, -1] <= max_distance]
+            round_k = min(2 * round_k, k)
+        return labels, distances
+
+    def _plan_filtered_search(self, n_allowed: int, k: int) -> FilteredSearchStrategy:
+        """Pick the cheaper way to serve a query restricted to n_allowed labels. To
+        collect ef matching candidates, a filtered hnsw search visits roughly
+        ef * size / n_allowed nodes, while an exact search scores each allowed
+        vector once."""
+        size = len(self._id_labels)
+        if n_allowed >= size:
+            return FilteredSearchStrategy.UNFILTERED
+        ef = max(self._params.search_ef, k)
+        if n_allowed * n_allowed <= ef * size:
+            return FilteredSearchStrategy.EXACT
+        return FilteredSearchStrategy.INDEX_FILTER
+
+    def _exact_search(
+        self,
+        query_vectors: Sequence[Vector],
+        labels: List[int],
+        k: int,
+        include_embeddings: bool,
+        max_distance: Optional[float] = None,
+    ) -> List[List[VectorQueryResult]]:
+        """Compute the exact top-k over just the given labels, with one batched
+        distance computation for all query vectors, keeping those within
+        max_distance"""
+        if k == 0 or len(labels) == 0:
+            return [[] for _ in range(len(query_vectors))]
+        index = cast(hnswlib.Index, self._index)
+        vectors = np.asarray(index.get_items(labels), dtype=np.float32)
+        distances = distance_functions.pairwise(
+            self._params.space,
+            np.asarray(query_vectors, dtype=np.float64),
+            vectors.astype(np.float64),
+        )
+        top, top_distances = distance_functions.top_k(distances, k)
+        counts = distance_functions.within_distance(top_distances, max_distance)
+        label_array = np.asarray(labels, dtype=np.int64)
+
+        all_results: List[List[VectorQueryResult]] = []
+        for row, distance_row, count in zip(
+            top.tolist(), top_distances.tolist(), counts.tolist()
+        ):
+            row, distance_row = row[:count], distance_row[:count]
+            row_ids = self._id_labels.get_ids(label_array[row])
+            all_results.append(
+                [
+                    VectorQueryResult(
+                        id=id,
+                        distance=distance,
+                        embedding=cast(Vector, vectors[j])
+                        if include_embeddings
+                        else None,
                     )
-                all_results.append(results)
-
-            return all_results
+                    for id, j, distance in zip(row_ids, row, distance_row)
+                ]
+            )
+        return all_results
 
     @override
     def max_seqid(self) -> SeqId:
@@ -189,7 +355,7 @@ class LocalHnswSegment(VectorReader):
 
     @override
     def count(self) -> int:
-        return len(self._id_to_label)
+        return len(self._id_labels)
 
     @trace_method("LocalHnswSegment._init_index", OpenTelemetryGranularity.ALL)
     def _init_index(self, dimensionality: int) -> None:
@@ -238,30 +404,33 @@ class LocalHnswSegment(VectorReader):
         vectors_to_write = batch.get_written_vectors(written_ids)
         labels_to_write = [0] * len(vectors_to_write)
 
+        if self._compaction_changes is not None:
+            self._compaction_changes.update(deleted_ids)
+            self._compaction_changes.update(written_ids)
+
         if len(deleted_ids) > 0:
             index = cast(hnswlib.Index, self._index)
             for i in range(len(deleted_ids)):
                 id = deleted_ids[i]
+                label = self._id_labels.get_label(id)
                 # Never added this id to hnsw, so we can safely ignore it for deletions
-                if id not in self._id_to_label:
+                if label is None:
                     continue
-                label = self._id_to_label[id]
 
                 index.mark_deleted(label)
-                del self._id_to_label[id]
-                del self._label_to_id[label]
-                del self._id_to_seq_id[id]
+                self._id_labels.remove(id)
 
         if len(written_ids) > 0:
-            self._ensure_index(batch.add_count, len(vectors_to_write[0]))
+            self._ensure_index(batch.add_count, vectors_to_write.shape[1])
 
             next_label = self._total_elements_added + 1
             for i in range(len(written_ids)):
-                if written_ids[i] not in self._id_to_label:
+                label = self._id_labels.get_label(written_ids[i])
+                if label is None:
                     labels_to_write[i] = next_label
                     next_label += 1
                 else:
-                    labels_to_write[i] = self._id_to_label[written_ids[i]]
+                    labels_to_write[i] = label
 
             index = cast(hnswlib.Index, self._index)
 
@@ -269,10 +438,9 @@ class LocalHnswSegment(VectorReader):
             index.add_items(vectors_to_write, labels_to_write)
 
             # If that succeeds, update the mappings
+            seq_ids = batch.get_written_seq_ids(written_ids)
             for i, id in enumerate(written_ids):
-                self._id_to_seq_id[id] = batch.get_record(id)["log_offset"]
-                self._id_to_label[id] = labels_to_write[i]
-                self._label_to_id[labels_to_write[i]] = id
+                self._id_labels.set(id, labels_to_write[i], seq_ids[i])
 
             # If that succeeds, update the total count
             self._total_elements_added += batch.add_count
@@ -280,6 +448,8 @@ class LocalHnswSegment(VectorReader):
             # If that succeeds, finally the seq ID
             self._max_seq_id = batch.max_seq_id
 
+        self._maybe_schedule_compaction()
+
     @trace_method("LocalHnswSegment._write_records", OpenTelemetryGranularity.ALL)
     def _write_records(self, records: Sequence[LogRecord]) -> None:
         """Add a batch of embeddings to the index"""
@@ -294,7 +464,7 @@ class LocalHnswSegment(VectorReader):
                 self._max_seq_id = max(self._max_seq_id, record["log_offset"])
                 id = record["operation_record"]["id"]
                 op = record["operation_record"]["operation"]
-                label = self._id_to_label.get(id, None)
+                label = self._id_labels.get_label(id)
 
                 if op == Operation.DELETE:
                     if label:
@@ -320,6 +490,158 @@ class LocalHnswSegment(VectorReader):
 
             self._apply_batch(batch)
 
+    def lock_stats(self) -> Dict[str, Union[int, float]]:
+        """Return the holders of the segment's read/write lock and how long readers
+        and writers waited for it"""
+        return self._lock.stats()
+
+    def deleted_ratio(self) -> float:
+        """Return the fraction of elements in the hnsw index that are deleted"""
+        if self._index is None or self._index.element_count == 0:
+            return 0.0
+        element_count = self._index.element_count
+        return (element_count - len(self._id_labels)) / element_count
+
+    @trace_method("LocalHnswSegment.compact", OpenTelemetryGranularity.ALL)
+    @override
+    def compact(self) -> None:
+        """Rebuild the hnsw index from the live embeddings, dropping deleted elements
+        and renumbering labels from 1. Reads and writes are served by the current
+        index while the new one is built. Writes made in the meantime are then
+        replayed onto it, and it is swapped in under the write lock."""
+        with self._compaction_lock:
+            with ReadRWLock(self._lock):
+                if self._index is None or not self._compaction_needed():
+                    return
+                entries = list(self._id_labels.items())
+                vectors = self._index.get_items([label for _, label, _ in entries])
+                self._compaction_changes = set()
+
+            try:
+                index = self._init_compacted_index(
+                    cast(int, self._dimensionality), len(entries)
+                )
+                id_labels = IdLabelMap()
+                labels = list(range(1, len(entries) + 1))
+                if len(entries) > 0:
+                    index.add_items(vectors, labels)
+                for (id, _, seq_id), label in zip(entries, labels):
+                    id_labels.set(id, label, seq_id)
+                del vectors
+
+                with WriteRWLock(self._lock):
+                    changes = cast(Set[str], self._compaction_changes)
+                    total_elements_added = self._replay_compaction_changes(
+                        index, id_labels, changes, len(entries)
+                    )
+                    self._compaction_changes = None
+                    self._swap_index(index, id_labels, total_elements_added)
+            finally:
+                if self._compaction_changes is not None:
+                    with WriteRWLock(self._lock):
+                        self._compaction_changes = None
+
+    def _replay_compaction_changes(
+        self,
+        index: hnswlib.Index,
+        id_labels: IdLabelMap,
+        changes: Set[str],
+        total_elements_added: int,
+    ) -> int:
+        """Bring a compacted index up to date with the ids changed since it was
+        snapshotted, returning its new total number of labels. Must be called under
+        the write lock."""
+        current_index = cast(hnswlib.Index, self._index)
+        written: List[str] = []
+        for id in changes:
+            if id in self._id_labels:
+                written.append(id)
+            else:
+                label = id_labels.remove(id)
+                if label is not None:
+                    index.mark_deleted(label)
+
+        if len(written) > 0:
+            vectors = current_index.get_items(
+                [cast(int, self._id_labels.get_label(id)) for id in written]
+            )
+            labels: List[int] = []
+            for id in written:
+                label = id_labels.get_label(id)
+                if label is None:
+                    total_elements_added += 1
+                    label = total_elements_added
+                labels.append(label)
+            if total_elements_added > index.get_max_elements():
+                index.resize_index(
+                    int(total_elements_added * self._params.resize_factor)
+                )
+            index.add_items(vectors, labels)
+            for id, label in zip(written, labels):
+                id_labels.set(id, label, cast(SeqId, self._id_labels.get_seq_id(id)))
+        return total_elements_added
+
+    def _init_compacted_index(self, dimensionality: int, n: int) -> hnswlib.Index:
+        """Create the empty index that a compaction fills with n live elements"""
+        index = hnswlib.Index(space=self._params.space, dim=dimensionality)
+        index.init_index(
+            max_elements=max(int(n * self._params.resize_factor), DEFAULT_CAPACITY),
+            ef_construction=self._params.construction_ef,
+            M=self._params.M,
+        )
+        index.set_ef(self._params.search_ef)
+        index.set_num_threads(self._params.num_threads)
+        return index
+
+    def _swap_index(
+        self, index: hnswlib.Index, id_labels: IdLabelMap, total_elements_added: int
+    ) -> None:
+        """Replace the index and mappings with compacted ones. Must be called under
+        the write lock."""
+        self._index = index
+        self._id_labels = id_labels
+        self._total_elements_added = total_elements_added
+
+    def _compaction_needed(self) -> bool:
+        """Whether compacting the index would change it"""
+        return self.deleted_ratio() > 0
+
+    def _should_compact(self) -> bool:
+        """Whether to compact in the background, which is once the deleted ratio
+        crosses hnsw:compaction_threshold"""
+        threshold = self._params.compaction_threshold
+        return (
+            threshold > 0
+            and self._index is not None
+            and self._index.element_count >= DEFAULT_CAPACITY
+            and self.deleted_ratio() >= threshold
+        )
+
+    def _maybe_schedule_compaction(self) -> None:
+        """Start a compaction in the background if it should be compacted"""
+        if not self._should_compact() or (
+            self._compaction_thread is not None and self._compaction_thread.is_alive()
+        ):
+            return
+        self._compaction_thread = threading.Thread(
+            target=self._compact_in_background,
+            name=f"hnsw-compaction-{self._id}",
+            daemon=True,
+        )
+        self._compaction_thread.start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception:
+            logger.exception(f"Compaction of segment {self._id} failed")
+
+    def _join_compaction(self) -> None:
+        """Wait for a background compaction to complete"""
+        thread = self._compaction_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
     @override
     def delete(self) -> None:
         raise NotImplementedError()
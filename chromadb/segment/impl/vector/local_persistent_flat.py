@@ -0,0 +1,98 @@
+import os
+from typing import Optional, cast
+
+import hnswlib
+from overrides import override
+
+from chromadb.config import System
+from chromadb.segment.impl.vector.flat_index import FlatIndex
+from chromadb.segment.impl.vector.flat_params import FlatParams
+from chromadb.segment.impl.vector.hnsw_params import PersistentHnswParams
+from chromadb.segment.impl.vector.local_persistent_hnsw import (
+    PersistentLocalHnswSegment,
+)
+from chromadb.telemetry.opentelemetry import OpenTelemetryGranularity, trace_method
+from chromadb.types import Metadata, Segment
+
+
+class PersistentLocalFlatSegment(PersistentLocalHnswSegment):
+    """A persistent vector segment that starts out with an exact FlatIndex, and is
+    promoted to an hnsw index once it holds flat:promotion_threshold embeddings.
+
+    A flat index has no graph to build or load and keeps a single file mapped, so
+    small collections open instantly, hold few file handles and get exact results.
+    The promotion rebuilds the index like a compaction does: the flat index serves
+    reads and writes while the hnsw index is built in the background. Whether a
+    segment was promoted is recorded by which index files are in its folder."""
+
+    # Written by hnswlib for persistent indexes
+    HNSW_HEADER_FILE = "header.bin"
+
+    _flat_params: FlatParams
+    # Set while a compaction builds the hnsw index the segment is promoted to
+    _promoting: bool
+
+    def __init__(self, system: System, segment: Segment):
+        # Set before the base class initializes the index
+        self._flat_params = FlatParams(segment["metadata"] or {})
+        self._promoting = False
+        super().__init__(system, segment)
+
+    @staticmethod
+    @override
+    def propagate_collection_metadata(metadata: Metadata) -> Optional[Metadata]:
+        hnsw_metadata = PersistentHnswParams.extract(metadata)
+        if "hnsw:quantization" in hnsw_metadata:
+            raise ValueError("hnsw:quantization is not supported by flat collections")
+        return {**hnsw_metadata, **FlatParams.extract(metadata)}
+
+    @staticmethod
+    @override
+    def get_file_handle_count() -> int:
+        """Return how many file handles are used by the index until it is
+        promoted"""
+        # The memory-mapped vectors, and one extra for the metadata file
+        return 2
+
+    def is_promoted(self) -> bool:
+        """Whether the segment is served by an hnsw index"""
+        return os.path.exists(
+            os.path.join(self._get_storage_folder(), self.HNSW_HEADER_FILE)
+        )
+
+    @trace_method("PersistentLocalFlatSegment.compact", OpenTelemetryGranularity.ALL)
+    @override
+    def compact(self) -> None:
+        """Compact the index, promoting it to hnsw if it has reached
+        flat:promotion_threshold"""
+        try:
+            super().compact()
+        finally:
+            self._promoting = False
+
+    @override
+    def _new_index(self, dimensionality: int) -> hnswlib.Index:
+        if self._promoting or self.is_promoted():
+            return super()._new_index(dimensionality)
+        return cast(
+            hnswlib.Index, FlatIndex(space=self._params.space, dim=dimensionality)
+        )
+
+    @override
+    def _init_compacted_index(self, dimensionality: int, n: int) -> hnswlib.Index:
+        self._promoting = self._should_promote()
+        return super()._init_compacted_index(dimensionality, n)
+
+    @override
+    def _compaction_needed(self) -> bool:
+        return super()._compaction_needed() or self._should_promote()
+
+    @override
+    def _should_compact(self) -> bool:
+        return super()._should_compact() or self._should_promote()
+
+    def _should_promote(self) -> bool:
+        return (
+            len(self._id_labels) >= self._flat_params.promotion_threshold
+            and not self.is_promoted()
+        )
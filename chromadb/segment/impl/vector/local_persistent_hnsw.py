@@ -2,15 +2,29 @@ import os
 import shutil
 from overrides import override
 import pickle
-from typing import Dict, List, Optional, Sequence, Set, cast
+import threading
+from threading import Lock
+from typing import Dict, FrozenSet, List, Optional, Sequence, Set, Tuple, cast
 from chromadb.config import System
+from chromadb.segment.impl.vector.background_persister import BackgroundPersister
 from chromadb.segment.impl.vector.batch import Batch
 from chromadb.segment.impl.vector.hnsw_params import PersistentHnswParams
+from chromadb.segment.impl.vector.id_label_map import IdLabelMap
+from chromadb.segment.impl.vector.id_label_store import (
+    IdLabelStore,
+    IdLabelStoreHeader,
+)
+from chromadb.segment.impl.vector.lazy_index import LazyIndex
 from chromadb.segment.impl.vector.local_hnsw import (
     DEFAULT_CAPACITY,
     LocalHnswSegment,
 )
-from chromadb.segment.impl.vector.brute_force_index import BruteForceIndex
+from chromadb.segment.impl.vector.brute_force_index import (
+    BruteForceIndex,
+    BruteForceIndexView,
+)
+from chromadb.segment.impl.vector.quantized_flat_index import QuantizedFlatIndex
+from chromadb.segment.impl.vector.result_merge import merge_layered_results
 from chromadb.telemetry.opentelemetry import (
     OpenTelemetryClient,
     OpenTelemetryGranularity,
@@ -29,6 +43,7 @@ from chromadb.types import (
 )
 import hnswlib
 import logging
+import numpy as np
 
 from chromadb.utils.read_write_lock import ReadRWLock, WriteRWLock
 
@@ -37,7 +52,10 @@ logger = logging.getLogger(__name__)
 
 
 class PersistentData:
-    """Stores the data and metadata needed for a PersistentLocalHnswSegment"""
+    """Stores the data and metadata needed for a PersistentLocalHnswSegment.
+
+    This is the legacy pickled format, superseded by IdLabelStore. It is only read to
+    migrate segments persisted by older versions."""
 
     dimensionality: Optional[int]
     total_elements_added: int
@@ -71,8 +89,68 @@ class PersistentData:
             return ret
 
 
+class _PersistSnapshot:
+    """The id/label changes captured for one sync to disk. Either entries holds
+    every live entry, for a compaction, or puts and deletes hold the delta."""
+
+    header: IdLabelStoreHeader
+    puts: List[Tuple[str, int, SeqId]]
+    deletes: List[str]
+    entries: Optional[List[Tuple[str, int, SeqId]]]
+
+    def __init__(self, header: IdLabelStoreHeader):
+        self.header = header
+        self.puts = []
+        self.deletes = []
+        self.entries = None
+
+
+class _ReadSnapshot:
+    """The state layered over the hnsw index as of the end of a write: a view of the
+    brute force index holding the vectors written by the current batch, and the ids
+    the batch writes or deletes. It is never changed once published, so readers use
+    it without taking the segment lock."""
+
+    brute_force_index: Optional[BruteForceIndexView]
+    # Every id written or deleted by the batch, which hides its hnsw results
+    changed_ids: FrozenSet[str]
+    written_ids: FrozenSet[str]
+    deleted_ids: FrozenSet[str]
+    update_count: int
+    delete_count: int
+    # The number of live embeddings in the hnsw index
+    hnsw_count: int
+    # The number of live embeddings, in the hnsw index and the batch
+    count: int
+
+    def __init__(
+        self,
+        brute_force_index: Optional[BruteForceIndexView],
+        batch: Batch,
+        hnsw_count: int,
+    ):
+        self.brute_force_index = brute_force_index
+        self.changed_ids = frozenset(batch.get_ids())
+        self.written_ids = frozenset(batch.get_written_ids())
+        self.deleted_ids = frozenset(batch.get_deleted_ids())
+        self.update_count = batch.update_count
+        self.delete_count = batch.delete_count
+        self.hnsw_count = hnsw_count
+        self.count = hnsw_count + batch.add_count - batch.delete_count
+
+
 class PersistentLocalHnswSegment(LocalHnswSegment):
+    # Legacy pickled metadata file, migrated to ID_LABEL_FILE on load
     METADATA_FILE: str = "index_metadata.pickle"
+    ID_LABEL_FILE: str = "index_metadata.bin"
+    # Writes of fewer records are buffered as usual, as hnswlib only adds small
+    # batches on a single thread anyway. Once a bulk load started, it goes on for
+    # writes of any size.
+    _BULK_LOAD_MIN_RECORDS: int = 1000
+    # How many embeddings a bulk load adds to the index per call
+    _BULK_LOAD_CHUNK_SIZE: int = 65536
+    # A bulk load ends once it went on this many seconds without writes
+    _BULK_LOAD_IDLE_SECONDS: float = 1.0
     # How many records to add to index at once, we do this because crossing the python/c++ boundary is expensive (for add())
     # When records are not added to the c++ index, they are buffered in memory and served
     # via brute force search.
@@ -82,9 +160,53 @@ class PersistentLocalHnswSegment(LocalHnswSegment):
     _curr_batch: Batch
     # How many records to add to index before syncing to disk
     _sync_threshold: int
-    _persist_data: PersistentData
+    _id_label_store: IdLabelStore
+    # The value of _total_elements_added as of the last sync to disk
+    _persisted_total_elements_added: int
+    # The number of ids as of the last sync to disk, served by count() until the
+    # mappings are loaded
+    _persisted_count: int
+    # Ids written or deleted since the last sync to disk
+    _dirty_ids: Set[str]
+    _deleted_ids_since_persist: Set[str]
+    # The id/label mappings are only read from disk on first use
+    _mappings_loaded: bool
+    _mappings_lock: Lock
+    # Rewrite the whole id/label store on the next sync, set after a failed write.
+    # Guarded by _persist_lock.
+    _compact_on_persist: bool
+    # The max seq_id of the last batch applied to the hnsw index. Records after it are
+    # only buffered in memory, so this is the point a sync makes durable.
+    _applied_max_seq_id: SeqId
+    # The max seq_id as of the last completed sync to disk
+    _durable_max_seq_id: SeqId
+    # Syncs to disk off the write path when hnsw:background_persist is set
+    _persister: Optional[BackgroundPersister]
+    # Held by syncs, and by compactions which replace the files they write
+    _persist_lock: Lock
+    # Set while a background sync writes the hnsw index to disk. Writers leave the
+    # index unchanged meanwhile, and keep buffering full batches. Guarded by the
+    # writer lock.
+    _index_frozen: bool
     _persist_directory: str
     _allow_reset: bool
+    # Serializes writers. The segment lock is only taken to change the hnsw index
+    # and the id/label mappings, which hnsw searches read.
+    _writer_lock: Lock
+    # Replaced, never changed, by writers
+    _read_snapshot: _ReadSnapshot
+    # Set by the write that starts a bulk load. It goes on until the first write
+    # that does not only add new embeddings, or until it is idle for
+    # _BULK_LOAD_IDLE_SECONDS, which clear it. Only writers change it.
+    _bulk_loading: bool
+    # Whether a bulk load added elements that are not persisted yet. They are
+    # persisted when it ends.
+    _bulk_load_unpersisted: bool
+    # Ends the bulk load once it is idle
+    _bulk_load_timer: Optional[threading.Timer]
+    # The number of bulk load writes, which tells the timer whether the bulk load
+    # went on since it was started
+    _bulk_load_writes: int
 
     _opentelemtry_client: OpenTelemetryClient
 
@@ -100,32 +222,64 @@ class PersistentLocalHnswSegment(LocalHnswSegment):
         self._persist_directory = system.settings.require("persist_directory")
         self._curr_batch = Batch()
         self._brute_force_index = None
+        self._persisted_total_elements_added = 0
+        self._persisted_count = 0
+        self._dirty_ids = set()
+        self._deleted_ids_since_persist = set()
+        self._mappings_loaded = True
+        self._mappings_lock = Lock()
+        self._compact_on_persist = False
+        self._applied_max_seq_id = self._max_seq_id
+        self._durable_max_seq_id = self._max_seq_id
+        self._persister = None
+        self._persist_lock = Lock()
+        self._index_frozen = False
+        self._writer_lock = Lock()
+        self._bulk_loading = False
+        self._bulk_load_unpersisted = False
+        self._bulk_load_timer = None
+        self._bulk_load_writes = 0
+        if self._params.background_persist:
+            self._persister = BackgroundPersister(
+                self._persist_in_background, name=f"hnsw-persister-{self._id}"
+            )
+        self._recover_compaction()
         if not os.path.exists(self._get_storage_folder()):
             os.makedirs(self._get_storage_folder(), exist_ok=True)
-        # Load persist data if it exists already, otherwise create it
+        self._id_label_store = IdLabelStore(self._get_id_label_file())
+        if not self._id_label_store.exists() and os.path.exists(
+            self._get_metadata_file()
+        ):
+            self._migrate_metadata_file()
+        # Load the persisted header if it exists already. The mappings themselves are
+        # loaded lazily by _ensure_mappings_loaded.
         if self._index_exists():
-            self._persist_data = PersistentData.load_from_file(
-                self._get_metadata_file()
-            )
-            self._dimensionality = self._persist_data.dimensionality
-            self._total_elements_added = self._persist_data.total_elements_added
-            self._max_seq_id = self._persist_data.max_seq_id
-            self._id_to_label = self._persist_data.id_to_label
-            self._label_to_id = self._persist_data.label_to_id
-            self._id_to_seq_id = self._persist_data.id_to_seq_id
-            # If the index was written to, we need to re-initialize it
-            if len(self._id_to_label) > 0:
+            header = self._id_label_store.read_header()
+            self._dimensionality = header.dimensionality
+            self._total_elements_added = header.total_elements_added
+            self._persisted_total_elements_added = header.total_elements_added
+            self._max_seq_id = header.max_seq_id
+            self._applied_max_seq_id = header.max_seq_id
+            self._durable_max_seq_id = header.max_seq_id
+            self._persisted_count = header.count
+            self._mappings_loaded = False
+            # If the index was written to, we need to re-initialize it. It is only
+            # loaded from disk on first use, or by preload.
+            if header.count > 0:
                 self._dimensionality = cast(int, self._dimensionality)
                 self._init_index(self._dimensionality)
-        else:
-            self._persist_data = PersistentData(
-                self._dimensionality,
-                self._total_elements_added,
-                self._max_seq_id,
-                self._id_to_label,
-                self._label_to_id,
-                self._id_to_seq_id,
-            )
+        self._publish_read_snapshot()
+
+    @trace_method("PersistentLocalHnswSegment.stop", OpenTelemetryGranularity.ALL)
+    @override
+    def stop(self) -> None:
+        super().stop()
+        # A bulk load going on ends, and is persisted, without waiting for its timer
+        with self._writer_lock:
+            self._end_bulk_load()
+        # Stopping waits for any requested sync to complete
+        if self._persister is not None:
+            self._persister.stop()
 
     @staticmethod
     @override
@@ -135,40 +289,120 @@ class PersistentLocalHnswSegment(LocalHnswSegment):
         return segment_metadata
 
     def _index_exists(self) -> bool:
-        """Check if the index exists via the metadata file"""
-        return os.path.exists(self._get_metadata_file())
+        """Check if the index exists via the id/label store"""
+        return self._id_label_store.exists()
 
     def _get_metadata_file(self) -> str:
-        """Get the metadata file path"""
+        """Get the legacy metadata file path"""
         return os.path.join(self._get_storage_folder(), self.METADATA_FILE)
 
+    def _get_id_label_file(self) -> str:
+        """Get the id/label store file path"""
+        return os.path.join(self._get_storage_folder(), self.ID_LABEL_FILE)
+
+    def _migrate_metadata_file(self) -> None:
+        """Convert a legacy pickled metadata file to an id/label store"""
+        data = PersistentData.load_from_file(self._get_metadata_file())
+        header = IdLabelStoreHeader(
+            dimensionality=data.dimensionality,
+            total_elements_added=data.total_elements_added,
+            max_seq_id=data.max_seq_id,
+            count=len(data.id_to_label),
+        )
+        id_labels = IdLabelMap()
+        for id, label in data.id_to_label.items():
+            id_labels.set(id, label, data.id_to_seq_id[id])
+        self._id_label_store.compact(header, id_labels.items())
+        os.remove(self._get_metadata_file())
+
+    def _ensure_mappings_loaded(self) -> None:
+        """Load the id/label mappings from disk if that has not happened yet"""
+        if self._mappings_loaded:
+            return
+        with self._mappings_lock:
+            if self._mappings_loaded:
+                return
+            self._id_labels = self._id_label_store.load()
+            self._mappings_loaded = True
+            with self._writer_lock:
+                self._publish_read_snapshot()
+
+    def _publish_read_snapshot(self) -> None:
+        """Replace the snapshot readers use with one of the current state. Must be
+        called by the writer, or with writers excluded."""
+        self._read_snapshot = _ReadSnapshot(
+            self._brute_force_index.view()
+            if self._brute_force_index is not None
+            else None,
+            self._curr_batch,
+            len(self._id_labels) if self._mappings_loaded else self._persisted_count,
+        )
+
     def _get_storage_folder(self) -> str:
         """Get the storage folder path"""
         folder = os.path.join(self._persist_directory, str(self._id))
         return folder
 
+    def _get_compaction_folder(self) -> str:
+        """Get the folder a compaction builds the new index in"""
+        return self._get_storage_folder() + ".compacted"
+
+    def _get_replaced_folder(self) -> str:
+        """Get the folder the storage folder is moved to while a compacted index is
+        swapped in"""
+        return self._get_storage_folder() + ".replaced"
+
+    def _recover_compaction(self) -> None:
+        """Clean up after a compaction that was interrupted by a crash"""
+        folder = self._get_storage_folder()
+        compacted = self._get_compaction_folder()
+        replaced = self._get_replaced_folder()
+        if not os.path.exists(folder) and os.path.exists(replaced):
+            # The crash happened between moving the old index out of the way and
+            # moving the compacted one in. The compacted one is complete by then.
+            if os.path.exists(compacted):
+                os.rename(compacted, folder)
+            else:
+                os.rename(replaced, folder)
+        if os.path.exists(compacted):
+            shutil.rmtree(compacted)
+        if os.path.exists(replaced):
+            shutil.rmtree(replaced)
+
+    def _new_index(self, dimensionality: int) -> hnswlib.Index:
+        """Create an uninitialized index. Quantized collections use a flat index over
+        quantized codes in place of the hnsw graph, which implements the same
+        interface."""
+        if self._params.quantization is not None:
+            return cast(
+                hnswlib.Index,
+                QuantizedFlatIndex(
+                    space=self._params.space,
+                    dim=dimensionality,
+                    quantization=self._params.quantization,
+                ),
+            )
+        return hnswlib.Index(space=self._params.space, dim=dimensionality)
+
     @trace_method(
         "PersistentLocalHnswSegment._init_index", OpenTelemetryGranularity.ALL
     )
     @override
     def _init_index(self, dimensionality: int) -> None:
-        index = hnswlib.Index(space=self._params.space, dim=dimensionality)
         self._brute_force_index = BruteForceIndex(
             size=self._batch_size,
             dimensionality=dimensionality,
             space=self._params.space,
         )
 
-        # Check if index exists and load it if it does
+        # An index that exists on disk is only loaded on first use
         if self._index_exists():
-            index.load_index(
-                self._get_storage_folder(),
-                is_persistent_index=True,
-                max_elements=int(
-                    max(self.count() * self._params.resize_factor, DEFAULT_CAPACITY)
-                ),
+            self._index = cast(
+                hnswlib.Index,
+                LazyIndex(lambda: self._open_index(dimensionality), name=str(self._id)),
             )
         else:
+            index = self._new_index(dimensionality)
             index.init_index(
                 max_elements=DEFAULT_CAPACITY,
                 ef_construction=self._params.construction_ef,
@@ -176,35 +410,208 @@ class PersistentLocalHnswSegment(LocalHnswSegment):
                 is_persistent_index=True,
                 persistence_location=self._get_storage_folder(),
             )
+            index.set_ef(self._params.search_ef)
+            index.set_num_threads(self._params.num_threads)
+            self._index = index
+        self._dimensionality = dimensionality
+        self._index_initialized = True
 
+    @trace_method(
+        "PersistentLocalHnswSegment._open_index", OpenTelemetryGranularity.ALL
+    )
+    def _open_index(self, dimensionality: int) -> hnswlib.Index:
+        """Load the index persisted in the storage folder"""
+        index = self._new_index(dimensionality)
+        index.load_index(
+            self._get_storage_folder(),
+            is_persistent_index=True,
+            max_elements=int(
+                max(self.count() * self._params.resize_factor, DEFAULT_CAPACITY)
+            ),
+        )
         index.set_ef(self._params.search_ef)
         index.set_num_threads(self._params.num_threads)
+        return index
+
+    def preload(self, background: bool = False) -> None:
+        """Load the id/label mappings and the index from disk ahead of their first
+        use, which then does not wait for them. In the background, they are loaded
+        on a thread of their own and errors are logged."""
+        if background:
+            threading.Thread(
+                target=self._preload_in_background,
+                name=f"hnsw-loader-{self._id}",
+                daemon=True,
+            ).start()
+            return
+        self._ensure_mappings_loaded()
+        if isinstance(self._index, LazyIndex):
+            self._index.get()
+
+    def _preload_in_background(self) -> None:
+        try:
+            self.preload()
+        except Exception:
+            logger.exception(f"Failed to preload segment {self._id}")
 
-        self._index = index
-        self._dimensionality = dimensionality
-        self._index_initialized = True
+    @override
+    def deleted_ratio(self) -> float:
+        self._ensure_mappings_loaded()
+        return super().deleted_ratio()
 
-    @trace_method("PersistentLocalHnswSegment._persist", OpenTelemetryGranularity.ALL)
-    def _persist(self) -> None:
-        """Persist the index and data to disk"""
-        index = cast(hnswlib.Index, self._index)
+    @trace_method("PersistentLocalHnswSegment.compact", OpenTelemetryGranularity.ALL)
+    @override
+    def compact(self) -> None:
+        self._ensure_mappings_loaded()
+        with self._persist_lock:
+            super().compact()
+
+    @override
+    def _init_compacted_index(self, dimensionality: int, n: int) -> hnswlib.Index:
+        folder = self._get_compaction_folder()
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        os.makedirs(folder)
+        index = self._new_index(dimensionality)
+        index.init_index(
+            max_elements=max(int(n * self._params.resize_factor), DEFAULT_CAPACITY),
+            ef_construction=self._params.construction_ef,
+            M=self._params.M,
+            is_persistent_index=True,
+            persistence_location=folder,
+        )
+        return index
 
-        # Persist the index
+    @override
+    def _swap_index(
+        self, index: hnswlib.Index, id_labels: IdLabelMap, total_elements_added: int
+    ) -> None:
+        # Write the compacted index and its complete id/label store next to the
+        # current ones, then swap the folders
         index.persist_dirty()
+        header = IdLabelStoreHeader(
+            dimensionality=self._dimensionality,
+            total_elements_added=total_elements_added,
+            max_seq_id=self._applied_max_seq_id,
+            count=len(id_labels),
+        )
+        compacted = self._get_compaction_folder()
+        IdLabelStore(os.path.join(compacted, self.ID_LABEL_FILE)).compact(
+            header, id_labels.items()
+        )
+        max_elements = index.get_max_elements()
+        index.close_file_handles()
+        self.close_persistent_index()
+
+        folder = self._get_storage_folder()
+        replaced = self._get_replaced_folder()
+        os.rename(folder, replaced)
+        os.rename(compacted, folder)
+        shutil.rmtree(replaced)
+
+        # Reopen the index from its final location
+        index = self._new_index(cast(int, self._dimensionality))
+        index.load_index(folder, is_persistent_index=True, max_elements=max_elements)
+        index.set_ef(self._params.search_ef)
+        index.set_num_threads(self._params.num_threads)
+        super()._swap_index(index, id_labels, total_elements_added)
 
-        # Persist the metadata
-        self._persist_data.dimensionality = self._dimensionality
-        self._persist_data.total_elements_added = self._total_elements_added
-        self._persist_data.max_seq_id = self._max_seq_id
+        self._id_label_store = IdLabelStore(self._get_id_label_file())
+        self._id_label_store.read_header()
+        self._dirty_ids.clear()
+        self._deleted_ids_since_persist.clear()
+        self._compact_on_persist = False
+        self._persisted_total_elements_added = total_elements_added
+        self._persisted_count = len(id_labels)
+        self._durable_max_seq_id = self._applied_max_seq_id
 
-        # TODO: This should really be stored in sqlite, the index itself, or a better
-        # storage format
-        self._persist_data.id_to_label = self._id_to_label
-        self._persist_data.label_to_id = self._label_to_id
-        self._persist_data.id_to_seq_id = self._id_to_seq_id
+    @trace_method("PersistentLocalHnswSegment._persist", OpenTelemetryGranularity.ALL)
+    def _persist(self) -> None:
+        """Persist the index and data to disk. The caller must hold the writer lock,
+        and not the segment lock: readers go on while the index is written. A
+        compaction holding the persist lock persists everything as it swaps in its
+        index, so the sync is skipped meanwhile."""
+        if not self._persist_lock.acquire(blocking=False):
+            return
+        try:
+            self._write_snapshot(self._snapshot())
+        finally:
+            self._persist_lock.release()
+
+    def _persist_in_background(self) -> None:
+        """Persist the index and data to disk from the background persister. Writers
+        are only excluded while the dirty state is captured. The hnsw index is then
+        frozen while it is written, and the id/label store is written and synced
+        without holding any lock but the persist lock."""
+        with self._persist_lock:
+            with self._writer_lock:
+                snapshot = self._snapshot()
+                self._index_frozen = True
+            try:
+                self._write_snapshot(snapshot)
+            finally:
+                with self._writer_lock:
+                    self._index_frozen = False
+                    # Apply a batch that filled up while the index was frozen
+                    try:
+                        self._apply_full_batch()
+                    finally:
+                        self._publish_read_snapshot()
+
+    def _snapshot(self) -> "_PersistSnapshot":
+        """Capture the id/label changes since the last sync. Must be called with the
+        persist lock held and writers excluded."""
+        header = IdLabelStoreHeader(
+            dimensionality=self._dimensionality,
+            total_elements_added=self._total_elements_added,
+            max_seq_id=self._applied_max_seq_id,
+            count=len(self._id_labels),
+        )
+        snapshot = _PersistSnapshot(header)
+        if self._compact_on_persist or self._id_label_store.should_compact():
+            snapshot.entries = list(self._id_labels.items())
+        else:
+            snapshot.puts = [
+                (
+                    id,
+                    cast(int, self._id_labels.get_label(id)),
+                    cast(SeqId, self._id_labels.get_seq_id(id)),
+                )
+                for id in self._dirty_ids
+            ]
+            snapshot.deletes = list(self._deleted_ids_since_persist)
+        self._dirty_ids.clear()
+        self._deleted_ids_since_persist.clear()
+        self._persisted_total_elements_added = self._total_elements_added
+        self._persisted_count = len(self._id_labels)
+        return snapshot
+
+    def _write_snapshot(self, snapshot: "_PersistSnapshot") -> None:
+        """Write the dirty hnsw elements to disk, and durably write a snapshot to the
+        id/label store. Must be called with the persist lock held, and the hnsw index
+        unchanged since the snapshot."""
+        # If the write fails the captured changes are lost, so rewrite the whole
+        # store on the next sync
+        self._compact_on_persist = True
+        cast(hnswlib.Index, self._index).persist_dirty()
+        if snapshot.entries is not None:
+            self._id_label_store.compact(snapshot.header, snapshot.entries)
+        else:
+            self._id_label_store.append(
+                snapshot.header, puts=snapshot.puts, deletes=snapshot.deletes
+            )
+        self._compact_on_persist = False
+        self._durable_max_seq_id = snapshot.header.max_seq_id
 
-        with open(self._get_metadata_file(), "wb") as metadata_file:
-            pickle.dump(self._persist_data, metadata_file, pickle.HIGHEST_PROTOCOL)
+    def durable_max_seqid(self) -> SeqId:
+        """Return the max seq_id that has been synced to disk. On restart, the
+        segment replays the log from this point."""
+        return self._durable_max_seq_id
+
+    def flush(self) -> None:
+        """Block until all pending background persistence has completed"""
+        if self._persister is not None:
+            self._persister.wait()
 
     @trace_method(
         "PersistentLocalHnswSegment._apply_batch", OpenTelemetryGranularity.ALL
@@ -212,12 +619,167 @@ class PersistentLocalHnswSegment(LocalHnswSegment):
     @override
     def _apply_batch(self, batch: Batch) -> None:
         super()._apply_batch(batch)
+        self._applied_max_seq_id = max(self._applied_max_seq_id, batch.max_seq_id)
+        for id in batch.get_deleted_ids():
+            self._dirty_ids.discard(id)
+            self._deleted_ids_since_persist.add(id)
+        for id in batch.get_written_ids():
+            self._deleted_ids_since_persist.discard(id)
+            self._dirty_ids.add(id)
+
+    def _apply_full_batch(self) -> None:
+        """Apply the current batch to the hnsw index once it is full, unless a
+        background sync is writing the index, and persist once hnsw:sync_threshold
+        elements were added since the last sync. The caller must hold the writer
+        lock."""
+        if len(self._curr_batch) < self._batch_size or self._index_frozen:
+            return
+        with WriteRWLock(self._lock):
+            self._apply_batch(self._curr_batch)
+        self._curr_batch = Batch()
+        cast(BruteForceIndex, self._brute_force_index).clear()
+        self._maybe_persist()
+
+    def _maybe_persist(self) -> None:
+        """Persist once hnsw:sync_threshold elements were added since the last sync.
+        The caller must hold the writer lock, and not the segment lock."""
         if (
-            self._total_elements_added - self._persist_data.total_elements_added
+            self._total_elements_added - self._persisted_total_elements_added
             >= self._sync_threshold
         ):
+            self._request_persist()
+
+    def _request_persist(self) -> None:
+        """Persist the index and data to disk, in the background if
+        hnsw:background_persist is set. The caller must hold the writer lock, and
+        not the segment lock."""
+        if self._persister is not None:
+            # Count the pending changes as persisted so that later batches do not
+            # request the same flush again
+            self._persisted_total_elements_added = self._total_elements_added
+            self._persister.request()
+        else:
             self._persist()
 
+    def _can_bulk_load(self, records: Sequence[LogRecord]) -> bool:
+        """Whether the records can be bulk loaded: they all add new embeddings of the
+        same dimensionality, and either a bulk load is going on, or there are at
+        least _BULK_LOAD_MIN_RECORDS and hnsw:batch_size of them and the collection
+        is empty or sets hnsw:bulk_load"""
+        if len(records) == 0:
+            return False
+        if not self._bulk_loading:
+            if len(records) < max(self._batch_size, self._BULK_LOAD_MIN_RECORDS):
+                return False
+            if not self._params.bulk_load and (
+                len(self._id_labels) > 0 or len(self._curr_batch) > 0
+            ):
+                return False
+        ids = set()
+        dimensionality = self._dimensionality
+        for record in records:
+            operation_record = record["operation_record"]
+            embedding = operation_record["embedding"]
+            if (
+                operation_record["operation"] not in (Operation.ADD, Operation.UPSERT)
+                or embedding is None
+                or operation_record["id"] in self._id_labels
+                or self._curr_batch.is_written(operation_record["id"])
+            ):
+                return False
+            if dimensionality is None:
+                dimensionality = len(embedding)
+            elif len(embedding) != dimensionality:
+                return False
+            ids.add(operation_record["id"])
+        return len(ids) == len(records)
+
+    @trace_method("PersistentLocalHnswSegment._bulk_load", OpenTelemetryGranularity.ALL)
+    def _bulk_load(self, records: Sequence[LogRecord]) -> None:
+        """Add the embeddings of records accepted by _can_bulk_load to the index in
+        large chunks, which hnswlib builds with hnsw:num_threads threads, instead of
+        buffering them in the brute force index. The caller must hold the segment
+        write lock, and persists the index once released."""
+        # Apply the writes buffered so far first, to keep the records in order
+        if len(self._curr_batch) > 0:
+            self._apply_batch(self._curr_batch)
+            self._curr_batch = Batch()
+            cast(BruteForceIndex, self._brute_force_index).clear()
+
+        vectors = np.array(
+            [record["operation_record"]["embedding"] for record in records],
+            dtype=np.float32,
+        )
+        self._ensure_index(len(records), vectors.shape[1])
+        index = cast(hnswlib.Index, self._index)
+        labels = np.arange(
+            self._total_elements_added + 1,
+            self._total_elements_added + len(records) + 1,
+            dtype=np.uint64,
+        )
+        for start in range(0, len(records), self._BULK_LOAD_CHUNK_SIZE):
+            end = start + self._BULK_LOAD_CHUNK_SIZE
+            index.add_items(vectors[start:end], labels[start:end])
+
+        ids = [record["operation_record"]["id"] for record in records]
+        for id, label, record in zip(ids, labels.tolist(), records):
+            self._id_labels.set(id, label, record["log_offset"])
+        self._total_elements_added += len(records)
+        max_seq_id = max(record["log_offset"] for record in records)
+        self._max_seq_id = max(self._max_seq_id, max_seq_id)
+        self._applied_max_seq_id = max(self._applied_max_seq_id, max_seq_id)
+        self._dirty_ids.update(ids)
+        self._deleted_ids_since_persist.difference_update(ids)
+        if self._compaction_changes is not None:
+            self._compaction_changes.update(ids)
+        self._maybe_schedule_compaction()
+
+    def _end_bulk_load(self) -> None:
+        """End a bulk load, if one is going on, and persist the elements it added
+        since the last sync. The caller must hold the writer lock, and not the
+        segment lock."""
+        self._bulk_loading = False
+        self._cancel_bulk_load_timer()
+        if self._bulk_load_unpersisted:
+            self._bulk_load_unpersisted = False
+            if self._total_elements_added > self._persisted_total_elements_added:
+                self._request_persist()
+
+    def _restart_bulk_load_timer(self) -> None:
+        """Start the timer that ends the bulk load once no write continues it for
+        _BULK_LOAD_IDLE_SECONDS, replacing the previous one. The caller must hold the
+        writer lock."""
+        self._cancel_bulk_load_timer()
+        self._bulk_load_writes += 1
+        timer = threading.Timer(
+            self._BULK_LOAD_IDLE_SECONDS,
+            self._end_idle_bulk_load,
+            args=(self._bulk_load_writes,),
+        )
+        timer.daemon = True
+        timer.name = f"hnsw-bulk-load-{self._id}"
+        self._bulk_load_timer = timer
+        timer.start()
+
+    def _cancel_bulk_load_timer(self) -> None:
+        """Cancel the timer of the bulk load, if any. The caller must hold the writer
+        lock."""
+        if self._bulk_load_timer is not None:
+            self._bulk_load_timer.cancel()
+            self._bulk_load_timer = None
+
+    def _end_idle_bulk_load(self, writes: int) -> None:
+        """End the bulk load from its timer, unless it was cancelled or restarted
+        by a later write meanwhile"""
+        try:
+            with self._writer_lock:
+                if self._bulk_load_timer is None or writes != self._bulk_load_writes:
+                    return
+                self._bulk_load_timer = None
+                self._end_bulk_load()
+        except Exception:
+            logger.exception(f"Ending the bulk load of segment {self._id} failed")
+
     @trace_method(
         "PersistentLocalHnswSegment._write_records", OpenTelemetryGranularity.ALL
     )
@@ -226,67 +788,84 @@ class PersistentLocalHnswSegment(LocalHnswSegment):
         """Add a batch of embeddings to the index"""
         if not self._running:
             raise RuntimeError("Cannot add embeddings to stopped component")
-        with WriteRWLock(self._lock):
-            for record in records:
+        self._ensure_mappings_loaded()
+        with self._writer_lock:
+            try:
+                self._write_records_unpublished(records)
+            finally:
+                self._publish_read_snapshot()
+
+    def _write_records_unpublished(self, records: Sequence[LogRecord]) -> None:
+        """Apply the records to the current batch and brute force index, and the
+        full batches to the hnsw index. The caller must hold the writer lock."""
+        if self._can_bulk_load(records):
+            self._bulk_loading = True
+            self._restart_bulk_load_timer()
+            # A frozen index is bulk loaded into by the next write instead
+            if not self._index_frozen:
+                with WriteRWLock(self._lock):
+                    self._bulk_load(records)
+                self._bulk_load_unpersisted = True
+                self._maybe_persist()
+                return
+        else:
+            self._end_bulk_load()
+        for record in records:
+            embedding = record["operation_record"]["embedding"]
+            if embedding is not None and (
+                not self._index_initialized or len(embedding) != self._dimensionality
+            ):
+                # Creates the index, or raises on a dimensionality mismatch
+                with WriteRWLock(self._lock):
+                    self._ensure_index(len(records), len(embedding))
+            if not self._index_initialized:
+                # If the index is not initialized here, it means that we have
+                # not yet added any records to the index. So we can just
+                # ignore the record since it was a delete.
+                continue
+            self._brute_force_index = cast(BruteForceIndex, self._brute_force_index)
+
+            self._max_seq_id = max(self._max_seq_id, record["log_offset"])
+            id = record["operation_record"]["id"]
+            op = record["operation_record"]["operation"]
+            exists_in_index = id in self._id_labels or self._brute_force_index.has_id(
+                id
+            )
+            exists_in_bf_index = self._brute_force_index.has_id(id)
+
+            if op == Operation.DELETE:
+                if exists_in_index:
+                    self._curr_batch.apply(record)
+                    if exists_in_bf_index:
+                        self._brute_force_index.delete([record])
+                else:
+                    logger.warning(f"Delete of nonexisting embedding ID: {id}")
+
+            elif op == Operation.UPDATE:
                 if record["operation_record"]["embedding"] is not None:
-                    self._ensure_index(
-                        len(records), len(record["operation_record"]["embedding"])
-                    )
-                if not self._index_initialized:
-                    # If the index is not initialized here, it means that we have
-                    # not yet added any records to the index. So we can just
-                    # ignore the record since it was a delete.
-                    continue
-                self._brute_force_index = cast(BruteForceIndex, self._brute_force_index)
-
-                self._max_seq_id = max(self._max_seq_id, record["log_offset"])
-                id = record["operation_record"]["id"]
-                op = record["operation_record"]["operation"]
-                exists_in_index = self._id_to_label.get(
-                    id, None
-                ) is not None or self._brute_force_index.has_id(id)
-                exists_in_bf_index = self._brute_force_index.has_id(id)
-
-                if op == Operation.DELETE:
                     if exists_in_index:
                         self._curr_batch.apply(record)
-                        if exists_in_bf_index:
-                            self._brute_force_index.delete([record])
+                        self._brute_force_index.upsert([record])
                     else:
-                        logger.warning(f"Delete of nonexisting embedding ID: {id}")
-
-                elif op == Operation.UPDATE:
-                    if record["operation_record"]["embedding"] is not None:
-                        if exists_in_index:
-                            self._curr_batch.apply(record)
-                            self._brute_force_index.upsert([record])
-                        else:
-                            logger.warning(
-                                f"Update of nonexisting embedding ID: {record['operation_record']['id']}"
-                            )
-                elif op == Operation.ADD:
-                    if record["operation_record"]["embedding"] is not None:
-                        if not exists_in_index:
-                            self._curr_batch.apply(record, not exists_in_index)
-                            self._brute_force_index.upsert([record])
-                        else:
-                            logger.warning(f"Add of existing embedding ID: {id}")
-                elif op == Operation.UPSERT:
-                    if record["operation_record"]["embedding"] is not None:
-                        self._curr_batch.apply(record, exists_in_index)
+                        logger.warning(
+                            f"Update of nonexisting embedding ID: {record['operation_record']['id']}"
+                        )
+            elif op == Operation.ADD:
+                if record["operation_record"]["embedding"] is not None:
+                    if not exists_in_index:
+                        self._curr_batch.apply(record, not exists_in_index)
                         self._brute_force_index.upsert([record])
-                if len(self._curr_batch) >= self._batch_size:
-                    self._apply_batch(self._curr_batch)
-                    self._curr_batch = Batch()
-                    self._brute_force_index.clear()
+                    else:
+                        logger.warning(f"Add of existing embedding ID: {id}")
+            elif op == Operation.UPSERT:
+                if record["operation_record"]["embedding"] is not None:
+                    self._curr_batch.apply(record, exists_in_index)
+                    self._brute_force_index.upsert([record])
+            self._apply_full_batch()
 
     @override
     def count(self) -> int:
-        return (
-            len(self._id_to_label)
-            + self._curr_batch.add_count
-            - self._curr_batch.delete_count
-        )
+        return self._read_snapshot.count
 
     @trace_method(
         "PersistentLocalHnswSegment.get_vectors", OpenTelemetryGranularity.ALL
@@ -296,40 +875,55 @@ class PersistentLocalHnswSegment(LocalHnswSegment):
         self, ids: Optional[Sequence[str]] = None
     ) -> Sequence[VectorEmbeddingRecord]:
         """Get the embeddings from the HNSW index and layered brute force
-        batch index."""
-
-        ids_hnsw: Set[str] = set()
-        ids_bf: Set[str] = set()
-
-        if self._index is not None:
-            ids_hnsw = set(self._id_to_label.keys())
-        if self._brute_force_index is not None:
-            ids_bf = set(self._curr_batch.get_written_ids())
-
-        target_ids = ids or list(ids_hnsw.union(ids_bf))
-        self._brute_force_index = cast(BruteForceIndex, self._brute_force_index)
-        hnsw_labels = []
-
+        batch index. The batch is read from the current snapshot, and the hnsw
+        index under the read lock."""
+        self._ensure_mappings_loaded()
+        snapshot = self._read_snapshot
+        ids_bf = snapshot.written_ids
+
+        # Results are filled in below so that both the brute force and the hnsw
+        # lookups can be batched
         results: List[Optional[VectorEmbeddingRecord]] = []
-        id_to_index: Dict[str, int] = {}
-        for i, id in enumerate(target_ids):
-            if id in ids_bf:
-                results.append(self._brute_force_index.get_vectors([id])[0])
-            elif id in ids_hnsw and id not in self._curr_batch._deleted_ids:
-                hnsw_labels.append(self._id_to_label[id])
-                # Placeholder for hnsw results to be filled in down below so we
-                # can batch the hnsw get() call
-                results.append(None)
-            id_to_index[id] = i
-
-        if len(hnsw_labels) > 0 and self._index is not None:
-            vectors = cast(Sequence[Vector], self._index.get_items(hnsw_labels))
-
-            for label, vector in zip(hnsw_labels, vectors):
-                id = self._label_to_id[label]
-                results[id_to_index[id]] = VectorEmbeddingRecord(
-                    id=id, embedding=vector
-                )
+        bf_ids: List[str] = []
+        bf_positions: List[int] = []
+        hnsw_ids: List[str] = []
+        hnsw_labels: List[int] = []
+        hnsw_positions: List[int] = []
+        with ReadRWLock(self._lock):
+            if ids:
+                target_ids = ids
+            else:
+                target_ids = list(ids_bf)
+                if self._index is not None:
+                    target_ids.extend(
+                        id for id in self._id_labels.ids() if id not in ids_bf
+                    )
+
+            for id in target_ids:
+                if id in ids_bf:
+                    bf_ids.append(id)
+                    bf_positions.append(len(results))
+                    results.append(None)
+                elif self._index is not None and id not in snapshot.deleted_ids:
+                    label = self._id_labels.get_label(id)
+                    if label is not None:
+                        hnsw_ids.append(id)
+                        hnsw_labels.append(label)
+                        hnsw_positions.append(len(results))
+                        results.append(None)
+
+            vectors: Sequence[Vector] = []
+            if len(hnsw_labels) > 0 and self._index is not None:
+                vectors = cast(Sequence[Vector], self._index.get_items(hnsw_labels))
+
+        if len(bf_ids) > 0:
+            bf_index = cast(BruteForceIndexView, snapshot.brute_force_index)
+            bf_records = bf_index.get_vectors(bf_ids)
+            for position, record in zip(bf_positions, bf_records):
+                results[position] = record
+
+        for position, id, vector in zip(hnsw_positions, hnsw_ids, vectors):
+            results[position] = VectorEmbeddingRecord(id=id, embedding=vector)
 
         return results  # type: ignore ## Python can't cast List with Optional to List with VectorEmbeddingRecord
 
@@ -340,86 +934,41 @@ class PersistentLocalHnswSegment(LocalHnswSegment):
     def query_vectors(
         self, query: VectorQuery
     ) -> Sequence[Sequence[VectorQueryResult]]:
-        if self._index is None and self._brute_force_index is None:
+        self._ensure_mappings_loaded()
+        # The batch and brute force index are read from the snapshot without any
+        # lock. Only the hnsw search takes the read lock, and writers only hold the
+        # write lock while they change the hnsw index.
+        snapshot = self._read_snapshot
+        if snapshot.brute_force_index is None:
             return [[] for _ in range(len(query["vectors"]))]
 
         k = query["k"]
-        if k > self.count():
+        if k > snapshot.count:
             logger.warning(
-                f"Number of requested results {k} is greater than number of elements in index {self.count()}, updating n_results = {self.count()}"
+                f"Number of requested results {k} is greater than number of elements in index {snapshot.count}, updating n_results = {snapshot.count}"
             )
-            k = self.count()
-
-        # Overquery by updated and deleted elements layered on the index because they may
-        # hide the real nearest neighbors in the hnsw index
-        hnsw_k = k + self._curr_batch.update_count + self._curr_batch.delete_count
-        if hnsw_k > len(self._id_to_label):
-            hnsw_k = len(self._id_to_label)
+            k = snapshot.count
+
+        # The brute force index is layered on the hnsw index: the ids written or
+        # deleted in the current batch hide their hnsw results. Overquery by the
+        # updated and deleted ones, as they may hide the real nearest neighbors.
+        hnsw_k = k + snapshot.update_count + snapshot.delete_count
+        if hnsw_k > snapshot.hnsw_count:
+            hnsw_k = snapshot.hnsw_count
         hnsw_query = VectorQuery(
             vectors=query["vectors"],
             k=hnsw_k,
             allowed_ids=query["allowed_ids"],
             include_embeddings=query["include_embeddings"],
             options=query["options"],
+            max_distance=query.get("max_distance"),
         )
 
-        # For each query vector, we want to take the top k results from the
-        # combined results of the brute force and hnsw index
-        results: List[List[VectorQueryResult]] = []
-        self._brute_force_index = cast(BruteForceIndex, self._brute_force_index)
-        with ReadRWLock(self._lock):
-            bf_results = self._brute_force_index.query(query)
-            hnsw_results = super().query_vectors(hnsw_query)
-            for i in range(len(query["vectors"])):
-                # Merge results into a single list of size k
-                bf_pointer: int = 0
-                hnsw_pointer: int = 0
-                curr_bf_result: Sequence[VectorQueryResult] = bf_results[i]
-                curr_hnsw_result: Sequence[VectorQueryResult] = hnsw_results[i]
-                curr_results: List[VectorQueryResult] = []
-                # In the case where filters cause the number of results to be less than k,
-                # we set k to be the number of results
-                total_results = len(curr_bf_result) + len(curr_hnsw_result)
-                if total_results == 0:
-                    results.append([])
-                else:
-                    while len(curr_results) < min(k, total_results):
-                        if bf_pointer < len(curr_bf_result) and hnsw_pointer < len(
-                            curr_hnsw_result
-                        ):
-                            bf_dist = curr_bf_result[bf_pointer]["distance"]
-                            hnsw_dist = curr_hnsw_result[hnsw_pointer]["distance"]
-                            if bf_dist <= hnsw_dist:
-                                curr_results.append(curr_bf_result[bf_pointer])
-                                bf_pointer += 1
-                            else:
-                                id = curr_hnsw_result[hnsw_pointer]["id"]
-                                # Only add the hnsw result if it is not in the brute force index
-                                # as updated or deleted
-                                if not self._brute_force_index.has_id(
-                                    id
-                                ) and not self._curr_batch.is_deleted(id):
-                                    curr_results.append(curr_hnsw_result[hnsw_pointer])
-                                hnsw_pointer += 1
-                        else:
-                            break
-                    remaining = min(k, total_results) - len(curr_results)
-                    if remaining > 0 and hnsw_pointer < len(curr_hnsw_result):
-                        for i in range(
-                            hnsw_pointer,
-                            min(len(curr_hnsw_result), hnsw_pointer + remaining + 1),
-                        ):
-                            id = curr_hnsw_result[i]["id"]
-                            if not self._brute_force_index.has_id(
-                                id
-                            ) and not self._curr_batch.is_deleted(id):
-                                curr_results.append(curr_hnsw_result[i])
-                    elif remaining > 0 and bf_pointer < len(curr_bf_result):
-                        curr_results.extend(
-                            curr_bf_result[bf_pointer : bf_pointer + remaining]
-                        )
-                    results.append(curr_results)
-            return results
+        bf_results = snapshot.brute_force_index.query(query)
+        hnsw_results = super().query_vectors(hnsw_query)
+        return merge_layered_results(
+            [bf_results, hnsw_results], [snapshot.changed_ids, frozenset()], k
+        )
 
     @trace_method(
         "PersistentLocalHnswSegment.reset_state", OpenTelemetryGranularity.ALL
@@ -427,6 +976,15 @@ class PersistentLocalHnswSegment(LocalHnswSegment):
     @override
     def reset_state(self) -> None:
         if self._allow_reset:
+            self._join_compaction()
+            with self._writer_lock:
+                self._cancel_bulk_load_timer()
+            if self._persister is not None:
+                # Drop any pending sync, the data it would write is being deleted
+                self._persister.stop(flush=False)
+                self._persister = BackgroundPersister(
+                    self._persist_in_background, name=f"hnsw-persister-{self._id}"
+                )
             data_path = self._get_storage_folder()
             if os.path.exists(data_path):
                 self.close_persistent_index()
@@ -435,6 +993,11 @@ class PersistentLocalHnswSegment(LocalHnswSegment):
     @trace_method("PersistentLocalHnswSegment.delete", OpenTelemetryGranularity.ALL)
     @override
     def delete(self) -> None:
+        self._join_compaction()
+        with self._writer_lock:
+            self._cancel_bulk_load_timer()
+        if self._persister is not None:
+            self._persister.stop(flush=False)
         data_path = self._get_storage_folder()
         if os.path.exists(data_path):
             self.close_persistent_index()
@@ -0,0 +1,75 @@
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union, cast
+
+import hnswlib
+import numpy as np
+import numpy.typing as npt
+from overrides import override
+
+from chromadb.config import System
+from chromadb.segment.impl.vector.hnsw_params import PersistentHnswParams
+from chromadb.segment.impl.vector.ivf_index import IvfIndex
+from chromadb.segment.impl.vector.ivf_params import IvfParams
+from chromadb.segment.impl.vector.local_persistent_hnsw import (
+    PersistentLocalHnswSegment,
+)
+from chromadb.types import Metadata, Segment, Vector
+
+
+class PersistentLocalIvfSegment(PersistentLocalHnswSegment):
+    """A persistent vector segment backed by an inverted file index instead of an
+    hnsw graph. It builds much faster than hnsw and only keeps the centroids and
+    bookkeeping in memory, as the vectors are memory-mapped, which suits collections
+    too large to hold an hnsw graph in memory.
+
+    Writes are buffered, persisted and compacted like in the hnsw segment. Queries
+    scan the ivf:nprobe lists nearest to them, which can be overridden per query with
+    the "nprobe" query option."""
+
+    _ivf_params: IvfParams
+
+    def __init__(self, system: System, segment: Segment):
+        # Set before the base class initializes the index
+        self._ivf_params = IvfParams(segment["metadata"] or {})
+        super().__init__(system, segment)
+
+    @staticmethod
+    @override
+    def propagate_collection_metadata(metadata: Metadata) -> Optional[Metadata]:
+        hnsw_metadata = PersistentHnswParams.extract(metadata)
+        if "hnsw:quantization" in hnsw_metadata:
+            raise ValueError("hnsw:quantization is not supported by IVF collections")
+        return {**hnsw_metadata, **IvfParams.extract(metadata)}
+
+    @staticmethod
+    @override
+    def get_file_handle_count() -> int:
+        """Return how many file handles are used by the index"""
+        # The memory-mapped vectors, and one extra for the metadata file
+        return 2
+
+    @override
+    def _new_index(self, dimensionality: int) -> hnswlib.Index:
+        return cast(
+            hnswlib.Index,
+            IvfIndex(
+                space=self._params.space,
+                dim=dimensionality,
+                nlist=self._ivf_params.nlist,
+                nprobe=self._ivf_params.nprobe,
+                train_size=self._ivf_params.train_size,
+            ),
+        )
+
+    @override
+    def _knn_query(
+        self,
+        query_vectors: Sequence[Vector],
+        k: int,
+        filter: Optional[Callable[[int], bool]],
+        options: Optional[Dict[str, Union[str, int, float, bool]]],
+    ) -> Tuple[npt.NDArray[np.uint64], npt.NDArray[np.float32]]:
+        nprobe = (options or {}).get("nprobe")
+        if nprobe is not None and (not isinstance(nprobe, int) or nprobe <= 0):
+            raise ValueError(f"Invalid value for the nprobe query option: {nprobe}")
+        index = cast(IvfIndex, self._index)
+        return index.knn_query(query_vectors, k=k, filter=filter, nprobe=nprobe)
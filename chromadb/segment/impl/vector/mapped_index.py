@@ -0,0 +1,294 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from chromadb.utils import distance_functions
+from chromadb.utils.distance_functions import NORM_EPS
+
+
+def label_filter_mask(
+    labels: npt.NDArray[Any], filter: Callable[[int], bool]
+) -> npt.NDArray[np.bool_]:
+    """Return which of the given labels an hnswlib-style filter accepts"""
+    # The hnsw segments filter with the __getitem__ of a bytes bitmap, which can be
+    # applied without calling it once per label
+    bitmap = getattr(filter, "__self__", None)
+    if isinstance(bitmap, (bytes, bytearray)):
+        allowed = np.frombuffer(bitmap, dtype=np.uint8)
+        mask = labels < len(allowed)
+        mask[mask] = allowed[labels[mask]] != 0
+        return mask
+    return np.fromiter(
+        (bool(filter(label)) for label in labels.tolist()),
+        dtype=bool,
+        count=len(labels),
+    )
+
+
+class MappedIndex(ABC):
+    """The base of the numpy vector indexes that stand in for hnswlib.Index.
+
+    It implements the part of the subset of hnswlib.Index's interface used by the
+    hnsw segments that does not depend on how an index searches its vectors. Like
+    hnswlib, labels are arbitrary non-negative ints, deletes are tombstones, and the
+    cosine space stores normalized vectors. Indexes are not thread safe: callers
+    must not write concurrently with other calls.
+
+    The vectors, and anything else as large, are kept in stored arrays named by their
+    files. For persistent indexes they are memory-mapped from those files on first
+    use, so opening an index takes no time regardless of its size. The rest of the
+    state of an index is small. It is held in memory and written to METADATA_FILE by
+    persist_dirty.
+    """
+
+    METADATA_FILE: str
+
+    space: str
+    dim: int
+    _location: Optional[str]
+    _max_elements: int
+    _element_count: int
+    # The dtype and row shape of each stored array, by the name of its file
+    _layouts: Dict[str, Tuple[npt.DTypeLike, Tuple[int, ...]]]
+    # The stored arrays by the name of their file. For persistent indexes they are
+    # memory maps, missing until first use and after the file handles are closed.
+    _arrays: Dict[str, npt.NDArray[Any]]
+
+    def __init__(self, space: str, dim: int):
+        if space not in ("l2", "ip", "cosine"):
+            raise ValueError(f"Unknown distance function: {space}")
+        self.space = space
+        self.dim = dim
+        self._location = None
+        self._max_elements = 0
+        self._element_count = 0
+        self._layouts = {}
+        self._arrays = {}
+
+    @property
+    def element_count(self) -> int:
+        """The number of labels added, including deleted ones"""
+        return self._element_count
+
+    def init_index(
+        self,
+        max_elements: int,
+        ef_construction: int = 200,
+        M: int = 16,
+        is_persistent_index: bool = False,
+        persistence_location: Optional[str] = None,
+    ) -> None:
+        """Create an empty index. ef_construction and M are accepted for
+        compatibility with hnswlib and unused."""
+        if is_persistent_index and persistence_location is None:
+            raise ValueError("A persistent index requires a persistence_location")
+        self._location = persistence_location if is_persistent_index else None
+        self._max_elements = max_elements
+        self._element_count = 0
+        self._arrays = {}
+        self._init(max_elements + 1)
+        self.persist_dirty()
+
+    def load_index(
+        self, path: str, is_persistent_index: bool = True, max_elements: int = 0
+    ) -> None:
+        """Open the persistent index at the given location"""
+        with np.load(os.path.join(path, self.METADATA_FILE)) as data:
+            if not self._matches(data):
+                raise ValueError(f"Index at {path} does not match its configuration")
+            self._location = path
+            self._max_elements = int(data["max_elements"])
+            self._arrays = {}
+            self._load(data)
+        if max_elements > self._max_elements:
+            self.resize_index(max_elements)
+
+    def get_max_elements(self) -> int:
+        return self._max_elements
+
+    def resize_index(self, new_size: int) -> None:
+        if new_size < self._element_count:
+            raise RuntimeError(
+                "Cannot resize, max element is less than the current number of elements"
+            )
+        self._max_elements = new_size
+        self._grow_labels(new_size + 1)
+
+    def set_ef(self, ef: int) -> None:
+        """Accepted for compatibility with hnswlib"""
+        pass
+
+    def set_num_threads(self, num_threads: int) -> None:
+        """Accepted for compatibility with hnswlib. numpy's BLAS decides the
+        parallelism of the distance computations."""
+        pass
+
+    def persist_dirty(self) -> None:
+        """Write the metadata of a persistent index to disk. The stored arrays are
+        written through their memory maps, which are flushed first."""
+        if self._location is None:
+            return
+        for array in list(self._arrays.values()):
+            array.flush()  # type: ignore[attr-defined]
+        tmp_path = self._path(self.METADATA_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                dim=self.dim,
+                space=self.space,
+                max_elements=self._max_elements,
+                **self._metadata(),
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(self.METADATA_FILE))
+
+    def open_file_handles(self) -> None:
+        """Accepted for compatibility with hnswlib. The stored arrays are mapped
+        again on first use."""
+        pass
+
+    def close_file_handles(self) -> None:
+        """Unmap the stored arrays of a persistent index. Like hnswlib's, it does not
+        persist the index, which is left to the segment: it is called by the segment
+        manager without the segment's locks, and the segment persists its index
+        together with its id/label store."""
+        if self._location is not None:
+            self._arrays = {}
+
+    @abstractmethod
+    def _init(self, rows: int) -> None:
+        """Initialize the state of an empty index with room for the given number of
+        label rows"""
+        pass
+
+    @abstractmethod
+    def _load(self, data: Any) -> None:
+        """Initialize the state of the index from its metadata"""
+        pass
+
+    @abstractmethod
+    def _metadata(self) -> Dict[str, Any]:
+        """Return the arrays of the metadata of the index, other than its
+        configuration"""
+        pass
+
+    @abstractmethod
+    def _grow_labels(self, rows: int) -> None:
+        """Grow the index to hold labels below the given number of rows"""
+        pass
+
+    def _matches(self, data: Any) -> bool:
+        """Whether the metadata of a persistent index matches its configuration"""
+        return int(data["dim"]) == self.dim and str(data["space"]) == self.space
+
+    def _file(self, name: str) -> str:
+        """Return the file that currently holds the stored array of the given name"""
+        return name
+
+    def _path(self, name: str) -> str:
+        return os.path.join(str(self._location), name)
+
+    def _row_bytes(self, name: str) -> int:
+        dtype, row_shape = self._layouts[name]
+        return np.dtype(dtype).itemsize * int(np.prod(row_shape))
+
+    def _store(self, name: str, rows: int) -> npt.NDArray[Any]:
+        """Replace the stored array of the given name with an empty one of the given
+        number of rows"""
+        dtype, row_shape = self._layouts[name]
+        array: npt.NDArray[Any]
+        if self._location is None:
+            array = np.zeros((rows, *row_shape), dtype=dtype)
+        else:
+            array = np.memmap(
+                self._path(self._file(name)),
+                dtype=dtype,
+                mode="w+",
+                shape=(rows, *row_shape),
+            )
+        self._arrays[name] = array
+        return array
+
+    def _stored(self, name: str) -> npt.NDArray[Any]:
+        """Return the stored array of the given name, mapping it if needed"""
+        # The file handles may be closed concurrently, so the map is returned from a
+        # local rather than looked up again
+        array = self._arrays.get(name)
+        if array is None:
+            dtype, row_shape = self._layouts[name]
+            path = self._path(self._file(name))
+            rows = os.path.getsize(path) // self._row_bytes(name)
+            array = np.memmap(path, dtype=dtype, mode="r+", shape=(rows, *row_shape))
+            self._arrays[name] = array
+        return array
+
+    def _grow_stored(self, name: str, rows: int) -> None:
+        """Grow the stored array of the given name to the given number of rows"""
+        if self._location is None:
+            array = self._arrays[name]
+            dtype, row_shape = self._layouts[name]
+            self._arrays[name] = np.concatenate(
+                [array, np.zeros((rows - len(array), *row_shape), dtype=dtype)]
+            )
+            return
+        # Extending a file keeps the offsets of its existing rows, so it is grown in
+        # place and mapped again
+        mapped = self._arrays.pop(name, None)
+        if mapped is not None:
+            mapped.flush()  # type: ignore[attr-defined]
+        with open(self._path(self._file(name)), "r+b") as f:
+            f.truncate(rows * self._row_bytes(name))
+
+    def _items(
+        self, data: Any, ids: Sequence[int]
+    ) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int64]]:
+        """Return the vectors and labels given to add_items, with cosine vectors
+        normalized"""
+        vectors = np.atleast_2d(np.asarray(data, dtype=np.float32))
+        labels = np.asarray(ids, dtype=np.int64)
+        if vectors.shape != (len(labels), self.dim):
+            raise RuntimeError(
+                f"Wrong dimensionality of the vectors, expected {self.dim}"
+            )
+        return self._normalized(vectors), labels
+
+    def _normalized(self, vectors: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+        if self.space == "cosine":
+            vectors = vectors / (
+                np.linalg.norm(vectors, axis=1, keepdims=True) + NORM_EPS
+            )
+        return vectors
+
+    @staticmethod
+    def _no_results(
+        n_queries: int,
+    ) -> Tuple[npt.NDArray[np.uint64], npt.NDArray[np.float32]]:
+        return (
+            np.zeros((n_queries, 0), dtype=np.uint64),
+            np.zeros((n_queries, 0), dtype=np.float32),
+        )
+
+    def _rerank(
+        self,
+        queries: npt.NDArray[np.float32],
+        candidates: npt.NDArray[np.int64],
+        vectors: npt.NDArray[np.float32],
+        k: int,
+    ) -> Tuple[npt.NDArray[np.int64], npt.NDArray[np.float32]]:
+        """Return the k of the candidates of each query nearest to it, and their
+        distances, in ascending order. vectors are the vectors of the candidates,
+        which are scored exactly."""
+        if self.space == "l2":
+            diffs = vectors - queries[:, None, :]
+            distances = np.einsum("ijk,ijk->ij", diffs, diffs)
+        else:
+            distances = 1 - np.einsum("ijk,ik->ij", vectors, queries)
+        top, top_distances = distance_functions.top_k(distances, k)
+        return (
+            np.take_along_axis(candidates, top, axis=1),
+            top_distances.astype(np.float32),
+        )
@@ -0,0 +1,48 @@
+from typing import Any, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+
+QUANTIZATIONS = ("float16", "int8")
+
+
+class ScalarQuantizer:
+    """Encodes float32 vectors into compact codes that distances can be approximated
+    from.
+
+    - float16 halves the size of each vector and keeps about three significant
+      digits per component.
+    - int8 quarters it. Each vector is scaled symmetrically by its own largest
+      absolute component, so vectors of very different magnitudes can share one
+      index without any training pass.
+    """
+
+    quantization: str
+    code_dtype: Any
+
+    def __init__(self, quantization: str):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.quantization = quantization
+        self.code_dtype = np.float16 if quantization == "float16" else np.int8
+
+    def encode(
+        self, vectors: npt.NDArray[np.float32]
+    ) -> Tuple[npt.NDArray[Any], npt.NDArray[np.float32]]:
+        """Return the codes of a (n, dim) array of vectors and the per-vector scales
+        needed to decode them"""
+        if self.quantization == "float16":
+            return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def decode(
+        self, codes: npt.NDArray[Any], scales: npt.NDArray[np.float32]
+    ) -> npt.NDArray[np.float32]:
+        """Return the approximate float32 vectors of the given codes"""
+        if self.quantization == "float16":
+            return codes.astype(np.float32)
+        return codes.astype(np.float32) * scales[:, None]
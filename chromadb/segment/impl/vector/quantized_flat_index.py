@@ -0,0 +1,75 @@
+from typing import Any, Dict
+
+import numpy as np
+import numpy.typing as npt
+
+from chromadb.segment.impl.vector.flat_index import FlatIndex
+from chromadb.segment.impl.vector.quantization import ScalarQuantizer
+
+
+class QuantizedFlatIndex(FlatIndex):
+    """A flat vector index that searches scalar-quantized codes and re-ranks the best
+    candidates with the full-precision vectors.
+
+    Only the codes (and one scale per vector) are scanned by queries, so they are the
+    only part of the index that needs to stay resident. When persistent, the
+    full-precision vectors are only paged in for the candidates being re-ranked and
+    for get_items.
+    """
+
+    METADATA_FILE = "quantized_index.npz"
+    VECTORS_FILE = "quantized_vectors.bin"
+    CODES_FILE = "quantized_codes.bin"
+    SCALES_FILE = "quantized_scales.bin"
+
+    # Re-rank at least this many candidates per requested result
+    RERANK_FACTOR = 4
+
+    _quantizer: ScalarQuantizer
+    _ef: int
+
+    def __init__(self, space: str, dim: int, quantization: str):
+        super().__init__(space, dim)
+        self._quantizer = ScalarQuantizer(quantization)
+        self._ef = 10
+        self._layouts[self.CODES_FILE] = (self._quantizer.code_dtype, (dim,))
+        self._layouts[self.SCALES_FILE] = (np.float32, ())
+
+    @property
+    def quantization(self) -> str:
+        return self._quantizer.quantization
+
+    def set_ef(self, ef: int) -> None:
+        """Set the minimum number of candidates re-ranked per query"""
+        self._ef = ef
+
+    def _matches(self, data: Any) -> bool:
+        return super()._matches(data) and str(data["quantization"]) == self.quantization
+
+    def _metadata(self) -> Dict[str, Any]:
+        return {**super()._metadata(), "quantization": self.quantization}
+
+    def _write(
+        self, labels: npt.NDArray[np.int64], vectors: npt.NDArray[np.float32]
+    ) -> None:
+        super()._write(labels, vectors)
+        codes, scales = self._quantizer.encode(vectors)
+        self._stored(self.CODES_FILE)[labels] = codes
+        self._stored(self.SCALES_FILE)[labels] = scales
+
+    def _candidates(
+        self, queries: npt.NDArray[np.float32], labels: npt.NDArray[np.int64], k: int
+    ) -> npt.NDArray[np.int64]:
+        # The pool re-ranked with the full-precision vectors is selected by the
+        # approximate distances to the decoded codes
+        pool = min(len(labels), max(k * self.RERANK_FACTOR, self._ef))
+        return self._scan(queries, labels, pool)
+
+    def _scanned_vectors(self, labels: npt.NDArray[np.int64]) -> npt.NDArray[Any]:
+        return self._quantizer.decode(
+            self._stored(self.CODES_FILE)[labels],
+            self._stored(self.SCALES_FILE)[labels],
+        )
+
+    def _scanned_row_bytes(self) -> int:
+        return self._row_bytes(self.CODES_FILE)
@@ -0,0 +1,81 @@
+from typing import AbstractSet, List, Optional, Sequence, cast
+
+import numpy as np
+
+from chromadb.types import VectorQueryResult
+
+
+def merge_layered_results(
+    layers: Sequence[Sequence[Sequence[VectorQueryResult]]],
+    shadows: Sequence[AbstractSet[str]],
+    k: int,
+) -> List[List[VectorQueryResult]]:
+    """Merge the results of the same queries over layered sources into the k
+    nearest results of each query, sorted by distance.
+
+    layers are ordered from the top, most recent, source down, and each holds a list
+    of results per query. The ids in shadows[i] are written or deleted in layer i,
+    which hides the results of lower layers for them. Ties are won by the higher
+    layer. The candidates of all layers are merged in one step for all queries:
+    their distances are gathered into one array, hidden ones are masked out, and
+    the top k are selected with a partition of each row."""
+    n_queries = len(layers[0]) if len(layers) > 0 else 0
+    widths = [max((len(results) for results in layer), default=0) for layer in layers]
+    width = sum(widths)
+    k = min(k, width)
+    if n_queries == 0 or k <= 0:
+        return [[] for _ in range(n_queries)]
+
+    # Candidates are placed in the columns of their layer, padded with inf
+    distances = np.full((n_queries, width), np.inf)
+    candidates: List[List[Optional[VectorQueryResult]]] = [[] for _ in range(n_queries)]
+    hidden: AbstractSet[str] = frozenset()
+    start = 0
+    for layer, shadow, layer_width in zip(layers, shadows, widths):
+        for i, results in enumerate(layer):
+            candidates[i].extend(results)
+            candidates[i].extend([None] * (layer_width - len(results)))
+            if len(results) == 0:
+                continue
+            layer_distances = np.fromiter(
+                (r["distance"] for r in results), dtype=np.float64, count=len(results)
+            )
+            # NaN distances sort last, but are still returned
+            layer_distances[np.isnan(layer_distances)] = np.finfo(np.float64).max
+            if len(hidden) > 0:
+                is_hidden = np.fromiter(
+                    (r["id"] in hidden for r in results),
+                    dtype=np.bool_,
+                    count=len(results),
+                )
+                layer_distances[is_hidden] = np.inf
+            distances[i, start : start + len(results)] = layer_distances
+        start += layer_width
+        hidden = hidden | shadow if len(hidden) > 0 else shadow
+
+    # The k-th smallest distance of each row bounds its results. Of the candidates
+    # at that distance, those of the highest layers are taken.
+    kth = np.partition(distances, k - 1, axis=1)[:, k - 1 : k]
+    below = distances < kth
+    at = distances == kth
+    n_at = k - np.count_nonzero(below, axis=1, keepdims=True)
+    selected = below | (at & (np.cumsum(at, axis=1) <= n_at))
+    top = np.nonzero(selected)[1].reshape(n_queries, k)
+    top_distances = np.take_along_axis(distances, top, axis=1)
+    # Sorting by column after distance has the higher layers win ties
+    order = np.lexsort((top, top_distances), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_distances = np.take_along_axis(top_distances, order, axis=1)
+
+    merged: List[List[VectorQueryResult]] = []
+    for row_candidates, row, row_finite in zip(
+        candidates, top.tolist(), np.isfinite(top_distances).tolist()
+    ):
+        merged.append(
+            [
+                cast(VectorQueryResult, row_candidates[column])
+                for column, finite in zip(row, row_finite)
+                if finite
+            ]
+        )
+    return merged
@@ -31,6 +31,7 @@ from chromadb.errors import (
 from chromadb.quota import QuotaError
 from chromadb.rate_limiting import RateLimitError
 from chromadb.server import Server
+from chromadb.segment import SegmentManager
 from chromadb.server.fastapi.types import (
     AddEmbedding,
     CreateDatabase,
@@ -127,6 +128,7 @@ class FastAPI(Server):
         self._app = fastapi.FastAPI(debug=True, default_response_class=ORJSONResponse)
         self._system = System(settings)
         self._api: ServerAPI = self._system.instance(ServerAPI)
+        self._segment_manager = self._system.instance(SegmentManager)
         self._opentelemetry_client = self._api.require(OpenTelemetryClient)
         self._capacity_limiter = CapacityLimiter(
             settings.chroma_server_thread_pool_size
@@ -262,6 +264,12 @@ class FastAPI(Server):
             methods=["GET"],
             response_model=None,
         )
+        self.router.add_api_route(
+            "/api/v1/collections/{collection_name}/compact",
+            self.compact_collection,
+            methods=["POST"],
+            response_model=None,
+        )
         self.router.add_api_route(
             "/api/v1/collections/{collection_id}",
             self.update_collection,
@@ -632,6 +640,37 @@ class FastAPI(Server):
             ),
         )
 
+    @trace_method("FastAPI.compact_collection", OpenTelemetryGranularity.OPERATION)
+    async def compact_collection(
+        self,
+        request: Request,
+        collection_name: str,
+        tenant: str = DEFAULT_TENANT,
+        database: str = DEFAULT_DATABASE,
+    ) -> None:
+        (
+            maybe_tenant,
+            maybe_database,
+        ) = self.auth_and_get_tenant_and_database_for_request(
+            request.headers,
+            AuthzAction.COMPACT_COLLECTION,
+            tenant,
+            database,
+            collection_name,
+        )
+        if maybe_tenant:
+            tenant = maybe_tenant
+        if maybe_database:
+            database = maybe_database
+
+        await to_thread.run_sync(
+            self._api.compact_collection,
+            collection_name,
+            tenant,
+            database,
+            limiter=self._capacity_limiter,
+        )
+
     @trace_method("FastAPI.update_collection", OpenTelemetryGranularity.OPERATION)
     async def update_collection(
         self,
@@ -806,6 +845,7 @@ class FastAPI(Server):
                 offset=get.offset,
                 where_document=get.where_document,
                 include=get.include,
+                after=get.after,
             )
 
         return cast(
@@ -914,6 +954,7 @@ class FastAPI(Server):
                 where=query.where,  # type: ignore
                 where_document=query.where_document,  # type: ignore
                 include=query.include,
+                max_distance=query.max_distance,
             )
 
         nnresult = cast(
@@ -929,9 +970,14 @@ class FastAPI(Server):
 
     async def pre_flight_checks(self) -> Dict[str, Any]:
         def process_pre_flight_checks() -> Dict[str, Any]:
-            return {
+            checks: Dict[str, Any] = {
                 "max_batch_size": self._api.max_batch_size,
             }
+            # Reports how far loading segments at startup got, if configured
+            warmup = self._segment_manager.warmup_progress()
+            if warmup is not None:
+                checks["warmup"] = warmup
+            return checks
 
         return cast(
             Dict[str, Any],
@@ -34,6 +34,7 @@ class QueryEmbedding(BaseModel):
     query_embeddings: List[Any]
     n_results: int = 10
     include: Include = ["metadatas", "documents", "distances"]
+    max_distance: Optional[float] = None
 
 
 class GetEmbedding(BaseModel):
@@ -44,6 +45,7 @@ class GetEmbedding(BaseModel):
     limit: Optional[int] = None
     offset: Optional[int] = None
     include: Include = ["metadatas", "documents"]
+    after: Optional[str] = None
 
 
 class DeleteEmbedding(BaseModel):
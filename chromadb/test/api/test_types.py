@@ -1,6 +1,14 @@
 import pytest
 from typing import List, cast
-from chromadb.api.types import EmbeddingFunction, Documents, Image, Document, Embeddings
+from chromadb.api.types import (
+    EmbeddingFunction,
+    Documents,
+    Image,
+    Document,
+    Embeddings,
+    decode_cursor,
+    encode_cursor,
+)
 import numpy as np
 
 
@@ -38,3 +46,13 @@ def test_embedding_function_results_format_when_response_is_invalid() -> None:
     with pytest.raises(ValueError) as e:
         ef(random_documents())
     assert e.type is ValueError
+
+
+def test_decode_cursor() -> None:
+    for id in ["id1", "ünïcödé", "a?>b"]:
+        assert decode_cursor(encode_cursor(id)) == id
+
+    # Not base64, empty, or another encoding of an ID than encode_cursor's
+    for cursor in ["!!!", "", "aWQx=", "aWQx==", "YT8+Yg==", "\u00e9"]:
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
@@ -231,6 +231,19 @@ def _count_executor(
     col.count()
 
 
+def _compact_collection_executor(
+    api: ServerAPI,
+    root_api: ServerAPI,
+    draw: st.DrawFn,
+) -> None:
+    collection = draw(collection_name())
+    try:
+        root_api.create_collection(collection)
+    except Exception:
+        pass
+    api.compact_collection(collection)
+
+
 def _update_executor(
     api: ServerAPI,
     root_api: ServerAPI,
@@ -287,4 +300,5 @@ api_executors: Dict[str, Callable[[ServerAPI, ServerAPI, st.DrawFn], None]] = {
     "collection:count": _count_executor,
     "collection:update": _update_executor,
     "collection:upsert": _upsert_executor,
+    "collection:compact_collection": _compact_collection_executor,
 }
@@ -108,6 +108,7 @@ valid_action_space = [
     "collection:count",
     "collection:update",
     "collection:upsert",
+    "collection:compact_collection",
 ]
 
 
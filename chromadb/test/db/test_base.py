@@ -1,4 +1,6 @@
-from chromadb.db.base import ParameterValue, get_sql
+from typing import Any
+
+from chromadb.db.base import ParameterValue, StatementRegistry, get_sql
 import pypika
 
 
@@ -40,3 +42,62 @@ def test_value_params_numeric() -> None:
     sql, values = get_sql(value_based_query, formatstr=":{}")
     assert sql == original_query.get_sql()
     assert values == (42, 43)
+
+
+def test_statement_registry() -> None:
+    t = pypika.Table("foo")
+    registry = StatementRegistry()
+    builds = []
+
+    def build(a: Any, ids: Any) -> pypika.queries.QueryBuilder:
+        builds.append(1)
+        q = pypika.Query.from_(t).select(t.a).where(t.b == ParameterValue(True))
+        if has_a:
+            q = q.where(t.a == ParameterValue(a))
+        return q.where(t.id.isin(ParameterValue(ids)))
+
+    has_a = True
+    sql, values = registry.get(("foo", has_a), build, 42, ["x", "y", "z"])
+    assert sql == 'SELECT "a" FROM "foo" WHERE "b"=? AND "a"=? AND "id" IN (?, ?, ?, ?)'
+    # The IN list is padded to its arity bucket with its last item
+    assert values == (True, 42, "x", "y", "z", "z")
+
+    # Lists of the same arity bucket share the compiled statement
+    assert registry.get(("foo", has_a), build, 43, ["w", "x", "y", "z"]) == (
+        sql,
+        (True, 43, "w", "x", "y", "z"),
+    )
+    assert len(builds) == 1
+
+    # Filters that are left out are named by the key, and other arity buckets are
+    # other shapes
+    has_a = False
+    sql, values = registry.get(("foo", has_a), build, None, ["x"])
+    assert sql == 'SELECT "a" FROM "foo" WHERE "b"=? AND "id" IN (?)'
+    assert values == (True, "x")
+    has_a = True
+    sql, values = registry.get(("foo", has_a), build, 42, ["x", "y", "z", "w", "v"])
+    assert len(values) == 10
+    assert len(builds) == 3
+    assert registry.stats() == {"hits": 1, "misses": 3, "size": 3}
+
+
+def test_statement_registry_binds_none() -> None:
+    t = pypika.Table("foo")
+    registry = StatementRegistry()
+
+    def insert(*values: Any) -> pypika.queries.QueryBuilder:
+        q = pypika.Query.into(t).columns(t.a, t.b, t.c)
+        for i in range(0, len(values), 3):
+            q = q.insert(*(ParameterValue(v) for v in values[i : i + 3]))
+        return q
+
+    # Every mix of None and non-None values of a batch shares the shape of its size
+    for size in range(1, 5):
+        for mask in range(2 ** (3 * size)):
+            values = [None if mask >> i & 1 else i for i in range(3 * size)]
+            sql, params = registry.get(("insert", size), insert, *values)
+            assert sql.count("?") == 3 * size
+            assert "NULL" not in sql
+            assert params == tuple(values)
+    assert registry.stats()["size"] == 4
@@ -0,0 +1,68 @@
+import threading
+from typing import List
+
+import pytest
+
+from chromadb.segment.impl.vector.background_persister import BackgroundPersister
+
+
+def test_requests_during_a_flush_are_coalesced() -> None:
+    flushes: List[int] = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def flush() -> None:
+        flushes.append(len(flushes))
+        started.set()
+        release.wait()
+
+    persister = BackgroundPersister(flush, name="test-persister")
+    persister.request()
+    assert started.wait(5)
+
+    # The first flush is still running, so these collapse into a single follow-up
+    for _ in range(10):
+        persister.request()
+    release.set()
+    persister.wait()
+    assert len(flushes) == 2
+
+    persister.stop()
+    with pytest.raises(RuntimeError):
+        persister.request()
+
+
+def test_stop_completes_pending_flush() -> None:
+    flushes: List[int] = []
+    release = threading.Event()
+
+    def flush() -> None:
+        release.wait()
+        flushes.append(1)
+
+    persister = BackgroundPersister(flush, name="test-persister")
+    persister.request()
+    release.set()
+    persister.stop()
+    assert flushes == [1]
+
+    # Without a request, stopping does not flush
+    persister = BackgroundPersister(flush, name="test-persister")
+    persister.stop()
+    assert flushes == [1]
+
+
+def test_failed_flush_does_not_stop_the_thread() -> None:
+    calls: List[int] = []
+
+    def failing_flush() -> None:
+        calls.append(1)
+        raise ValueError("disk full")
+
+    persister = BackgroundPersister(failing_flush, name="test-persister")
+    persister.request()
+    persister.wait()
+    persister.request()
+    persister.wait()
+    persister.stop()
+    assert len(calls) == 2
@@ -0,0 +1,74 @@
+from typing import Optional
+
+import numpy as np
+import pytest
+
+from chromadb.errors import InvalidDimensionException
+from chromadb.segment.impl.vector.batch import Batch
+from chromadb.types import (
+    LogRecord,
+    Operation,
+    OperationRecord,
+    ScalarEncoding,
+    Vector,
+)
+
+
+def _record(
+    id: str, operation: Operation, seq_id: int, embedding: Optional[Vector] = None
+) -> LogRecord:
+    return LogRecord(
+        log_offset=seq_id,
+        operation_record=OperationRecord(
+            id=id,
+            embedding=embedding,
+            encoding=ScalarEncoding.FLOAT32 if embedding is not None else None,
+            metadata=None,
+            operation=operation,
+        ),
+    )
+
+
+def test_counts_and_dedup() -> None:
+    batch = Batch()
+    batch.apply(_record("new", Operation.ADD, 1, [1.0, 1.0]))
+    batch.apply(_record("existing", Operation.UPDATE, 2, [2.0, 2.0]))
+    batch.apply(_record("deleted", Operation.DELETE, 3))
+    batch.apply(_record("upserted", Operation.UPSERT, 4, [3.0, 3.0]), False)
+    assert (batch.add_count, batch.update_count, batch.delete_count) == (2, 1, 1)
+    assert len(batch) == 4
+
+    # Later changes to an id replace its earlier ones
+    batch.apply(_record("new", Operation.UPSERT, 5, [4.0, 4.0]), True)
+    batch.apply(_record("existing", Operation.DELETE, 6))
+    batch.apply(_record("deleted", Operation.UPSERT, 7, [5.0, 5.0]), True)
+    batch.apply(_record("upserted", Operation.DELETE, 8))
+    assert (batch.add_count, batch.update_count, batch.delete_count) == (1, 1, 1)
+    assert len(batch) == 3
+    assert batch.max_seq_id == 8
+
+    # An id added and deleted in the batch leaves no change behind
+    assert sorted(batch.get_written_ids()) == ["deleted", "new"]
+    assert batch.get_deleted_ids() == ["existing"]
+    assert batch.is_written("new") and not batch.is_deleted("new")
+    assert batch.is_deleted("existing")
+    assert not batch.is_written("upserted") and not batch.is_deleted("upserted")
+
+    vectors = batch.get_written_vectors(["new", "deleted"])
+    assert vectors.dtype == np.float32 and vectors.flags["C_CONTIGUOUS"]
+    assert vectors.tolist() == [[4.0, 4.0], [5.0, 5.0]]
+    assert batch.get_written_seq_ids(["new", "deleted"]) == [5, 7]
+
+
+def test_growth_and_dimensionality() -> None:
+    batch = Batch()
+    for i in range(1000):
+        batch.apply(_record(str(i), Operation.ADD, i, [float(i), -float(i)]))
+    assert batch.add_count == 1000
+    ids = [str(i) for i in range(0, 1000, 7)]
+    assert batch.get_written_vectors(ids).tolist() == [
+        [float(i), -float(i)] for i in range(0, 1000, 7)
+    ]
+    with pytest.raises(InvalidDimensionException):
+        batch.apply(_record("other", Operation.ADD, 1000, [1.0, 2.0, 3.0]))
+    assert batch.get_written_vectors([]).shape[0] == 0
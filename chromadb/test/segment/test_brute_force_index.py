@@ -0,0 +1,147 @@
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+from chromadb.segment.impl.vector.brute_force_index import BruteForceIndex
+from chromadb.types import LogRecord, Operation, OperationRecord, VectorQuery
+from chromadb.utils import distance_functions
+
+
+def _record(i: int, id: str, embedding: Optional[List[float]]) -> LogRecord:
+    return {
+        "log_offset": i,
+        "operation_record": OperationRecord(
+            id=id,
+            embedding=embedding,
+            encoding=None,
+            metadata=None,
+            operation=Operation.UPSERT if embedding is not None else Operation.DELETE,
+        ),
+    }  # type: ignore
+
+
+@pytest.mark.parametrize(
+    "space, distance_fn",
+    [
+        ("l2", distance_functions.l2),
+        ("ip", distance_functions.ip),
+        ("cosine", distance_functions.cosine),
+    ],
+)
+def test_query_matches_exact_distances(
+    space: str, distance_fn: Callable[[npt.ArrayLike, npt.ArrayLike], float]
+) -> None:
+    rng = np.random.default_rng(42)
+    dim = 16
+    vectors = rng.uniform(-1.0, 1.0, size=(50, dim))
+    index = BruteForceIndex(size=64, dimensionality=dim, space=space)
+    index.upsert([_record(i, f"id_{i}", v.tolist()) for i, v in enumerate(vectors)])
+
+    # Deleted slots must never be returned
+    deleted = {f"id_{i}" for i in range(0, 50, 7)}
+    index.delete([_record(100, id, None) for id in deleted])
+    live = [i for i in range(50) if f"id_{i}" not in deleted]
+
+    queries = rng.uniform(-1.0, 1.0, size=(5, dim))
+    k = 10
+    results = index.query(
+        VectorQuery(
+            vectors=queries.tolist(),
+            k=k,
+            allowed_ids=None,
+            include_embeddings=True,
+            options=None,
+        )
+    )
+
+    assert len(results) == len(queries)
+    for query, result in zip(queries, results):
+        expected: Any = sorted((distance_fn(vectors[i], query), i) for i in live)[:k]
+        assert [r["id"] for r in result] == [f"id_{i}" for _, i in expected]
+        assert np.allclose([r["distance"] for r in result], [d for d, _ in expected])
+        for r in result:
+            assert r["embedding"] is not None
+            assert np.allclose(r["embedding"], vectors[int(r["id"][3:])])
+
+
+def test_query_allowed_ids_and_small_k() -> None:
+    index = BruteForceIndex(size=8, dimensionality=2)
+    index.upsert([_record(i, f"id_{i}", [float(i), float(i)]) for i in range(5)])
+
+    results = index.query(
+        VectorQuery(
+            vectors=[[0.0, 0.0]],
+            k=10,
+            allowed_ids=["id_3", "id_1", "missing"],
+            include_embeddings=False,
+            options=None,
+        )
+    )
+    assert [r["id"] for r in results[0]] == ["id_1", "id_3"]
+    assert all(r["embedding"] is None for r in results[0])
+
+    index.clear()
+    results = index.query(
+        VectorQuery(
+            vectors=[[0.0, 0.0]],
+            k=1,
+            allowed_ids=None,
+            include_embeddings=False,
+            options=None,
+        )
+    )
+    assert results == [[]]
+
+
+def test_float32_storage_and_cached_norms() -> None:
+    index = BruteForceIndex(size=4, dimensionality=2, space="cosine")
+    index.upsert([_record(0, "a", [3.0, 4.0]), _record(1, "b", [1.0, 0.0])])
+    assert index.vectors.dtype == np.float32
+    assert np.allclose(index.norms[index.id_to_index["a"]], 5.0)
+
+    # Updates refresh the cached norm, deletes clear it
+    index.upsert([_record(2, "a", [0.0, 2.0])])
+    assert np.allclose(index.norms[index.id_to_index["a"]], 2.0)
+    index.delete([_record(3, "b", None)])
+    assert not index.has_id("b")
+
+    vectors = index.get_vectors()
+    assert len(vectors) == 1
+    assert isinstance(vectors[0]["embedding"], np.ndarray)
+    assert np.allclose(vectors[0]["embedding"], [0.0, 2.0])
+
+
+def test_views_share_the_buffer() -> None:
+    index = BruteForceIndex(size=4, dimensionality=2)
+    index.upsert([_record(0, "a", [1.0, 0.0]), _record(1, "b", [2.0, 0.0])])
+    view = index.view()
+    vectors = index.vectors.copy()
+
+    # Later writes append to the shared buffer, and leave what views see unchanged
+    index.upsert([_record(2, "a", [3.0, 0.0]), _record(3, "c", [4.0, 0.0])])
+    index.delete([_record(4, "b", None)])
+    next_view = index.view()
+    assert next_view.vectors is view.vectors
+    assert np.array_equal(index.vectors[:2], vectors[:2])
+    assert sorted(r["id"] for r in view.get_vectors()) == ["a", "b"]
+    assert np.allclose(view.get_vectors(["a"])[0]["embedding"], [1.0, 0.0])
+    assert sorted(r["id"] for r in next_view.get_vectors()) == ["a", "c"]
+    assert np.allclose(next_view.get_vectors(["a"])[0]["embedding"], [3.0, 0.0])
+
+    # Running out of slots moves the live ones to new arrays, and clearing the
+    # index allocates new ones
+    index.upsert([_record(5, "d", [5.0, 0.0])])
+    assert index.vectors is not view.vectors
+    assert len(index) == 3 and len(next_view) == 2
+    index.clear()
+    assert len(next_view) == 2
+    query = VectorQuery(
+        vectors=[[0.0, 0.0]],
+        k=3,
+        allowed_ids=None,
+        include_embeddings=False,
+        options=None,
+    )
+    assert [r["id"] for r in next_view.query(query)[0]] == ["a", "c"]
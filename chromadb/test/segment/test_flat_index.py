@@ -0,0 +1,128 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from chromadb.segment.impl.vector.flat_index import FlatIndex
+from chromadb.utils import distance_functions
+
+
+@pytest.mark.parametrize("space", ["l2", "ip", "cosine"])
+def test_exact(space: str) -> None:
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 16)).astype(np.float32)
+    queries = rng.standard_normal((10, 16)).astype(np.float32)
+
+    index = FlatIndex(space=space, dim=16)
+    # Force the scan over several chunks
+    index._SCAN_CHUNK_BYTES = 16 * 4 * 300
+    index.init_index(max_elements=2000)
+    index.add_items(vectors, np.arange(1, 2001))
+    labels, distances = index.knn_query(queries, k=10)
+
+    exact = distance_functions.pairwise(
+        space, queries.astype(np.float64), vectors.astype(np.float64)
+    )
+    # Labels start at 1, rows of vectors at 0
+    expected, expected_distances = distance_functions.top_k(exact, 10)
+    assert labels.tolist() == (expected + 1).tolist()
+    assert np.allclose(distances, expected_distances, atol=1e-4)
+
+
+def test_delete_and_filter() -> None:
+    index = FlatIndex(space="l2", dim=2)
+    index.init_index(max_elements=10)
+    index.add_items([[float(i), 0.0] for i in range(5)], [1, 2, 3, 4, 5])
+    index.mark_deleted(1)
+    index.mark_deleted(1)
+
+    labels, _ = index.knn_query([[0.0, 0.0]], k=2)
+    assert labels.tolist() == [[2, 3]]
+
+    bitmap = np.zeros(6, dtype=np.uint8)
+    bitmap[[1, 3, 5]] = 1
+    labels, _ = index.knn_query([[0.0, 0.0]], k=2, filter=bitmap.tobytes().__getitem__)
+    assert labels.tolist() == [[3, 5]]
+    labels, _ = index.knn_query([[0.0, 0.0]], k=1, filter=lambda label: label == 4)
+    assert labels.tolist() == [[4]]
+
+    with pytest.raises(RuntimeError):
+        index.knn_query([[0.0, 0.0]], k=5)
+    with pytest.raises(RuntimeError):
+        index.get_items([1])
+    with pytest.raises(RuntimeError):
+        index.mark_deleted(6)
+    assert index.element_count == 5
+
+
+def test_max_elements_and_resize() -> None:
+    index = FlatIndex(space="l2", dim=2)
+    index.init_index(max_elements=2)
+    index.add_items([[1.0, 1.0], [2.0, 2.0]], [1, 2])
+    # Updates do not count against the limit
+    index.add_items([[3.0, 3.0]], [2])
+    with pytest.raises(RuntimeError):
+        index.add_items([[4.0, 4.0]], [3])
+    index.resize_index(100)
+    index.add_items([[4.0, 4.0]], [50])
+    assert index.get_items([2, 50]) == [[3.0, 3.0], [4.0, 4.0]]
+
+
+def test_close_file_handles() -> None:
+    index = FlatIndex(space="l2", dim=2)
+    index.init_index(
+        max_elements=10,
+        is_persistent_index=True,
+        persistence_location=tempfile.mkdtemp(),
+    )
+    index.add_items([[1.0, 1.0], [2.0, 2.0]], [1, 2])
+
+    # Closing the file handles only unmaps the vectors file. Persisting the index is
+    # left to the segment, which persists it together with its id/label store.
+    persisted = []
+    index.persist_dirty = lambda: persisted.append(True)  # type: ignore[assignment]
+    index.close_file_handles()
+    assert persisted == []
+
+    # It is mapped again on first use, including to grow it
+    assert index.get_items([2]) == [[2.0, 2.0]]
+    index.close_file_handles()
+    index.resize_index(100)
+    index.add_items([[3.0, 3.0]], [50])
+    labels, _ = index.knn_query([[3.0, 3.0]], k=2)
+    assert labels.tolist() == [[50, 2]]
+
+
+def test_persistence() -> None:
+    path = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 8)).astype(np.float32)
+
+    index = FlatIndex(space="cosine", dim=8)
+    index.init_index(
+        max_elements=100, is_persistent_index=True, persistence_location=path
+    )
+    index.add_items(vectors[:100], np.arange(1, 101))
+    index.resize_index(300)
+    index.add_items(vectors[100:], np.arange(101, 301))
+    index.mark_deleted(7)
+    index.persist_dirty()
+    assert sorted(os.listdir(path)) == [FlatIndex.METADATA_FILE, FlatIndex.VECTORS_FILE]
+    labels, distances = index.knn_query(vectors[:5], k=3)
+
+    # Unmapped vectors are mapped again on use
+    index.close_file_handles()
+    assert np.allclose(index.get_items([8]), vectors[7] / np.linalg.norm(vectors[7]))
+
+    reopened = FlatIndex(space="cosine", dim=8)
+    reopened.load_index(path, is_persistent_index=True, max_elements=400)
+    assert reopened.element_count == 300
+    assert reopened.get_max_elements() == 400
+    reopened_labels, reopened_distances = reopened.knn_query(vectors[:5], k=3)
+    assert reopened_labels.tolist() == labels.tolist()
+    assert np.allclose(reopened_distances, distances)
+    assert 7 not in reopened_labels
+
+    with pytest.raises(ValueError):
+        FlatIndex(space="l2", dim=8).load_index(path)
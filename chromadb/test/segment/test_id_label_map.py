@@ -0,0 +1,58 @@
+import random
+from typing import Dict, Tuple
+
+import pytest
+
+from chromadb.segment.impl.vector.id_label_map import IdLabelMap
+
+
+def test_set_get_remove() -> None:
+    id_labels = IdLabelMap()
+    id_labels.set("a", 1, 10)
+    id_labels.set("ß-unicode", 2, 11)
+    assert len(id_labels) == 2
+    assert "a" in id_labels
+    assert id_labels.get_label("ß-unicode") == 2
+    assert id_labels.get_seq_id("a") == 10
+    assert id_labels.get_id(2) == "ß-unicode"
+    assert id_labels.get_ids([2, 1]) == ["ß-unicode", "a"]
+
+    # Updating the seq_id keeps the label
+    id_labels.set("a", 1, 12)
+    assert id_labels.get_seq_id("a") == 12
+    assert len(id_labels) == 2
+
+    assert id_labels.remove("a") == 1
+    assert id_labels.remove("a") is None
+    assert "a" not in id_labels
+    assert id_labels.get_label("a") is None
+    with pytest.raises(KeyError):
+        id_labels.get_id(1)
+    with pytest.raises(KeyError):
+        id_labels.get_ids([1, 2])
+    assert id_labels.ids() == ["ß-unicode"]
+
+
+def test_matches_dict_under_churn() -> None:
+    rng = random.Random(0)
+    id_labels = IdLabelMap()
+    expected: Dict[str, Tuple[int, int]] = {}
+    next_label = 1
+    for seq_id in range(50000):
+        id = f"id-{rng.randrange(5000)}"
+        if rng.random() < 0.3:
+            label = id_labels.remove(id)
+            assert label == expected.pop(id, (None, None))[0]
+        else:
+            label = expected[id][0] if id in expected else next_label
+            next_label += id not in expected
+            id_labels.set(id, label, seq_id)
+            expected[id] = (label, seq_id)
+
+    assert len(id_labels) == len(expected)
+    assert sorted(id_labels.items()) == sorted(
+        (id, label, seq_id) for id, (label, seq_id) in expected.items()
+    )
+    for id, (label, _) in expected.items():
+        assert id_labels.get_label(id) == label
+        assert id_labels.get_id(label) == id
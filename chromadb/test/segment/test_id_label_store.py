@@ -0,0 +1,139 @@
+import os
+import tempfile
+
+import pytest
+
+from chromadb.segment.impl.vector.id_label_map import IdLabelMap
+from chromadb.segment.impl.vector.id_label_store import (
+    IdLabelStore,
+    IdLabelStoreCorruptedError,
+    IdLabelStoreHeader,
+)
+
+
+def _header(count: int, max_seq_id: int = 0) -> IdLabelStoreHeader:
+    return IdLabelStoreHeader(
+        dimensionality=3,
+        total_elements_added=count,
+        max_seq_id=max_seq_id,
+        count=count,
+    )
+
+
+def test_append_and_load() -> None:
+    path = os.path.join(tempfile.mkdtemp(), "store.bin")
+    store = IdLabelStore(path)
+    assert not store.exists()
+
+    store.append(_header(2, 2), puts=[("a", 1, 1), ("b", 2, 2)], deletes=[])
+    size_after_first = os.path.getsize(path)
+    store.append(_header(2, 4), puts=[("c", 3, 4)], deletes=["a"])
+    # Only the delta was appended
+    assert os.path.getsize(path) - size_after_first < size_after_first
+
+    reopened = IdLabelStore(path)
+    header = reopened.read_header()
+    assert header.dimensionality == 3
+    assert header.max_seq_id == 4
+    assert header.count == 2
+    id_labels = reopened.load()
+    assert sorted(id_labels.items()) == [("b", 2, 2), ("c", 3, 4)]
+
+
+def test_uncommitted_tail_is_ignored() -> None:
+    path = os.path.join(tempfile.mkdtemp(), "store.bin")
+    store = IdLabelStore(path)
+    store.append(_header(1), puts=[("a", 1, 1)], deletes=[])
+
+    # Simulate a write that was torn before its header was committed
+    with open(path, "ab") as f:
+        f.write(b"\x01garbage")
+
+    reopened = IdLabelStore(path)
+    assert list(reopened.load().items()) == [("a", 1, 1)]
+    reopened.append(_header(2), puts=[("b", 2, 2)], deletes=[])
+    assert list(IdLabelStore(path).load().items()) == [("a", 1, 1), ("b", 2, 2)]
+
+
+def test_corrupted_entry_raises() -> None:
+    path = os.path.join(tempfile.mkdtemp(), "store.bin")
+    store = IdLabelStore(path)
+    store.append(_header(1), puts=[("abc", 1, 1)], deletes=[])
+
+    with open(path, "r+b") as f:
+        f.seek(-6, os.SEEK_END)
+        f.write(b"x")
+
+    with pytest.raises(IdLabelStoreCorruptedError):
+        IdLabelStore(path).load()
+
+
+def test_compaction() -> None:
+    path = os.path.join(tempfile.mkdtemp(), "store.bin")
+    store = IdLabelStore(path)
+    store.COMPACTION_MIN_ENTRIES = 4
+    store.append(_header(1), puts=[("a", 1, 1)], deletes=[])
+    for i in range(2, 6):
+        store.append(_header(1), puts=[("a", i, i)], deletes=[])
+    assert store.should_compact()
+
+    id_labels = IdLabelMap()
+    id_labels.set("a", 5, 5)
+    store.compact(_header(1), id_labels.items())
+    assert not store.should_compact()
+    assert store.read_header().entry_count == 1
+    assert list(IdLabelStore(path).load().items()) == [("a", 5, 5)]
+
+
+def test_torn_header_falls_back_to_previous_commit() -> None:
+    path = os.path.join(tempfile.mkdtemp(), "store.bin")
+    store = IdLabelStore(path)
+    store.append(_header(1, 1), puts=[("a", 1, 1)], deletes=[])
+    store.append(_header(2, 2), puts=[("b", 2, 2)], deletes=[])
+    store.append(_header(3, 3), puts=[("c", 3, 3)], deletes=[])
+    newest = store.read_header()
+
+    # Corrupt the slot holding the newest header, as a torn write would
+    slot_size = IdLabelStore._SLOT_SIZE
+    with open(path, "r+b") as f:
+        f.seek(newest.generation % 2 * slot_size + 20)
+        f.write(b"torn")
+
+    reopened = IdLabelStore(path)
+    header = reopened.read_header()
+    assert header.generation == newest.generation - 1
+    assert header.max_seq_id == 2
+    assert sorted(reopened.load().items()) == [("a", 1, 1), ("b", 2, 2)]
+    # The next commit overwrites the torn slot
+    reopened.append(_header(3, 4), puts=[("d", 4, 4)], deletes=[])
+    assert sorted(IdLabelStore(path).load().items()) == [
+        ("a", 1, 1),
+        ("b", 2, 2),
+        ("d", 4, 4),
+    ]
+
+
+def test_truncated_header_raises() -> None:
+    path = os.path.join(tempfile.mkdtemp(), "store.bin")
+    store = IdLabelStore(path)
+    store.append(_header(1), puts=[("a", 1, 1)], deletes=[])
+
+    with open(path, "r+b") as f:
+        f.truncate(10)
+
+    with pytest.raises(IdLabelStoreCorruptedError):
+        IdLabelStore(path).read_header()
+
+
+def test_large_seq_ids() -> None:
+    path = os.path.join(tempfile.mkdtemp(), "store.bin")
+    store = IdLabelStore(path)
+    large = 2**100
+    store.append(_header(1, large), puts=[("a", 1, large)], deletes=[])
+
+    reopened = IdLabelStore(path)
+    assert reopened.read_header().max_seq_id == large
+    assert list(reopened.load().items()) == [("a", 1, large)]
+
+    with pytest.raises(ValueError):
+        store.append(_header(1, 2**127), puts=[], deletes=[])
@@ -0,0 +1,188 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from chromadb.segment.impl.vector.ivf_index import IvfIndex, kmeans
+from chromadb.utils import distance_functions
+
+
+def _clustered(rng: np.random.Generator, centers: np.ndarray, n: int) -> np.ndarray:
+    assignments = rng.integers(0, len(centers), n)
+    return (centers[assignments] + rng.standard_normal((n, centers.shape[1]))).astype(
+        np.float32
+    )
+
+
+def test_kmeans() -> None:
+    rng = np.random.default_rng(0)
+    centers = np.array([[-10.0, -10.0], [0.0, 10.0], [10.0, -10.0]])
+    centroids = kmeans(_clustered(rng, centers, 3000), 3)
+    for center in centers:
+        assert np.min(np.linalg.norm(centroids - center, axis=1)) < 0.5
+
+
+@pytest.mark.parametrize("space", ["l2", "ip", "cosine"])
+def test_recall(space: str) -> None:
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((50, 16)) * 5
+    vectors = _clustered(rng, centers, 5000)
+    queries = _clustered(rng, centers, 20)
+
+    index = IvfIndex(space=space, dim=16, nlist=50, nprobe=8, train_size=2000)
+    index.init_index(max_elements=5000)
+    for start in range(0, 5000, 1000):
+        index.add_items(
+            vectors[start : start + 1000], np.arange(start + 1, start + 1001)
+        )
+    assert index.is_trained
+    labels, distances = index.knn_query(queries, k=10)
+
+    if space == "cosine":
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    exact = distance_functions.pairwise(
+        space, queries.astype(np.float64), vectors.astype(np.float64)
+    )
+    # Labels start at 1, rows of vectors at 0
+    expected, _ = distance_functions.top_k(exact, 10)
+    recall = np.mean(
+        [
+            len(set(row) & set(expected_row + 1)) / 10
+            for row, expected_row in zip(labels.tolist(), expected)
+        ]
+    )
+    assert recall >= 0.9
+    assert np.allclose(
+        distances,
+        np.take_along_axis(exact, labels.astype(np.int64) - 1, axis=1),
+        atol=1e-4,
+    )
+    # Probing every list is exhaustive
+    labels, _ = index.knn_query(queries, k=10, nprobe=50)
+    assert labels.tolist() == (expected + 1).tolist()
+
+
+def test_probes_until_k_candidates() -> None:
+    index = IvfIndex(space="l2", dim=2, nlist=4, nprobe=1, train_size=8)
+    index.init_index(max_elements=8)
+    corners = [[-10.0, -10.0], [-10.0, 10.0], [10.0, -10.0], [10.0, 10.0]]
+    index.add_items(
+        [[x + dx, y] for x, y in corners for dx in (0.0, 1.0)], list(range(1, 9))
+    )
+    assert index.is_trained
+
+    # A single list holds 2 vectors, so more are probed to return 3 results
+    labels, _ = index.knn_query([[10.0, 10.0]], k=3)
+    assert labels[0][:2].tolist() == [7, 8]
+    assert len(set(labels[0].tolist())) == 3
+
+    # Lists without accepted labels are skipped over as well
+    bitmap = np.zeros(9, dtype=np.uint8)
+    bitmap[[1, 2]] = 1
+    labels, _ = index.knn_query(
+        [[10.0, 10.0]], k=2, filter=bitmap.tobytes().__getitem__
+    )
+    assert labels.tolist() == [[2, 1]]
+    with pytest.raises(RuntimeError):
+        index.knn_query([[10.0, 10.0]], k=3, filter=bitmap.tobytes().__getitem__)
+
+
+def test_update_and_delete() -> None:
+    index = IvfIndex(space="l2", dim=2, nlist=2, nprobe=1, train_size=4)
+    index.init_index(max_elements=10)
+    index.add_items(
+        [[-10.0, 0.0], [-11.0, 0.0], [10.0, 0.0], [11.0, 0.0]], [1, 2, 3, 4]
+    )
+    assert index.is_trained
+
+    # Updating a vector moves it to the list of its new nearest centroid
+    index.add_items([[12.0, 0.0]], [1])
+    labels, _ = index.knn_query([[12.0, 0.0]], k=3)
+    assert labels.tolist() == [[1, 4, 3]]
+    assert index.get_items([1]) == [[12.0, 0.0]]
+
+    index.mark_deleted(4)
+    index.mark_deleted(4)
+    labels, _ = index.knn_query([[12.0, 0.0]], k=2)
+    assert labels.tolist() == [[1, 3]]
+    with pytest.raises(RuntimeError):
+        index.get_items([4])
+    with pytest.raises(RuntimeError):
+        index.mark_deleted(5)
+    assert index.element_count == 4
+
+
+def test_max_elements_and_resize() -> None:
+    index = IvfIndex(space="l2", dim=2, nlist=2, nprobe=1, train_size=100)
+    index.init_index(max_elements=2)
+    index.add_items([[1.0, 1.0], [2.0, 2.0]], [1, 2])
+    with pytest.raises(RuntimeError):
+        index.add_items([[3.0, 3.0]], [3])
+    index.resize_index(1000)
+    index.add_items(np.ones((600, 2)), np.arange(3, 603))
+    assert index.element_count == 602
+
+
+def test_close_file_handles() -> None:
+    path = tempfile.mkdtemp()
+    index = IvfIndex(space="l2", dim=2, nlist=2, nprobe=1, train_size=4)
+    index.init_index(
+        max_elements=10, is_persistent_index=True, persistence_location=path
+    )
+    index.add_items([[1.0, 1.0], [2.0, 2.0]], [1, 2])
+
+    # Closing the file handles only unmaps the vectors file. Persisting the index is
+    # left to the segment, which persists it together with its id/label store.
+    persisted = []
+    index.persist_dirty = lambda: persisted.append(True)  # type: ignore[assignment]
+    index.close_file_handles()
+    assert persisted == []
+
+    # It is mapped again on first use, including by training, which still moves the
+    # vectors to a file of a new generation
+    assert index.get_items([2]) == [[2.0, 2.0]]
+    index.close_file_handles()
+    index.add_items([[8.0, 8.0], [9.0, 9.0]], [3, 4])
+    assert index.is_trained
+    assert "ivf_vectors.1.bin" in os.listdir(path)
+    labels, _ = index.knn_query([[0.0, 0.0]], k=1)
+    assert labels.tolist() == [[1]]
+
+
+def test_persistence() -> None:
+    path = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1000, 8)).astype(np.float32)
+
+    index = IvfIndex(space="cosine", dim=8, nlist=10, nprobe=3, train_size=500)
+    index.init_index(
+        max_elements=300, is_persistent_index=True, persistence_location=path
+    )
+    index.add_items(vectors[:300], np.arange(1, 301))
+    index.resize_index(1000)
+    # Training redistributes the vectors to a new file
+    index.add_items(vectors[300:], np.arange(301, 1001))
+    index.mark_deleted(7)
+    index.persist_dirty()
+    assert sorted(os.listdir(path)) == [IvfIndex.METADATA_FILE, "ivf_vectors.1.bin"]
+    labels, distances = index.knn_query(vectors[:5], k=3)
+
+    # Unmapped vectors are mapped again on use
+    index.close_file_handles()
+    assert np.allclose(index.get_items([8]), vectors[7] / np.linalg.norm(vectors[7]))
+
+    reopened = IvfIndex(space="cosine", dim=8, nlist=10, nprobe=3, train_size=500)
+    reopened.load_index(path, is_persistent_index=True, max_elements=2000)
+    assert reopened.is_trained
+    assert reopened.element_count == 1000
+    assert reopened.get_max_elements() == 2000
+    reopened_labels, reopened_distances = reopened.knn_query(vectors[:5], k=3)
+    assert reopened_labels.tolist() == labels.tolist()
+    assert np.allclose(reopened_distances, distances)
+    assert 7 not in reopened_labels
+
+    with pytest.raises(ValueError):
+        IvfIndex(space="cosine", dim=8, nlist=20, nprobe=3, train_size=500).load_index(
+            path
+        )
@@ -3,6 +3,7 @@ import shutil
 import tempfile
 import pytest
 from typing import (
+    Any,
     Generator,
     List,
     Callable,
@@ -20,6 +21,7 @@ from chromadb.db.base import ParameterValue, get_sql
 from chromadb.db.impl.sqlite import SqliteDB
 from chromadb.test.conftest import ProducerFn
 from chromadb.types import (
+    LogRecord,
     OperationRecord,
     MetadataEmbeddingRecord,
     Operation,
@@ -389,6 +391,41 @@ def test_fulltext(
     result = segment.get_metadata(where_document={"$contains": "zer"})
     assert len(result) == 9
 
+    # test case sensitivity, terms too short for the trigram index and wildcards
+    assert segment.get_metadata(where_document={"$contains": "Zero"}) == []
+    result = segment.get_metadata(where_document={"$contains": "ze"})
+    assert len(result) == 9
+    result = segment.get_metadata(where_document={"$contains": "z_r"})
+    assert len(result) == 9
+
+    # test $phrase and $match, which ignore case
+    result = segment.get_metadata(where_document={"$phrase": "Four Two"})
+    assert [r["id"] for r in result] == ["embedding_42"]
+    result = segment.get_metadata(where_document={"$match": "two FOUR"})
+    assert set([r["id"] for r in result]) == {"embedding_42", "embedding_24"}
+    result = segment.get_metadata(
+        where_document={"$and": [{"$match": "two"}, {"$not_contains": "four"}]}
+    )
+    assert len(result) == len(
+        [
+            i
+            for i in range(1, 100)
+            if "two" in _build_document(i) and "four" not in _build_document(i)
+        ]
+    )
+
+    # terms too short for the trigram index are compared without it, ignoring case
+    # and without wildcards
+    result = segment.get_metadata(where_document={"$match": "four TW"})
+    assert set([r["id"] for r in result]) == {
+        f"embedding_{i}"
+        for i in range(1, 100)
+        if "four" in _build_document(i) and "tw" in _build_document(i)
+    }
+    result = segment.get_metadata(where_document={"$phrase": "Ne"})
+    assert len(result) == len([i for i in range(1, 100) if "ne" in _build_document(i)])
+    assert segment.get_metadata(where_document={"$match": "o_"}) == []
+
 
 def test_delete(
     system: System,
@@ -589,6 +626,50 @@ def _test_update(
     assert len(results) == 0
 
 
+def test_write_batch(system: System) -> None:
+    system.reset_state()
+    segment = SqliteMetadataSegment(system, segment_definition)
+
+    def record(
+        id: str, operation: Operation, metadata: Optional[Dict[str, Any]] = None
+    ) -> OperationRecord:
+        return OperationRecord(
+            id=id,
+            metadata=metadata,
+            embedding=None,
+            encoding=None,
+            operation=operation,
+        )
+
+    # One batch, in which IDs repeat and are written in order
+    records = [
+        record("a", Operation.ADD, {"chroma:document": "one", "n": 1}),
+        record("b", Operation.ADD, {"chroma:document": "two", "n": 2}),
+        record("a", Operation.UPDATE, {"chroma:document": "three", "n": None}),
+        record("b", Operation.DELETE),
+        record("b", Operation.ADD, {"n": 4.5}),
+        record("c", Operation.UPSERT, {"flag": True}),
+        record("c", Operation.ADD, {"flag": False}),
+        record("d", Operation.UPDATE, {"n": 5}),
+        record("e", Operation.DELETE),
+    ]
+    segment._write_metadata(
+        [LogRecord(log_offset=i + 1, operation_record=r) for i, r in enumerate(records)]
+    )
+    assert segment.max_seqid() == len(records)
+    assert segment.count() == 3
+    results = {r["id"]: r["metadata"] for r in segment.get_metadata()}
+    assert results == {
+        "a": {"chroma:document": "three"},
+        "b": {"n": 4.5},
+        "c": {"flag": True},
+    }
+    results = segment.get_metadata(where_document={"$contains": "thr"})
+    assert [r["id"] for r in results] == ["a"]
+    assert segment.get_metadata(where_document={"$contains": "one"}) == []
+    assert segment.get_metadata(where_document={"$contains": "two"}) == []
+
+
 def test_limit(
     system: System,
     sample_embeddings: Iterator[OperationRecord],
@@ -632,6 +713,27 @@ def test_limit(
     res = segment.get_metadata(limit=3, offset=10)
     assert len(res) == 0
 
+    # page by the last ID of each page
+    ids = [r["id"] for r in segment.get_metadata()]
+    pages = [segment.get_metadata(limit=4)]
+    pages.append(segment.get_metadata(limit=4, after=pages[0][-1]["id"]))
+    assert [r["id"] for page in pages for r in page] == ids
+    res = segment.get_metadata(where={"int_key": {"$gt": 0}}, after=ids[1], limit=2)
+    assert [r["id"] for r in res] == [id for id in ids[2:] if id != "embedding_0"][:2]
+
+
+def test_metadata_indices(system: System) -> None:
+    system.reset_state()
+    _db = system.instance(SqliteDB)
+    with _db.tx() as cur:
+        for column in ["string_value", "int_value", "float_value", "bool_value"]:
+            plan = cur.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM embedding_metadata "
+                f"WHERE key = ? AND {column} > ?",
+                ("foo", 1),
+            ).fetchall()
+            assert f"COVERING INDEX embedding_metadata_{column}" in plan[0][-1]
+
 
 def test_delete_segment(
     system: System,
@@ -0,0 +1,136 @@
+import tempfile
+
+import numpy as np
+import pytest
+
+from chromadb.segment.impl.vector.quantized_flat_index import QuantizedFlatIndex
+from chromadb.utils import distance_functions
+
+
+def _exact_top_k(
+    space: str, queries: np.ndarray, vectors: np.ndarray, k: int
+) -> np.ndarray:
+    distances = distance_functions.pairwise(space, queries, vectors)
+    top, _ = distance_functions.top_k(distances, k)
+    return top
+
+
+@pytest.mark.parametrize("space", ["l2", "ip", "cosine"])
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_recall(space: str, quantization: str) -> None:
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1000, 32)).astype(np.float32)
+    if space == "ip":
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = rng.standard_normal((20, 32)).astype(np.float32)
+
+    index = QuantizedFlatIndex(space=space, dim=32, quantization=quantization)
+    index.init_index(max_elements=1000)
+    index.add_items(vectors, np.arange(1, 1001))
+    labels, distances = index.knn_query(queries, k=10)
+
+    # Labels start at 1, rows of vectors at 0
+    expected = _exact_top_k(space, queries, vectors, 10) + 1
+    recall = np.mean(
+        [
+            len(set(row) & set(expected_row)) / 10
+            for row, expected_row in zip(labels, expected)
+        ]
+    )
+    assert recall >= 0.95
+    # Distances are re-ranked with the full-precision vectors
+    exact = distance_functions.pairwise(space, queries, vectors)
+    assert np.allclose(
+        distances,
+        np.take_along_axis(exact, labels.astype(np.int64) - 1, axis=1),
+        atol=1e-4,
+    )
+
+
+def test_delete_and_filter() -> None:
+    index = QuantizedFlatIndex(space="l2", dim=2, quantization="int8")
+    index.init_index(max_elements=10)
+    index.add_items([[float(i), 0.0] for i in range(5)], [1, 2, 3, 4, 5])
+    index.mark_deleted(1)
+
+    labels, _ = index.knn_query([[0.0, 0.0]], k=2)
+    assert labels.tolist() == [[2, 3]]
+
+    bitmap = np.zeros(6, dtype=np.uint8)
+    bitmap[[3, 5]] = 1
+    labels, _ = index.knn_query([[0.0, 0.0]], k=2, filter=bitmap.tobytes().__getitem__)
+    assert labels.tolist() == [[3, 5]]
+    labels, _ = index.knn_query([[0.0, 0.0]], k=1, filter=lambda label: label == 4)
+    assert labels.tolist() == [[4]]
+
+    with pytest.raises(RuntimeError):
+        index.knn_query([[0.0, 0.0]], k=5)
+    with pytest.raises(RuntimeError):
+        index.get_items([1])
+    assert index.element_count == 5
+
+
+def test_max_elements_and_resize() -> None:
+    index = QuantizedFlatIndex(space="l2", dim=2, quantization="float16")
+    index.init_index(max_elements=2)
+    index.add_items([[1.0, 1.0], [2.0, 2.0]], [1, 2])
+    # Updates do not count against the limit
+    index.add_items([[3.0, 3.0]], [2])
+    with pytest.raises(RuntimeError):
+        index.add_items([[4.0, 4.0]], [3])
+    index.resize_index(100)
+    index.add_items([[4.0, 4.0]], [50])
+    assert index.get_items([2, 50]) == [[3.0, 3.0], [4.0, 4.0]]
+
+
+def test_close_file_handles() -> None:
+    index = QuantizedFlatIndex(space="l2", dim=2, quantization="int8")
+    index.init_index(
+        max_elements=10,
+        is_persistent_index=True,
+        persistence_location=tempfile.mkdtemp(),
+    )
+    index.add_items([[1.0, 1.0], [2.0, 2.0]], [1, 2])
+
+    # Closing the file handles only unmaps the files. Persisting the index is left to
+    # the segment, which persists it together with its id/label store.
+    persisted = []
+    index.persist_dirty = lambda: persisted.append(True)  # type: ignore[assignment]
+    index.close_file_handles()
+    assert persisted == []
+
+    # They are mapped again on first use
+    assert index.get_items([2]) == [[2.0, 2.0]]
+    labels, _ = index.knn_query([[0.0, 0.0]], k=1)
+    assert labels.tolist() == [[1]]
+
+
+def test_persistence() -> None:
+    path = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 8)).astype(np.float32)
+
+    index = QuantizedFlatIndex(space="cosine", dim=8, quantization="int8")
+    index.init_index(
+        max_elements=100, is_persistent_index=True, persistence_location=path
+    )
+    index.add_items(vectors[:100], np.arange(1, 101))
+    index.resize_index(300)
+    index.add_items(vectors[100:], np.arange(101, 301))
+    index.mark_deleted(7)
+    index.persist_dirty()
+    labels, distances = index.knn_query(vectors[:5], k=3)
+
+    reopened = QuantizedFlatIndex(space="cosine", dim=8, quantization="int8")
+    reopened.load_index(path, is_persistent_index=True, max_elements=400)
+    assert reopened.element_count == 300
+    assert reopened.get_max_elements() == 400
+    reopened_labels, reopened_distances = reopened.knn_query(vectors[:5], k=3)
+    assert reopened_labels.tolist() == labels.tolist()
+    assert np.allclose(reopened_distances, distances)
+    assert 7 not in reopened_labels
+
+    with pytest.raises(ValueError):
+        QuantizedFlatIndex(space="cosine", dim=8, quantization="float16").load_index(
+            path
+        )
@@ -0,0 +1,45 @@
+from typing import List, Tuple
+
+from chromadb.segment.impl.vector.result_merge import merge_layered_results
+from chromadb.types import VectorQueryResult
+
+
+def _results(*pairs: Tuple[str, float]) -> List[VectorQueryResult]:
+    return [VectorQueryResult(id=id, distance=d, embedding=None) for id, d in pairs]
+
+
+def _ids(merged: List[List[VectorQueryResult]]) -> List[List[str]]:
+    return [[r["id"] for r in results] for results in merged]
+
+
+def test_merge_two_layers() -> None:
+    top = [_results(("a", 0.5), ("b", 2.0)), _results()]
+    bottom = [
+        _results(("c", 0.1), ("a", 0.2), ("d", 1.0), ("e", 3.0)),
+        _results(("c", 0.1)),
+    ]
+    # a is updated and f deleted in the top layer, hiding a's result below it
+    merged = merge_layered_results([top, bottom], [{"a", "b", "f"}, set()], 3)
+    assert _ids(merged) == [["c", "a", "d"], ["c"]]
+    assert [r["distance"] for r in merged[0]] == [0.1, 0.5, 1.0]
+
+
+def test_merge_n_layers() -> None:
+    layers = [
+        [_results(("a", 1.0))],
+        [_results(("a", 0.0), ("b", 1.0), ("c", 2.0))],
+        [_results(("b", 0.0), ("c", 0.5), ("d", 0.7))],
+    ]
+    shadows = [{"a"}, {"b", "c", "x"}, set()]
+    # Ties are won by the higher layer
+    assert _ids(merge_layered_results(layers, shadows, 4)) == [["d", "a", "b", "c"]]
+    assert _ids(merge_layered_results(layers, shadows, 2)) == [["d", "a"]]
+    assert _ids(merge_layered_results(layers, shadows, 10)) == [["d", "a", "b", "c"]]
+
+
+def test_merge_empty() -> None:
+    assert merge_layered_results([[_results()], [_results()]], [set(), set()], 3) == [
+        []
+    ]
+    assert merge_layered_results([[], []], [set(), set()], 3) == []
+    assert merge_layered_results([[_results(("a", 1.0))]], [set()], 0) == [[]]
@@ -1,5 +1,17 @@
 import pytest
-from typing import Generator, List, Callable, Iterator, Type, cast
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    List,
+    Callable,
+    Iterator,
+    Optional,
+    Sequence,
+    Type,
+    Union,
+    cast,
+)
 from chromadb.config import System, Settings
 from chromadb.test.conftest import ProducerFn
 from chromadb.types import (
@@ -11,19 +23,34 @@ from chromadb.types import (
     SegmentScope,
     SeqId,
     Vector,
+    VectorQueryResult,
 )
 from chromadb.ingest import Producer
 from chromadb.segment import VectorReader
 import uuid
+import threading
 import time
+import hnswlib
+import numpy as np
 
 from chromadb.segment.impl.vector.local_hnsw import (
+    FilteredSearchStrategy,
     LocalHnswSegment,
 )
 
 from chromadb.segment.impl.vector.local_persistent_hnsw import (
     PersistentLocalHnswSegment,
 )
+from chromadb.segment.impl.vector.brute_force_index import BruteForceIndexView
+from chromadb.segment.impl.vector.flat_index import FlatIndex
+from chromadb.segment.impl.vector.ivf_index import IvfIndex
+from chromadb.segment.impl.vector.lazy_index import LazyIndex
+from chromadb.segment.impl.vector.local_persistent_flat import (
+    PersistentLocalFlatSegment,
+)
+from chromadb.segment.impl.vector.local_persistent_ivf import (
+    PersistentLocalIvfSegment,
+)
 
 from chromadb.test.property.strategies import test_hnsw_config
 from pytest import FixtureRequest
@@ -98,7 +125,12 @@ def sample_embeddings() -> Iterator[OperationRecord]:
 
 
 def vector_readers() -> List[Type[VectorReader]]:
-    return [LocalHnswSegment, PersistentLocalHnswSegment]
+    return [
+        LocalHnswSegment,
+        PersistentLocalHnswSegment,
+        PersistentLocalIvfSegment,
+        PersistentLocalFlatSegment,
+    ]
 
 
 @pytest.fixture(scope="module", params=vector_readers())
@@ -265,13 +297,15 @@ def test_ann_query(
     # Each item is its own nearest neighbor (all at once)
     vectors = [cast(Vector, e["embedding"]) for e in embeddings]
     query = VectorQuery(
-        vectors=vectors, k=1, allowed_ids=None, options=None, include_embeddings=False
+        vectors=vectors, k=1, allowed_ids=None, options=None, include_embeddings=True
     )
     results = segment.query_vectors(query)
     assert len(results) == len(embeddings)
     for r, e in zip(results, embeddings):
         assert len(r) == 1
         assert r[0]["id"] == e["id"]
+        assert r[0]["embedding"] is not None
+        assert approx_equal_vector(r[0]["embedding"], cast(Vector, e["embedding"]))
 
     # Each item's 3 nearest neighbors are itself and the item before and after
     test_embeddings = embeddings[1:-1]
@@ -289,6 +323,141 @@ def test_ann_query(
         assert r[2]["id"] == embeddings[i + 1]["id"]
 
 
+def test_filtered_query_strategies(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    vector_reader: Type[VectorReader],
+    produce_fns: ProducerFn,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = vector_reader(system, segment_definition)
+    segment.start()
+
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=100,
+    )
+    sync(segment, seq_ids[-1])
+
+    hnsw_segment = cast(LocalHnswSegment, segment)
+    assert (
+        hnsw_segment._plan_filtered_search(100, 10) == FilteredSearchStrategy.UNFILTERED
+    )
+    assert hnsw_segment._plan_filtered_search(10, 10) == FilteredSearchStrategy.EXACT
+
+    allowed_ids = [e["id"] for e in embeddings[::3]] + ["missing"]
+    query = VectorQuery(
+        vectors=[cast(Vector, e["embedding"]) for e in embeddings[40:43]],
+        k=3,
+        allowed_ids=allowed_ids,
+        options=None,
+        include_embeddings=True,
+    )
+
+    # Every strategy must return the same neighbors
+    results = {}
+    for strategy in FilteredSearchStrategy:
+        monkeypatch.setattr(
+            hnsw_segment, "_plan_filtered_search", lambda n, k, s=strategy: s
+        )
+        results[strategy] = segment.query_vectors(query)
+
+    expected = [
+        ["embedding_39", "embedding_42", "embedding_36"],
+        ["embedding_42", "embedding_39", "embedding_45"],
+        ["embedding_42", "embedding_39", "embedding_45"],
+    ]
+    for strategy in (FilteredSearchStrategy.EXACT, FilteredSearchStrategy.INDEX_FILTER):
+        assert [[r["id"] for r in row] for row in results[strategy]] == expected
+        for row in results[strategy]:
+            for r in row:
+                assert r["embedding"] is not None
+                assert approx_equal_vector(
+                    r["embedding"], embeddings[int(r["id"].split("_")[1])]["embedding"]
+                )
+        assert all(
+            approx_equal(a["distance"], b["distance"])
+            for row_a, row_b in zip(
+                results[strategy], results[FilteredSearchStrategy.INDEX_FILTER]
+            )
+            for a, b in zip(row_a, row_b)
+        )
+
+
+def test_range_query(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    vector_reader: Type[VectorReader],
+    produce_fns: ProducerFn,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = vector_reader(system, segment_definition)
+    segment.start()
+
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=100,
+    )
+    sync(segment, seq_ids[-1])
+
+    # Record how many neighbors each search of the index asks for
+    hnsw_segment = cast(LocalHnswSegment, segment)
+    knn_query = hnsw_segment._knn_query
+    searched_ks: List[int] = []
+
+    def record_knn_query(*args: Any) -> Any:
+        searched_ks.append(args[1])
+        return knn_query(*args)
+
+    monkeypatch.setattr(hnsw_segment, "_knn_query", record_knn_query)
+
+    vectors = np.array([e["embedding"] for e in embeddings], dtype=np.float64)
+    query_vector = cast(Vector, embeddings[50]["embedding"])
+    distances = np.sum((vectors - vectors[50]) ** 2, axis=1)
+    order = np.argsort(distances)
+    # A radius halfway between the 5th and 6th nearest neighbors
+    max_distance = float(distances[order[4]] + distances[order[5]]) / 2
+    within = [embeddings[i]["id"] for i in order[:5]]
+
+    query = VectorQuery(
+        vectors=[query_vector, cast(Vector, [1e6, 1e6])],
+        k=100,
+        allowed_ids=None,
+        options=None,
+        include_embeddings=True,
+        max_distance=max_distance,
+    )
+    results = segment.query_vectors(query)
+    assert [r["id"] for r in results[0]] == within
+    assert all(r["distance"] <= max_distance for r in results[0])
+    assert all(r["embedding"] is not None for r in results[0])
+    assert results[1] == []
+    # The search stopped once its first candidates exceeded the radius
+    assert all(k <= hnsw_segment._params.search_ef for k in searched_ks)
+
+    # n_results still caps the results within the radius
+    query["k"] = 3
+    assert [r["id"] for r in segment.query_vectors(query)[0]] == within[:3]
+
+    query["k"] = 100
+    query["allowed_ids"] = within[::2] + [e["id"] for e in embeddings[:10]]
+    assert [r["id"] for r in segment.query_vectors(query)[0]] == within[::2]
+
+
 def test_delete(
     system: System,
     sample_embeddings: Iterator[OperationRecord],
@@ -411,7 +580,7 @@ def _test_update(
     results = segment.get_vectors()
     assert len(results) == 3
     results = segment.get_vectors(ids=[embeddings[0]["id"]])
-    assert results[0]["embedding"] == [10.0, 10.0]
+    assert list(results[0]["embedding"]) == [10.0, 10.0]
 
     # Test querying at the old location
     vector = cast(Vector, embeddings[0]["embedding"])
@@ -624,6 +793,794 @@ def test_delete_with_local_segment_storage(
             segment.delete()
 
 
+def test_background_persist(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    produce_fns: ProducerFn,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:batch_size": 10,
+        "hnsw:sync_threshold": 10,
+        "hnsw:background_persist": True,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = PersistentLocalHnswSegment(system, segment_definition)
+    segment.start()
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=20,
+    )
+    sync(segment, seq_ids[-1])
+    segment.flush()
+    # Records written while a sync holds the index are buffered past the batch size,
+    # so the records that follow are only produced once the first 20 are durable
+    more_embeddings, more_seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=5,
+    )
+    embeddings = [*embeddings, *more_embeddings]
+    seq_ids = [*seq_ids, *more_seq_ids]
+    sync(segment, seq_ids[-1])
+    segment.flush()
+    # The last 5 records are still buffered and only the first 20 are durable
+    assert segment.durable_max_seqid() == seq_ids[19]
+    assert segment.max_seqid() == seq_ids[-1]
+    segment.stop()
+
+    # A reopened segment starts from the durable point and replays the rest
+    reopened = PersistentLocalHnswSegment(system, segment_definition)
+    assert reopened.max_seqid() == seq_ids[19]
+    assert reopened.count() == 20
+    reopened.start()
+    sync(reopened, seq_ids[-1])
+    assert reopened.count() == 25
+    results = reopened.get_vectors(ids=[embeddings[24]["id"]])
+    assert approx_equal_vector(
+        results[0]["embedding"], cast(Vector, embeddings[24]["embedding"])
+    )
+    reopened.stop()
+
+
+class _BlockingPersistIndex:
+    """Delegates to an hnsw index, holding persist_dirty until it is released"""
+
+    def __init__(self, index: hnswlib.Index):
+        self._index = index
+        self.persisting = threading.Event()
+        self.release = threading.Event()
+
+    def persist_dirty(self) -> None:
+        self.persisting.set()
+        assert self.release.wait(timeout=10)
+        self._index.persist_dirty()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._index, name)
+
+
+def test_background_persist_does_not_block_writers(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    produce_fns: ProducerFn,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:batch_size": 10,
+        "hnsw:sync_threshold": 10,
+        "hnsw:background_persist": True,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = PersistentLocalHnswSegment(system, segment_definition)
+    segment.start()
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=10,
+    )
+    sync(segment, seq_ids[-1])
+    segment.flush()
+    index = _BlockingPersistIndex(cast(hnswlib.Index, segment._index))
+    segment._index = cast(hnswlib.Index, index)
+
+    # The next full batch starts a sync, which blocks while writing the index
+    _, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=10,
+    )
+    sync(segment, seq_ids[-1])
+    assert index.persisting.wait(timeout=10)
+
+    # Writers and readers go on meanwhile. Full batches are buffered rather than
+    # applied to the frozen index.
+    writer = threading.Thread(
+        target=lambda: seq_ids.extend(
+            produce_fns(
+                producer=producer,
+                collection_id=collection_id,
+                embeddings=sample_embeddings,
+                n=25,
+            )[1]
+        )
+    )
+    writer.start()
+    writer.join(timeout=10)
+    assert not writer.is_alive()
+    sync(segment, seq_ids[-1])
+    assert len(segment._curr_batch) == 25
+    assert segment.count() == 45
+    query = VectorQuery(
+        vectors=[cast(Vector, embeddings[0]["embedding"])],
+        k=1,
+        allowed_ids=None,
+        include_embeddings=False,
+        options=None,
+    )
+    assert segment.query_vectors(query)[0][0]["id"] == embeddings[0]["id"]
+    assert segment.durable_max_seqid() < seq_ids[9]
+
+    # Once the index is written, the buffered batch is applied and synced too
+    index.release.set()
+    segment.flush()
+    assert len(segment._curr_batch) == 0
+    assert segment.durable_max_seqid() == seq_ids[-1]
+    assert segment.count() == 45
+    segment.stop()
+
+
+@pytest.mark.parametrize("bulk_load", [False, True])
+def test_bulk_load(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    bulk_load: bool,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:batch_size": 10,
+        "hnsw:bulk_load": bulk_load,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = PersistentLocalHnswSegment(system, segment_definition)
+    segment._BULK_LOAD_IDLE_SECONDS = 0.05
+    segment.start()
+    embeddings = [next(sample_embeddings) for _ in range(2010)]
+    seq_ids = producer.submit_embeddings(collection_id, embeddings[:1005])
+    sync(segment, seq_ids[-1])
+    # The records skip the brute force index, and are persisted at once
+    assert len(segment._curr_batch) == 0
+    assert segment.count() == 1005
+    assert segment.durable_max_seqid() == seq_ids[-1]
+
+    query = VectorQuery(
+        vectors=[cast(Vector, embeddings[50]["embedding"])],
+        k=3,
+        allowed_ids=None,
+        include_embeddings=False,
+        options=None,
+    )
+    expected = [embeddings[i]["id"] for i in (50, 49, 51)]
+    assert [r["id"] for r in segment.query_vectors(query)[0]] == expected
+
+    # The bulk load ends once it is idle
+    deadline = time.time() + 10
+    while segment._bulk_loading:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+    # Only collections that set hnsw:bulk_load start one in a non empty index
+    seq_ids = producer.submit_embeddings(collection_id, embeddings[1005:])
+    sync(segment, seq_ids[-1])
+    assert segment.count() == 2010
+    assert len(segment._curr_batch) == (0 if bulk_load else 5)
+    assert (segment.durable_max_seqid() == seq_ids[-1]) == bulk_load
+
+    assert [r["id"] for r in segment.query_vectors(query)[0]] == expected
+    results = segment.get_vectors(ids=[embeddings[1020]["id"]])
+    assert approx_equal_vector(
+        results[0]["embedding"], cast(Vector, embeddings[1020]["embedding"])
+    )
+    segment.stop()
+
+
+def test_bulk_load_session(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:batch_size": 10,
+        "hnsw:sync_threshold": 2500,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = PersistentLocalHnswSegment(system, segment_definition)
+    # Long enough for the bulk load not to end by itself
+    segment._BULK_LOAD_IDLE_SECONDS = 60
+    segment.start()
+    persisted_seq_ids: List[SeqId] = []
+    write_snapshot = segment._write_snapshot
+
+    def record_persist(snapshot: Any) -> None:
+        persisted_seq_ids.append(snapshot.header.max_seq_id)
+        write_snapshot(snapshot)
+
+    segment._write_snapshot = record_persist  # type: ignore[method-assign]
+
+    # An import arriving in consecutive chunks is bulk loaded as a whole, including
+    # chunks smaller than the one starting it, and only persisted once
+    # hnsw:sync_threshold elements were added. Queries between the chunks do not
+    # end it.
+    embeddings = [next(sample_embeddings) for _ in range(3000)]
+    seq_ids: List[SeqId] = []
+    for start, end in [(0, 1000), (1000, 1600), (1600, 2200), (2200, 2800)]:
+        seq_ids = producer.submit_embeddings(collection_id, embeddings[start:end])
+        sync(segment, seq_ids[-1])
+        assert len(segment._curr_batch) == 0
+        query = VectorQuery(
+            vectors=[cast(Vector, embeddings[start]["embedding"])],
+            k=1,
+            allowed_ids=None,
+            include_embeddings=False,
+            options=None,
+        )
+        results = segment.query_vectors(query)[0]
+        assert [r["id"] for r in results] == [embeddings[start]["id"]]
+        assert segment._bulk_loading
+    assert segment.count() == 2800
+    assert persisted_seq_ids == [seq_ids[-1]]
+
+    seq_ids = producer.submit_embeddings(collection_id, embeddings[2800:2900])
+    sync(segment, seq_ids[-1])
+    assert len(segment._curr_batch) == 0
+    assert segment.durable_max_seqid() < seq_ids[-1]
+
+    # A write that does not only add new embeddings ends it, and persists the rest
+    delete_record = OperationRecord(
+        id=embeddings[0]["id"],
+        embedding=None,
+        encoding=None,
+        metadata=None,
+        operation=Operation.DELETE,
+    )
+    delete_seq_id = producer.submit_embedding(collection_id, delete_record)
+    sync(segment, delete_seq_id)
+    assert persisted_seq_ids[1:] == [seq_ids[-1]]
+    assert len(segment._curr_batch) == 1
+    assert not segment._bulk_loading
+
+    # Later writes are buffered again
+    seq_ids = producer.submit_embeddings(collection_id, embeddings[2900:])
+    sync(segment, seq_ids[-1])
+    assert len(segment._curr_batch) == 1
+    assert segment.count() == 2999
+    assert len(persisted_seq_ids) == 2
+    segment.stop()
+
+
+def test_bulk_load_idle(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:batch_size": 10,
+        "hnsw:sync_threshold": 2500,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = PersistentLocalHnswSegment(system, segment_definition)
+    segment._BULK_LOAD_IDLE_SECONDS = 0.05
+    segment.start()
+    embeddings = [next(sample_embeddings) for _ in range(1005)]
+    seq_ids = producer.submit_embeddings(collection_id, embeddings[:1000])
+    sync(segment, seq_ids[-1])
+
+    # A bulk load without a write ending it is persisted once it is idle
+    deadline = time.time() + 10
+    while segment.durable_max_seqid() < seq_ids[-1]:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    assert not segment._bulk_loading
+
+    # Later writes are buffered again
+    seq_ids = producer.submit_embeddings(collection_id, embeddings[1000:])
+    sync(segment, seq_ids[-1])
+    assert len(segment._curr_batch) == 5
+    segment.stop()
+
+
+def test_lazy_index_loading(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    produce_fns: ProducerFn,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:batch_size": 10,
+        "hnsw:sync_threshold": 10,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = PersistentLocalHnswSegment(system, segment_definition)
+    segment.start()
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=20,
+    )
+    sync(segment, seq_ids[-1])
+    segment.stop()
+
+    # The header is served without loading the index, and closing it does not load
+    reopened = PersistentLocalHnswSegment(system, segment_definition)
+    index = reopened._index
+    assert isinstance(index, LazyIndex)
+    assert reopened.count() == 20
+    assert reopened.max_seqid() == seq_ids[-1]
+    reopened.close_persistent_index()
+    reopened.open_persistent_index()
+    assert not index.loaded
+
+    query = VectorQuery(
+        vectors=[cast(Vector, embeddings[10]["embedding"])],
+        k=3,
+        allowed_ids=None,
+        include_embeddings=False,
+        options=None,
+    )
+    expected = [embeddings[i]["id"] for i in (10, 9, 11)]
+    assert [r["id"] for r in reopened.query_vectors(query)[0]] == expected
+    assert index.loaded
+
+    # Preloading in the background loads the mappings and the index
+    preloaded = PersistentLocalHnswSegment(system, segment_definition)
+    index = cast(LazyIndex, preloaded._index)
+    preloaded.preload(background=True)
+    deadline = time.time() + 10
+    while not (index.loaded and preloaded._mappings_loaded):
+        assert time.time() < deadline
+        time.sleep(0.01)
+    assert [r["id"] for r in preloaded.query_vectors(query)[0]] == expected
+
+
+def test_read_snapshot(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    produce_fns: ProducerFn,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:batch_size": 10,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = PersistentLocalHnswSegment(system, segment_definition)
+    segment.start()
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=15,
+    )
+    sync(segment, seq_ids[-1])
+    snapshot = segment._read_snapshot
+    assert snapshot.count == 15 and snapshot.hnsw_count == 10
+    assert len(snapshot.written_ids) == 5
+
+    query = VectorQuery(
+        vectors=[cast(Vector, embeddings[12]["embedding"])],
+        k=3,
+        allowed_ids=None,
+        include_embeddings=False,
+        options=None,
+    )
+    expected = [embeddings[i]["id"] for i in (12, 11, 13)]
+
+    # Reads do not wait for a writer that is not changing the hnsw index
+    results: List[Sequence[Sequence[VectorQueryResult]]] = []
+    with segment._writer_lock:
+        reader = threading.Thread(
+            target=lambda: results.append(segment.query_vectors(query))
+        )
+        reader.start()
+        reader.join(timeout=10)
+        assert not reader.is_alive()
+        assert segment.count() == 15
+        assert len(segment.get_vectors([embeddings[14]["id"]])) == 1
+    assert [r["id"] for r in results[0][0]] == expected
+
+    # Buffered writes publish a new snapshot sharing the brute force buffer, rather
+    # than copying it
+    _, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=1,
+    )
+    sync(segment, seq_ids[-1])
+    snapshot_index = cast(BruteForceIndexView, snapshot.brute_force_index)
+    next_index = cast(BruteForceIndexView, segment._read_snapshot.brute_force_index)
+    assert next_index.vectors is snapshot_index.vectors
+    assert len(next_index) == 6 and len(snapshot_index) == 5
+
+    # Writes publish a new snapshot, leaving the one readers may hold unchanged
+    more_embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=10,
+    )
+    sync(segment, seq_ids[-1])
+    assert segment._read_snapshot is not snapshot
+    assert segment.count() == 26
+    assert snapshot.count == 15 and len(snapshot.written_ids) == 5
+    assert snapshot.hnsw_count == 10 and segment._read_snapshot.hnsw_count == 20
+    assert len(snapshot_index) == 5
+    assert [r["id"] for r in segment.query_vectors(query)[0]] == expected
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_quantization(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    produce_fns: ProducerFn,
+    quantization: str,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:batch_size": 10,
+        "hnsw:sync_threshold": 10,
+        "hnsw:quantization": quantization,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = PersistentLocalHnswSegment(system, segment_definition)
+    segment.start()
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=50,
+    )
+    sync(segment, seq_ids[-1])
+    query = VectorQuery(
+        vectors=[cast(Vector, embeddings[7]["embedding"])],
+        k=3,
+        allowed_ids=None,
+        include_embeddings=True,
+        options=None,
+    )
+    results = segment.query_vectors(query)[0]
+    assert results[0]["id"] == embeddings[7]["id"]
+    assert results[0]["distance"] == pytest.approx(0, abs=1e-6)
+    # Embeddings are returned at full precision
+    assert approx_equal_vector(
+        cast(Vector, results[0]["embedding"]),
+        cast(Vector, embeddings[7]["embedding"]),
+    )
+    segment.stop()
+
+    reopened = PersistentLocalHnswSegment(system, segment_definition)
+    reopened.start()
+    assert reopened.count() == 50
+    assert [r["id"] for r in reopened.query_vectors(query)[0]] == [
+        r["id"] for r in results
+    ]
+    reopened.stop()
+
+
+def test_ivf_segment(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    produce_fns: ProducerFn,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:batch_size": 10,
+        "hnsw:sync_threshold": 10,
+        "ivf:nlist": 4,
+        "ivf:nprobe": 1,
+        "ivf:train_size": 20,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = PersistentLocalIvfSegment(system, segment_definition)
+    segment.start()
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=100,
+    )
+    sync(segment, seq_ids[-1])
+    assert cast(IvfIndex, segment._index).is_trained
+
+    def query(options: Optional[Dict[str, Union[str, int, float, bool]]]) -> List[str]:
+        results = segment.query_vectors(
+            VectorQuery(
+                vectors=[cast(Vector, embeddings[50]["embedding"])],
+                k=3,
+                allowed_ids=None,
+                include_embeddings=False,
+                options=options,
+            )
+        )
+        return [r["id"] for r in results[0]]
+
+    expected = [embeddings[i]["id"] for i in (50, 49, 51)]
+    assert query(None) == expected
+    assert query({"nprobe": 4}) == expected
+    with pytest.raises(ValueError):
+        query({"nprobe": 0})
+    segment.stop()
+
+    segment = PersistentLocalIvfSegment(system, segment_definition)
+    segment.start()
+    assert segment.count() == 100
+    assert query(None) == expected
+    segment.stop()
+
+
+def test_flat_segment_promotion(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    produce_fns: ProducerFn,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:batch_size": 10,
+        "hnsw:sync_threshold": 10,
+        "flat:promotion_threshold": 50,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = PersistentLocalFlatSegment(system, segment_definition)
+    segment.start()
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=40,
+    )
+    sync(segment, seq_ids[-1])
+    assert isinstance(segment._index, FlatIndex)
+    assert not segment.is_promoted()
+
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=60,
+    )
+    sync(segment, seq_ids[-1])
+    segment._join_compaction()
+    assert isinstance(segment._index, hnswlib.Index)
+    assert segment.is_promoted()
+    assert segment.count() == 100
+
+    query = VectorQuery(
+        vectors=[cast(Vector, embeddings[30]["embedding"])],
+        k=3,
+        allowed_ids=None,
+        include_embeddings=False,
+        options=None,
+    )
+    expected = [embeddings[i]["id"] for i in (30, 29, 31)]
+    assert [r["id"] for r in segment.query_vectors(query)[0]] == expected
+    segment.stop()
+
+    reopened = PersistentLocalFlatSegment(system, segment_definition)
+    reopened.start()
+    assert reopened.is_promoted()
+    assert reopened.count() == 100
+    assert [r["id"] for r in reopened.query_vectors(query)[0]] == expected
+    assert isinstance(cast(LazyIndex, reopened._index).get(), hnswlib.Index)
+    reopened.stop()
+
+
+def test_compaction(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    vector_reader: Type[VectorReader],
+    produce_fns: ProducerFn,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = cast(LocalHnswSegment, vector_reader(system, segment_definition))
+    segment.start()
+
+    embeddings, seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=sample_embeddings,
+        n=200,
+    )
+    deletes = [
+        OperationRecord(
+            id=e["id"],
+            embedding=None,
+            encoding=None,
+            metadata=None,
+            operation=Operation.DELETE,
+        )
+        for e in embeddings[:100]
+    ]
+    _, delete_seq_ids = produce_fns(
+        producer=producer,
+        collection_id=collection_id,
+        embeddings=iter(deletes),
+        n=len(deletes),
+    )
+    sync(segment, delete_seq_ids[-1])
+    assert segment.deleted_ratio() == 0.5
+
+    # Writes made while the compacted index is being built are replayed onto it
+    changes = [
+        OperationRecord(
+            id=embeddings[100]["id"],
+            embedding=None,
+            encoding=None,
+            metadata=None,
+            operation=Operation.DELETE,
+        ),
+        OperationRecord(
+            id=embeddings[101]["id"],
+            embedding=[500.0, 500.0],
+            encoding=ScalarEncoding.FLOAT32,
+            metadata=None,
+            operation=Operation.UPDATE,
+        ),
+        OperationRecord(
+            id="new_embedding",
+            embedding=[1000.0, 1000.0],
+            encoding=ScalarEncoding.FLOAT32,
+            metadata=None,
+            operation=Operation.ADD,
+        ),
+    ]
+    init_compacted_index = segment._init_compacted_index
+
+    def write_during_rebuild(dimensionality: int, n: int) -> hnswlib.Index:
+        _, change_seq_ids = produce_fns(
+            producer=producer,
+            collection_id=collection_id,
+            embeddings=iter(changes),
+            n=len(changes),
+        )
+        sync(segment, change_seq_ids[-1])
+        return init_compacted_index(dimensionality, n)
+
+    monkeypatch.setattr(segment, "_init_compacted_index", write_during_rebuild)
+    segment.compact()
+    monkeypatch.undo()
+
+    def check(segment: LocalHnswSegment) -> None:
+        assert segment.count() == 100
+        if isinstance(segment, PersistentLocalHnswSegment):
+            segment._ensure_mappings_loaded()
+        assert max(segment._id_labels.labels()) <= 101
+
+        query = VectorQuery(
+            vectors=[[500.0, 500.0], [1000.0, 1000.0], [0.0, 0.0]],
+            k=1,
+            allowed_ids=None,
+            options=None,
+            include_embeddings=False,
+        )
+        results = segment.query_vectors(query)
+        assert [r[0]["id"] for r in results] == [
+            embeddings[101]["id"],
+            "new_embedding",
+            embeddings[102]["id"],
+        ]
+        assert segment.get_vectors(ids=[embeddings[0]["id"]]) == []
+        assert segment.get_vectors(ids=[embeddings[100]["id"]]) == []
+        vectors = segment.get_vectors(ids=[embeddings[150]["id"]])
+        assert approx_equal_vector(
+            vectors[0]["embedding"], cast(Vector, embeddings[150]["embedding"])
+        )
+
+    check(segment)
+    if isinstance(segment, PersistentLocalHnswSegment):
+        assert not os.path.exists(segment._get_compaction_folder())
+        assert not os.path.exists(segment._get_replaced_folder())
+        segment.stop()
+        reopened = type(segment)(system, segment_definition)
+        reopened.start()
+        sync(reopened, segment.max_seqid())
+        check(reopened)
+        reopened.stop()
+    else:
+        assert segment.deleted_ratio() < 0.02
+        segment.stop()
+
+
+def test_compaction_threshold(
+    system: System,
+    sample_embeddings: Iterator[OperationRecord],
+    vector_reader: Type[VectorReader],
+) -> None:
+    producer = system.instance(Producer)
+    system.reset_state()
+    segment_definition = create_random_segment_definition()
+    segment_definition["metadata"] = {
+        **(segment_definition["metadata"] or {}),
+        "hnsw:compaction_threshold": 0.5,
+    }
+    collection_id = cast(uuid.UUID, segment_definition["collection"])
+
+    segment = cast(LocalHnswSegment, vector_reader(system, segment_definition))
+    segment.start()
+
+    embeddings = [next(sample_embeddings) for _ in range(1000)]
+    producer.submit_embeddings(collection_id, embeddings)
+    deletes = [
+        OperationRecord(
+            id=e["id"],
+            embedding=None,
+            encoding=None,
+            metadata=None,
+            operation=Operation.DELETE,
+        )
+        for e in embeddings[:600]
+    ]
+    seq_ids = producer.submit_embeddings(collection_id, deletes)
+    sync(segment, seq_ids[-1])
+
+    assert segment._compaction_thread is not None
+    segment._compaction_thread.join()
+    # Deletes that arrive during the compaction are replayed as tombstones
+    assert segment.deleted_ratio() < 0.5
+    assert cast(hnswlib.Index, segment._index).element_count < 1000
+    assert segment.count() == 400
+    segment.stop()
+
+
 def test_reset_state_ignored_for_allow_reset_false(
     system: System,
     sample_embeddings: Iterator[OperationRecord],
@@ -6,7 +6,10 @@ from urllib3.connectionpool import InsecureRequestWarning
 import chromadb
 from chromadb.api.fastapi import FastAPI
 from chromadb.api.types import QueryResult, EmbeddingFunction, Document
-from chromadb.config import Settings
+from chromadb.api import ServerAPI
+from chromadb.config import Settings, System
+from chromadb.segment import SegmentManager, VectorReader
+from chromadb.types import SegmentScope
 from chromadb.errors import InvalidCollectionException
 import chromadb.server.fastapi
 import pytest
@@ -98,6 +101,140 @@ def test_persist_index_loading(api_fixture, request):
             assert nn[key] is None
 
 
+@pytest.mark.parametrize("api_fixture", [local_persist_api])
+def test_ivf_collection(api_fixture, request):
+    api = request.getfixturevalue("local_persist_api")
+    api.reset()
+    collection = api.create_collection(
+        "test", metadata={"ivf:nlist": 4, "ivf:train_size": 20}
+    )
+    ids = [str(i) for i in range(100)]
+    collection.add(ids=ids, embeddings=[[float(i), float(i)] for i in range(100)])
+    nn = collection.query(query_embeddings=[[50.2, 50.2]], n_results=2)
+    assert nn["ids"] == [["50", "51"]]
+
+    api2 = request.getfixturevalue("local_persist_api_cache_bust")
+    collection = api2.get_collection("test")
+    nn = collection.query(query_embeddings=[[50.2, 50.2]], n_results=2)
+    assert nn["ids"] == [["50", "51"]]
+
+
+def test_flat_collection_promotion():
+    save_path = tempfile.mkdtemp()
+    client = chromadb.Client(
+        Settings(
+            allow_reset=True,
+            is_persistent=True,
+            persist_directory=save_path,
+            chroma_flat_segment_promotion_threshold=20,
+        ),
+    )
+    client.reset()
+    collection = client.create_collection("test")
+    ids = [str(i) for i in range(50)]
+    for start in range(0, 50, 10):
+        collection.add(
+            ids=ids[start : start + 10],
+            embeddings=[[float(i), float(i)] for i in range(start, start + 10)],
+        )
+    nn = collection.query(query_embeddings=[[30.2, 30.2]], n_results=2)
+    assert nn["ids"] == [["30", "31"]]
+    client.clear_system_cache()
+    shutil.rmtree(save_path, ignore_errors=True)
+
+
+def test_warmup():
+    save_path = tempfile.mkdtemp()
+    settings = Settings(
+        allow_reset=True,
+        is_persistent=True,
+        persist_directory=save_path,
+        chroma_warmup_recent_collections=1,
+    )
+    system = System(settings)
+    api = system.instance(ServerAPI)
+    system.start()
+    collections = {}
+    for name in ["aaa", "bbb", "ccc"]:
+        collections[name] = api.create_collection(
+            name, metadata={"hnsw:batch_size": 10, "hnsw:sync_threshold": 10}
+        )
+        collections[name].add(
+            ids=[str(i) for i in range(20)],
+            embeddings=[[float(i), float(i)] for i in range(20)],
+        )
+    api.get_collection("ccc").count()
+    system.stop()
+
+    # ccc was used last, and bbb is configured by name
+    system = System(
+        Settings(**{**settings.dict(), "chroma_warmup_collections": ["bbb"]})
+    )
+    system.instance(ServerAPI)
+    system.start()
+    manager = system.instance(SegmentManager)
+    manager._warmup.wait()
+    assert manager.warmup_progress() == {
+        "total": 2,
+        "loaded": 2,
+        "failed": 0,
+        "done": True,
+    }
+    warmed_up = set(manager.segment_cache[SegmentScope.VECTOR].cache)
+    assert warmed_up == {collections["bbb"].id, collections["ccc"].id}
+    vector_segment = manager.get_segment(collections["ccc"].id, VectorReader)
+    assert vector_segment._index.loaded
+    system.stop()
+    shutil.rmtree(save_path, ignore_errors=True)
+
+
+def test_query_cache():
+    system = System(Settings(allow_reset=True, chroma_query_cache_size=2))
+    api = system.instance(ServerAPI)
+    system.start()
+    collection = api.create_collection("test_query_cache")
+    collection.add(**records)
+
+    first = collection.query(
+        query_embeddings=[0, 0, 0],
+        n_results=2,
+        include=["metadatas", "embeddings"],
+    )
+    first["ids"][0].append("changed")
+    first["metadatas"][0][0]["int_value"] = 100
+    first["embeddings"][0][0][0] = 100
+    second = collection.query(
+        query_embeddings=[0, 0, 0],
+        n_results=2,
+        include=["metadatas", "embeddings"],
+    )
+    assert second["ids"] == [["id1", "id2"]]
+    assert second["metadatas"][0][0]["int_value"] == 1
+    assert second["embeddings"][0][0][0] == 0
+    assert api.query_cache_stats() == {"hits": 1, "misses": 1, "size": 1}
+    # Results returned by hits are copies too
+    second["metadatas"][0][0]["int_value"] = 100
+    third = collection.query(
+        query_embeddings=[0, 0, 0],
+        n_results=2,
+        include=["metadatas", "embeddings"],
+    )
+    assert third["metadatas"][0][0]["int_value"] == 1
+    assert api.query_cache_stats() == {"hits": 2, "misses": 1, "size": 1}
+
+    # Queries that differ in any argument are cached apart
+    collection.query(query_embeddings=[0, 0, 0], n_results=1)
+    collection.query(query_embeddings=[0, 0, 0], n_results=2, where={"int_value": 1})
+    assert api.query_cache_stats() == {"hits": 2, "misses": 3, "size": 2}
+
+    # A write makes the cached results stale
+    collection.update(ids=["id1"], metadatas=[{"int_value": 5}])
+    items = collection.query(query_embeddings=[0, 0, 0], n_results=1)
+    assert items["metadatas"][0][0]["int_value"] == 5
+    assert api.query_cache_stats()["hits"] == 2
+    system.stop()
+
+
 @pytest.mark.parametrize("api_fixture", [local_persist_api])
 def test_persist_index_loading_embedding_function(api_fixture, request):
     class TestEF(EmbeddingFunction[Document]):
@@ -306,6 +443,22 @@ def test_reset_db(api):
     assert len(api.list_collections()) == 0
 
 
+def test_compact_collection(api):
+    api.reset()
+    collection = api.create_collection("testspace")
+    ids = [str(i) for i in range(10)]
+    collection.add(ids=ids, embeddings=[[float(i), float(i)] for i in range(10)])
+    collection.delete(ids=ids[:5])
+
+    api.compact_collection("testspace")
+    assert collection.count() == 5
+    nn = collection.query(query_embeddings=[[0.0, 0.0]], n_results=1)
+    assert nn["ids"] == [["5"]]
+
+    with pytest.raises(Exception):
+        api.compact_collection("missing")
+
+
 def test_get_nearest_neighbors(api):
     api.reset()
     collection = api.create_collection("testspace")
@@ -879,6 +1032,9 @@ def test_query_document_valid_operators(api):
     with pytest.raises(ValueError, match="where document"):
         collection.get(where_document={"$contains": []})
 
+    with pytest.raises(ValueError, match="where document"):
+        collection.get(where_document={"$match": "   "})
+
     # Test invalid $and, $or
     with pytest.raises(ValueError):
         collection.get(where_document={"$and": {"$unsupported": "doc"}})
@@ -1187,6 +1343,52 @@ def test_query_order(api):
     assert items["documents"][0][1] == "this document is first"
 
 
+def test_query_max_distance(api):
+    api.reset()
+    collection = api.create_collection("test_query_max_distance")
+    collection.add(**records)
+
+    # id2 is at a squared l2 distance of about 16.7 from the origin
+    items = collection.query(query_embeddings=[0, 0, 0], n_results=2, max_distance=10)
+    assert items["ids"] == [["id1"]]
+    assert items["documents"] == [["this document is first"]]
+
+    items = collection.query(
+        query_embeddings=[[0, 0, 0], [1.2, 2.24, 3.2]], n_results=2, max_distance=20
+    )
+    assert items["ids"] == [["id1", "id2"], ["id2", "id1"]]
+
+    items = collection.query(query_embeddings=[0, 0, 0], max_distance=-1)
+    assert items["ids"] == [[]]
+
+    with pytest.raises(ValueError):
+        collection.query(query_embeddings=[0, 0, 0], max_distance="10")
+
+
+def test_get_after(api):
+    api.reset()
+    collection = api.create_collection("test_get_after")
+    ids = [f"id{i}" for i in range(7)]
+    collection.add(ids=ids, embeddings=[[i, i, i] for i in range(7)])
+
+    pages = [collection.get(limit=3)]
+    while pages[-1]["next_cursor"] is not None:
+        pages.append(collection.get(limit=3, after=pages[-1]["next_cursor"]))
+    assert [page["ids"] for page in pages] == [ids[:3], ids[3:6], ids[6:]]
+
+    # The last full page has a cursor, after which there is nothing
+    pages = [collection.get(limit=4)]
+    pages.append(collection.get(limit=4, after=pages[0]["next_cursor"]))
+    assert pages[1]["ids"] == ids[4:]
+    assert pages[1]["next_cursor"] is None
+    assert collection.get()["next_cursor"] is None
+
+    with pytest.raises(Exception):
+        collection.get(limit=3, after="not a cursor")
+    with pytest.raises(Exception):
+        collection.get(limit=4, after="!!!")
+
+
 # test to make sure add, get, delete error on invalid id input
 
 
@@ -1,7 +1,21 @@
+import multiprocessing
+import shutil
+import tempfile
+from typing import cast
+
+import hnswlib
 from typer.testing import CliRunner
 
+from chromadb.api import ServerAPI
+from chromadb.api.client import SharedSystemClient
 from chromadb.cli.cli import app
 from chromadb.cli.utils import set_log_file_path
+from chromadb.config import Settings, System
+from chromadb.segment import SegmentManager, VectorReader
+from chromadb.segment.impl.vector.local_persistent_hnsw import (
+    PersistentLocalHnswSegment,
+)
+from chromadb.test.conftest import _await_server, _run_server, find_free_port
 
 runner = CliRunner()
 
@@ -25,3 +39,56 @@ def test_app() -> None:
 def test_utils_set_log_file_path() -> None:
     log_config = set_log_file_path("chromadb/log_config.yml", "test.log")
     assert log_config["handlers"]["file"]["filename"] == "test.log"
+
+
+def test_compact() -> None:
+    # The CLI asks the server serving the persist directory to compact it
+    path = tempfile.mkdtemp()
+    port = find_free_port()
+    ctx = multiprocessing.get_context("spawn")
+    proc = ctx.Process(
+        target=_run_server,
+        args=(port, True, path),
+        daemon=True,
+    )
+    proc.start()
+    system = System(
+        Settings(
+            chroma_api_impl="chromadb.api.fastapi.FastAPI",
+            chroma_server_host="localhost",
+            chroma_server_http_port=port,
+        )
+    )
+    api = system.instance(ServerAPI)
+    system.start()
+    _await_server(api)
+    collection = api.create_collection(
+        "test_compact", metadata={"hnsw:batch_size": 10, "hnsw:sync_threshold": 10}
+    )
+    ids = [str(i) for i in range(20)]
+    collection.add(ids=ids, embeddings=[[float(i), float(i)] for i in range(20)])
+    collection.delete(ids=ids[:10])
+
+    result = runner.invoke(
+        app, ["compact", "test_compact", "--port", str(port)], catch_exceptions=False
+    )
+    assert result.exit_code == 0, result.stdout
+    assert "test_compact" in result.stdout
+    assert collection.count() == 10
+    system.stop()
+    proc.kill()
+    proc.join()
+
+    # The index written by the server no longer holds the deleted embeddings
+    system = System(Settings(is_persistent=True, persist_directory=path))
+    system.instance(ServerAPI)
+    system.start()
+    segment = cast(
+        PersistentLocalHnswSegment,
+        system.instance(SegmentManager).get_segment(collection.id, VectorReader),
+    )
+    assert segment.deleted_ratio() == 0
+    assert cast(hnswlib.Index, segment._index).element_count == 10
+    system.stop()
+    SharedSystemClient.clear_system_cache()
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from chromadb.utils.read_write_lock import ReadRWLock, ReadWriteLock, WriteRWLock
+
+
+def test_readers_share_and_writer_excludes() -> None:
+    lock = ReadWriteLock()
+    assert lock.acquire_read()
+    assert lock.acquire_read()
+    assert lock.stats()["readers"] == 2
+    # Another thread cannot write while the reads are held
+    results = []
+    writer = threading.Thread(target=lambda: results.append(lock.acquire_write(0.05)))
+    writer.start()
+    writer.join()
+    assert results == [False]
+    lock.release_read()
+    lock.release_read()
+
+    with WriteRWLock(lock):
+        # The writer may lock again, for reading or writing
+        with ReadRWLock(lock), WriteRWLock(lock):
+            pass
+        reader = threading.Thread(
+            target=lambda: results.append(lock.acquire_read(0.05))
+        )
+        reader.start()
+        reader.join()
+    assert results == [False, False]
+    stats = lock.stats()
+    assert stats["readers"] == 0 and stats["writer"] == 0
+    assert stats["timeouts"] == 2
+
+
+def test_writer_preferred() -> None:
+    lock = ReadWriteLock()
+    lock.acquire_read()
+    writer_waiting = threading.Event()
+    order = []
+
+    def write() -> None:
+        writer_waiting.set()
+        with WriteRWLock(lock):
+            order.append("writer")
+
+    def read() -> None:
+        with ReadRWLock(lock):
+            order.append("reader")
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer_waiting.wait()
+    while lock.stats()["waiting_writers"] == 0:
+        pass
+    reader = threading.Thread(target=read)
+    reader.start()
+
+    # New readers wait behind the waiting writer, but a thread already holding a
+    # read lock may acquire it again
+    def read_with_timeout() -> None:
+        with pytest.raises(TimeoutError):
+            with ReadRWLock(lock, timeout=0.05):
+                pass
+
+    timed_out = threading.Thread(target=read_with_timeout)
+    timed_out.start()
+    timed_out.join()
+    assert lock.acquire_read(timeout=0)
+    lock.release_read()
+    assert order == []
+
+    lock.release_read()
+    writer.join()
+    reader.join()
+    assert order == ["writer", "reader"]
+    assert lock.stats()["max_write_wait_seconds"] > 0
+
+
+def test_upgrade_raises() -> None:
+    lock = ReadWriteLock()
+    with ReadRWLock(lock):
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    assert lock.acquire_write(timeout=0)
+    lock.release_write()
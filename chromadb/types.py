@@ -1,6 +1,6 @@
 from typing import Optional, Union, Sequence, Dict, Mapping, List
 
-from typing_extensions import Literal, TypedDict, TypeVar
+from typing_extensions import Literal, NotRequired, TypedDict, TypeVar
 from uuid import UUID
 from enum import Enum
 
@@ -105,6 +105,8 @@ class VectorQuery(TypedDict):
     allowed_ids: Optional[Sequence[str]]
     include_embeddings: bool
     options: Optional[Dict[str, Union[str, int, float, bool]]]
+    # Only results within this distance of their query vector are returned
+    max_distance: NotRequired[Optional[float]]
 
 
 class VectorQueryResult(TypedDict):
@@ -137,7 +139,11 @@ Where = Dict[
 ]
 
 WhereDocumentOperator = Union[
-    Literal["$contains"], Literal["$not_contains"], LogicalOperator
+    Literal["$contains"],
+    Literal["$not_contains"],
+    Literal["$match"],
+    Literal["$phrase"],
+    LogicalOperator,
 ]
 WhereDocument = Dict[WhereDocumentOperator, Union[str, List["WhereDocument"]]]
 
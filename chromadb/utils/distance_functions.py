@@ -1,18 +1,22 @@
 """
 These functions match what the spec of hnswlib is.
 """
+from typing import Any, Optional, Tuple
+
 import numpy as np
+import numpy.typing as npt
 from numpy.typing import ArrayLike
 
+# This epsilon is used to prevent division by zero, and the value is the same
+# https://github.com/nmslib/hnswlib/blob/359b2ba87358224963986f709e593d799064ace6/python_bindings/bindings.cpp#L238
+NORM_EPS = 1e-30
+
 
 def l2(x: ArrayLike, y: ArrayLike) -> float:
     return np.linalg.norm(x - y) ** 2
 
 
 def cosine(x: ArrayLike, y: ArrayLike) -> float:
-    # This epsilon is used to prevent division by zero, and the value is the same
-    # https://github.com/nmslib/hnswlib/blob/359b2ba87358224963986f709e593d799064ace6/python_bindings/bindings.cpp#L238
-    NORM_EPS = 1e-30
     return 1 - np.dot(x, y) / (
         (np.linalg.norm(x) + NORM_EPS) * (np.linalg.norm(y) + NORM_EPS)
     )
@@ -20,3 +24,58 @@ def cosine(x: ArrayLike, y: ArrayLike) -> float:
 
 def ip(x: ArrayLike, y: ArrayLike) -> float:
     return 1 - np.dot(x, y)
+
+
+def pairwise(
+    space: str,
+    queries: npt.NDArray[Any],
+    vectors: npt.NDArray[Any],
+    vector_norms: Optional[npt.NDArray[Any]] = None,
+) -> npt.NDArray[Any]:
+    """Compute the (n_queries, n_vectors) matrix of distances in the given space with
+    a single matrix product. The norms of the vectors may be passed in if they are
+    already known. The expanded l2 form loses precision to cancellation for
+    near-identical vectors, especially in float32."""
+    dots = queries @ vectors.T
+    if space == "ip":
+        return 1 - dots
+    if vector_norms is None:
+        vector_norms = np.linalg.norm(vectors, axis=1)
+    if space == "cosine":
+        query_norms = np.linalg.norm(queries, axis=1) + NORM_EPS
+        return 1 - dots / np.outer(query_norms, vector_norms + NORM_EPS)
+    if space == "l2":
+        # |q - v|^2 = |q|^2 + |v|^2 - 2 q.v
+        query_sq_norms = np.einsum("ij,ij->i", queries, queries)
+        return query_sq_norms[:, None] + np.square(vector_norms)[None, :] - 2 * dots
+    raise ValueError(f"Unknown distance function: {space}")
+
+
+def top_k(
+    distances: npt.NDArray[Any], k: int
+) -> Tuple[npt.NDArray[np.intp], npt.NDArray[Any]]:
+    """Return the column indices and values of the k smallest distances in each row of
+    a distance matrix, sorted in ascending order. Only the selected k are sorted."""
+    n_rows, n_columns = distances.shape
+    k = min(k, n_columns)
+    if k < n_columns:
+        indices = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.broadcast_to(np.arange(n_columns), (n_rows, n_columns))
+    values = np.take_along_axis(distances, indices, axis=1)
+    order = np.argsort(values, axis=1, kind="stable")
+    return (
+        np.take_along_axis(indices, order, axis=1),
+        np.take_along_axis(values, order, axis=1),
+    )
+
+
+def within_distance(
+    sorted_distances: npt.NDArray[Any], max_distance: Optional[float]
+) -> npt.NDArray[np.intp]:
+    """Return how many of the leading distances of each row of an ascending distance
+    matrix lie within max_distance, or the full row length if there is no limit."""
+    n_rows, n_columns = sorted_distances.shape
+    if max_distance is None:
+        return np.full(n_rows, n_columns, dtype=np.intp)
+    return np.count_nonzero(sorted_distances <= max_distance, axis=1)
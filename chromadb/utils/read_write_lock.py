@@ -1,53 +1,134 @@
 import threading
+import time
 from types import TracebackType
-from typing import Optional, Type
+from typing import Dict, Optional, Type, Union
 
 
 class ReadWriteLock:
     """A lock object that allows many simultaneous "read locks", but
-    only one "write lock." """
+    only one "write lock."
+
+    Writers are preferred: once a writer is waiting, new readers wait behind it, so
+    a steady stream of readers cannot starve writers. A thread may acquire a read
+    lock it already holds again, and the writer may acquire either lock again.
+    Acquisitions take an optional timeout, and the lock keeps contention metrics."""
 
     def __init__(self) -> None:
-        self._read_ready = threading.Condition(threading.RLock())
+        self._cond = threading.Condition(threading.Lock())
         self._readers = 0
+        self._writer: Optional[int] = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        # The read locks held by the current thread
+        self._held = threading.local()
+
+        self._read_acquisitions = 0
+        self._write_acquisitions = 0
+        self._read_wait_seconds = 0.0
+        self._write_wait_seconds = 0.0
+        self._max_write_wait_seconds = 0.0
+        self._timeouts = 0
 
-    def acquire_read(self) -> None:
-        """Acquire a read lock. Blocks only if a thread has
-        acquired the write lock."""
-        self._read_ready.acquire()
-        try:
+    def acquire_read(self, timeout: Optional[float] = None) -> bool:
+        """Acquire a read lock. Blocks while a thread holds or waits for the write
+        lock, for at most timeout seconds if given. Returns whether the lock was
+        acquired."""
+        me = threading.get_ident()
+        held = getattr(self._held, "reads", 0)
+        with self._cond:
+            if held == 0 and self._writer != me and not self._can_read():
+                start = time.perf_counter()
+                acquired = self._cond.wait_for(self._can_read, timeout)
+                self._read_wait_seconds += time.perf_counter() - start
+                if not acquired:
+                    self._timeouts += 1
+                    return False
             self._readers += 1
-        finally:
-            self._read_ready.release()
+            self._read_acquisitions += 1
+        self._held.reads = held + 1
+        return True
 
     def release_read(self) -> None:
         """Release a read lock."""
-        self._read_ready.acquire()
-        try:
+        with self._cond:
             self._readers -= 1
-            if not self._readers:
-                self._read_ready.notify_all()
-        finally:
-            self._read_ready.release()
-
-    def acquire_write(self) -> None:
-        """Acquire a write lock. Blocks until there are no
-        acquired read or write locks."""
-        self._read_ready.acquire()
-        while self._readers > 0:
-            self._read_ready.wait()
+            if self._readers == 0:
+                self._cond.notify_all()
+        self._held.reads -= 1
+
+    def acquire_write(self, timeout: Optional[float] = None) -> bool:
+        """Acquire a write lock. Blocks until there are no acquired read or write
+        locks, for at most timeout seconds if given. Returns whether the lock was
+        acquired."""
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                self._write_acquisitions += 1
+                return True
+            if getattr(self._held, "reads", 0) > 0:
+                raise RuntimeError(
+                    "Cannot acquire a write lock while holding a read lock"
+                )
+            if not self._can_write():
+                self._waiting_writers += 1
+                start = time.perf_counter()
+                try:
+                    acquired = self._cond.wait_for(self._can_write, timeout)
+                finally:
+                    self._waiting_writers -= 1
+                waited = time.perf_counter() - start
+                self._write_wait_seconds += waited
+                self._max_write_wait_seconds = max(self._max_write_wait_seconds, waited)
+                if not acquired:
+                    self._timeouts += 1
+                    # Readers held back by this writer may go ahead
+                    self._cond.notify_all()
+                    return False
+            self._writer = me
+            self._writer_depth = 1
+            self._write_acquisitions += 1
+            return True
 
     def release_write(self) -> None:
         """Release a write lock."""
-        self._read_ready.release()
+        with self._cond:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """The current holders and waiters of the lock, and how many times and for
+        how long in total it was waited for"""
+        with self._cond:
+            return {
+                "readers": self._readers,
+                "writer": int(self._writer is not None),
+                "waiting_writers": self._waiting_writers,
+                "read_acquisitions": self._read_acquisitions,
+                "write_acquisitions": self._write_acquisitions,
+                "read_wait_seconds": self._read_wait_seconds,
+                "write_wait_seconds": self._write_wait_seconds,
+                "max_write_wait_seconds": self._max_write_wait_seconds,
+                "timeouts": self._timeouts,
+            }
+
+    def _can_read(self) -> bool:
+        return self._writer is None and self._waiting_writers == 0
+
+    def _can_write(self) -> bool:
+        return self._writer is None and self._readers == 0
 
 
 class ReadRWLock:
-    def __init__(self, rwLock: ReadWriteLock):
+    def __init__(self, rwLock: ReadWriteLock, timeout: Optional[float] = None):
         self.rwLock = rwLock
+        self.timeout = timeout
 
     def __enter__(self) -> None:
-        self.rwLock.acquire_read()
+        if not self.rwLock.acquire_read(self.timeout):
+            raise TimeoutError(f"Timed out acquiring a read lock after {self.timeout}s")
 
     def __exit__(
         self,
@@ -59,11 +140,15 @@ class ReadRWLock:
 
 
 class WriteRWLock:
-    def __init__(self, rwLock: ReadWriteLock):
+    def __init__(self, rwLock: ReadWriteLock, timeout: Optional[float] = None):
         self.rwLock = rwLock
+        self.timeout = timeout
 
     def __enter__(self) -> None:
-        self.rwLock.acquire_write()
+        if not self.rwLock.acquire_write(self.timeout):
+            raise TimeoutError(
+                f"Timed out acquiring a write lock after {self.timeout}s"
+            )
 
     def __exit__(
         self,